@@ -1,5 +1,7 @@
 import streamlit as st
 import os
+import subprocess
+from collections import deque
 from pathlib import Path
 
 # Import our modules
@@ -7,12 +9,45 @@ from pathlib import Path
 import sys
 sys.path.append(str(Path(__file__).parent))
 
-from src.ingest import load_shortcodes, download_post
-from src.processor import process_pipeline
-from src.rag_db import ingest_document, query_similar, document_exists
+# Only light modules at import time: Streamlit reruns this script on every
+# interaction, so models and pipeline-only dependencies are loaded on first use
+from src.rag_db import query_similar, get_collection, build_filter, reopen
+from src import manifest, query_cache, metrics, rerank, thumbnails
+from src.context import pack_context, build_prompt, CONTEXT_TOKEN_BUDGET
+
+OLLAMA_MODEL = "llama3.2"
+OPENAI_MODEL = "gpt-4o-mini"
+PIPELINE_LOG = "data/pipeline.log"
 
 st.set_page_config(page_title="InstaRAG", layout="wide")
 
+@st.cache_resource(show_spinner="Loading search index...", max_entries=1)
+def load_collection(version):
+    # Opens Chroma and the MiniLM embedding model once per server process, and
+    # Chroma again whenever the pipeline (a separate process) has indexed new posts
+    reopen()
+    return get_collection()
+
+@st.cache_resource(show_spinner=False)
+def load_llm(provider, api_key=""):
+    # LLM clients are reused across queries instead of rebuilt on every rerun
+    if provider == "Ollama (Local)":
+        from langchain_community.chat_models import ChatOllama
+        # We'll use a small model - assuming user has pulled it. 
+        return ChatOllama(model=OLLAMA_MODEL, base_url="http://localhost:11434")
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model=OPENAI_MODEL, api_key=api_key)
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def metrics_summary(stamp):
+    # Re-read only when data/metrics.jsonl has changed (stamp = its mtime and size)
+    return metrics.summarize(metrics.load()) if stamp else []
+
+@st.cache_resource(show_spinner="Loading re-ranker...")
+def load_reranker():
+    # Loaded outside the re-ranking time budget
+    return rerank.get_reranker()
+
 st.title("Instagram Saved Posts RAG")
 
 # Sidebar for controls
@@ -21,42 +56,54 @@ with st.sidebar:
     
     json_path = st.text_input("Path to saved_posts.json", "saved_posts.json")
     
-    if st.button("Run Pipeline (Ingest -> Process -> Index)"):
+    # Ingestion runs as a separate process (python -m src.pipeline run), so it keeps
+    # going when the tab closes and this app stays a query-only front end
+    running = manifest.running_pid()
+    if running:
+        st.info(f"Pipeline running (pid {running})")
+        st.button("Refresh")
+    elif st.button("Run Pipeline (Ingest -> Process -> Index)"):
         if not os.path.exists(json_path):
             st.error(f"File not found: {json_path}")
         else:
-            with st.status("Running Pipeline...", expanded=True) as status:
-                st.write("Parsing JSON...")
-                shortcodes = load_shortcodes(json_path)
-                st.write(f"Found {len(shortcodes)} posts.")
-                
-                progress_bar = st.progress(0)
-                for i, code in enumerate(shortcodes):
-                    st.write(f"Processing {code}...")
-                    
-                    # Optimization: Skip if already in DB (and we assume raw data is there too)
-                    if document_exists(code):
-                         st.info(f"Skipping {code} (Already indexed)")
-                         progress_bar.progress((i + 1) / len(shortcodes))
-                         continue
-
-                    # 1. Download
-                    download_post(code)
-                    
-                    # 2. Process
-                    result = process_pipeline(code)
-                    
-                    # 3. Index
-                    if result:
-                        ingest_document(
-                            result['shortcode'], 
-                            result['content'], 
-                            result['image_path']
-                        )
-                    
-                    progress_bar.progress((i + 1) / len(shortcodes))
-                    
-                status.update(label="Pipeline Completed!", state="complete", expanded=False)
+            Path(PIPELINE_LOG).parent.mkdir(parents=True, exist_ok=True)
+            # The run replaces the log itself once it holds the lock; until then
+            # (or if another run holds it) its output is appended
+            with open(PIPELINE_LOG, 'a') as log:
+                subprocess.Popen(
+                    [sys.executable, "-u", "-m", "src.pipeline", "run", "--export", json_path,
+                     "--log", PIPELINE_LOG],
+                    env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+                    stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+                )
+            st.success("Pipeline started in the background.")
+            st.button("Refresh")
+
+    counts = manifest.summary()
+    if any(counts.values()):
+        st.caption(" | ".join(f"{state}: {count}" for state, count in counts.items()))
+    if os.path.exists(PIPELINE_LOG):
+        with st.expander("Pipeline log"):
+            with open(PIPELINE_LOG, 'r', encoding='utf-8', errors='replace') as f:
+                st.code("".join(deque(f, maxlen=30)))
+    failed = manifest.failures()
+    if failed and not running:
+        with st.expander(f"{len(failed)} failed posts (retried on next run)"):
+            st.text("\n".join(f"{code}: {reason}" for code, reason in failed))
+
+    with st.expander("Performance"):
+        # Written by every stage into data/metrics.jsonl, see src/metrics.py
+        rows = metrics_summary(metrics.stamp())
+        if rows:
+            st.dataframe(rows, hide_index=True)
+        else:
+            st.caption("No timings recorded yet.")
+
+    st.header("Search Filters")
+    # Narrowing the candidates happens inside the vector search, before ranking
+    filter_collections = st.multiselect("Collections", manifest.collections())
+    filter_years = st.multiselect("Saved in", manifest.years())
+    filter_kinds = st.multiselect("Type", ["reel", "post", "tv"])
 
     st.header("AI Settings")
     llm_provider = st.radio("Model Provider", ["Ollama (Local)", "OpenAI (Cloud)"])
@@ -64,100 +111,110 @@ with st.sidebar:
     openai_api_key = ""
     if llm_provider == "OpenAI (Cloud)":
         openai_api_key = st.text_input("OpenAI API Key", type="password")
+    
+    context_budget = st.number_input("Context budget (tokens)", min_value=500, max_value=32000,
+                                     value=CONTEXT_TOKEN_BUDGET, step=500,
+                                     help="Retrieved posts are trimmed to fit; fewer tokens = faster, cheaper summaries.")
+    use_summary_cache = st.checkbox("Reuse cached AI summaries", value=True,
+                                    help="Same query, same retrieved posts and same model return the stored answer.")
+    use_rerank = st.checkbox("Re-rank posts", value=False,
+                             help=f"Score {rerank.RERANK_CANDIDATES} candidates with a local cross-encoder "
+                                  "and send only the best ones to the AI.")
+    if use_rerank:
+        rerank_top_k = st.number_input("Posts kept after re-ranking", min_value=1, max_value=15,
+                                       value=rerank.RERANK_TOP_K)
+        rerank_budget = st.number_input("Re-ranking time limit (s)", min_value=0.1, max_value=30.0,
+                                        value=rerank.RERANK_BUDGET_SECONDS, step=0.5,
+                                        help="Slower than this and the posts keep their search order.")
 
 # Main Search Interface
 # Main Search Interface
 query = st.text_input("Ask a question about your saved posts:", placeholder="Which movie should I watch today?")
 
 if query:
+    load_collection(query_cache.collection_version())
+    
     # Increase recall: Fetch more results (15) to ensure we capture all relevant content
-    results = query_similar(query, n_results=15)
+    results = query_similar(
+        query, n_results=rerank.RERANK_CANDIDATES if use_rerank else 15,
+        where=build_filter(filter_collections, filter_years, filter_kinds)
+    )
+    if use_rerank:
+        load_reranker()
+        results = rerank.rerank(query, results, top_k=rerank_top_k, budget=rerank_budget)
     
     ids = results['ids'][0]
     docs = results['documents'][0]
     metadatas = results['metadatas'][0]
     distances = results['distances'][0]
     
-    # helper to check if model is available
-    try:
-        from langchain_community.chat_models import ChatOllama
-        from langchain_openai import ChatOpenAI
-        from langchain.schema import HumanMessage, SystemMessage
+    # Summary goes above the posts, but the posts are rendered first so they
+    # show up immediately while the LLM is still working
+    summary_area = st.container()
+    
+    st.divider()
+    st.subheader(f"Retrieved Posts ({len(ids)})")
+    st.caption("These are the most similar posts found in your library.")
+    
+    for i in range(len(ids)):
+        c_id = ids[i]
+        c_doc = docs[i]
+        c_meta = metadatas[i]
         
-        llm = None
-        if llm_provider == "Ollama (Local)":
-            # We'll use a small model - assuming user has pulled it. 
-            llm = ChatOllama(model="llama3.2", base_url="http://localhost:11434")
-        else:
-            if not openai_api_key:
+        with st.container(border=True):
+            col1, col2 = st.columns([1, 3])
+            
+            with col1:
+                thumb = thumbnails.load_thumbnail(c_meta.get('thumb_path'), c_meta.get('image_path'))
+                if thumb:
+                    st.image(thumb, width=150)
+                else:
+                    st.write("No Image")
+            
+            with col2:
+                st.markdown(f"**[Link to Post](https://www.instagram.com/p/{c_id}/)**")
+                st.caption(f"Shortcode: {c_id}")
+                if c_meta.get('duplicates'):
+                    # Reposts of the same media, folded into this card
+                    st.caption("Also saved as: " + ", ".join(
+                        f"[{code}](https://www.instagram.com/p/{code}/)" for code in c_meta['duplicates'].split("|")))
+                # Show a preview of the content derived from the doc text
+                with st.expander("Show Content Preview"):
+                    st.text(c_doc) 
+    
+    with summary_area:
+        st.markdown("### AI Summary")
+        
+        # helper to check if model is available
+        try:
+            from langchain.schema import HumanMessage, SystemMessage
+            
+            if llm_provider == "OpenAI (Cloud)" and not openai_api_key:
                 st.warning("Please enter your OpenAI API Key in the sidebar.")
                 st.stop()
-            llm = ChatOpenAI(model="gpt-4o-mini", api_key=openai_api_key)
-        
-        # Construct Context
-        # Truncate likely long posts to fit more into context window
-        context_text = ""
-        for i, (doc, shortcode) in enumerate(zip(docs, ids)):
-            # safe_doc = doc[:1000] 
-            context_text += f"\n[Post {shortcode}]: {doc}\n"
-
-        prompt = f"""
-You are an intelligent assistant summarizing personal saved Instagram posts.
-User Query: "{query}"
-
-Here are the retrieved posts (may be truncated):
-{context_text}
-
-INSTRUCTIONS:
-1. Analyze the provided posts to find information answering the User Query.
-2. If the user asks for a LIST, clearly itemize the findings.
-3. Combine details from multiple posts if they talk about the same topic.
-4. If NO posts look relevant in the context, state "I couldn't find specific details in the retrieved posts" and provide a general answer.
-5. Provide a helpful, concise summary. Do not output any special parsing codes.
-"""
-        with st.spinner("Synthesizing Summary..."):
+            llm = load_llm(llm_provider, openai_api_key)
+            
+            # Construct Context
+            # Fit the posts into the token budget, trimming long ones to the sentences that match the query
+            prompt = build_prompt(query, pack_context(ids, docs, query, budget=context_budget))
+            model_name = f"ollama:{OLLAMA_MODEL}" if llm_provider == "Ollama (Local)" else f"openai:{OPENAI_MODEL}"
             try:
-                # Get integration
-                response = llm.invoke([HumanMessage(content=prompt)])
-                final_answer = response.content
-                
-                st.markdown("### AI Summary")
-                st.write(final_answer)
-                
-                st.divider()
-                st.subheader(f"Retrieved Posts ({len(ids)})")
-                st.caption("These are the most similar posts found in your library.")
-                
-                for i in range(len(ids)):
-                    c_id = ids[i]
-                    c_doc = docs[i]
-                    c_meta = metadatas[i]
-                    
-                    with st.container(border=True):
-                        col1, col2 = st.columns([1, 3])
-                        
-                        with col1:
-                            img_path = c_meta.get('image_path')
-                            if img_path and os.path.exists(img_path):
-                                st.image(img_path, width=150)
-                            else:
-                                st.write("No Image")
-                        
-                        with col2:
-                            st.markdown(f"**[Link to Post](https://www.instagram.com/p/{c_id}/)**")
-                            st.caption(f"Shortcode: {c_id}")
-                            # Show a preview of the content derived from the doc text
-                            with st.expander("Show Content Preview"):
-                                st.text(c_doc) 
+                final_answer = None
+                if use_summary_cache:
+                    final_answer = query_cache.get_summary(model_name, query, ids, prompt)
+                if final_answer is not None:
+                    st.write(final_answer)
+                else:
+                    # Stream tokens into the page as they arrive
+                    with metrics.timed("llm", model=model_name, prompt_tokens=len(prompt) // 4):
+                        stream = llm.stream([HumanMessage(content=prompt)])
+                        final_answer = st.write_stream(chunk.content for chunk in stream)
+                    query_cache.put_summary(model_name, query, ids, prompt, final_answer)
                      
             except Exception as e:
                 st.error(f"Error communicating with AI Provider ({llm_provider}): {e}")
                 if llm_provider == "Ollama (Local)":
                     st.info("Make sure Ollama is running (ollama serve) and you have the model (ollama pull llama3.2).")
-                # Fallback to old view logic if LLM completely fails
-                st.subheader("Raw Results (Fallback)")
-                for i in range(len(ids)):
-                     st.text(docs[i][:200])
                     
-    except ImportError:
-         st.error("LangChain community not installed?")
+        except ImportError:
+             st.error("LangChain community not installed?")
@@ -0,0 +1,93 @@
+"""
+Streaming export parser (iter_posts) vs loading the whole file with json.load,
+on a synthetic saved_collections export.
+
+Each mode runs in its own process so peak RSS is measured separately.
+
+Usage:
+    python benchmarks/bench_export_parser.py --items 1000000
+"""
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+def write_export(path, items, collection_every=500, seed=0):
+    """
+    Writes a saved_collections style export, streamed so generating it is cheap too.
+    """
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{\n  "saved_saved_collections": [\n')
+        for i in range(items):
+            if i % collection_every == 0:
+                item = {
+                    "title": "Collection",
+                    "string_map_data": {
+                        "Name": {"value": f"Collection {i // collection_every}"},
+                        "Creation Time": {"timestamp": 1500000000 + i},
+                    },
+                }
+            else:
+                marker = rng.choice(["p", "reel"])
+                item = {
+                    "string_map_data": {
+                        "Name": {"href": f"https://www.instagram.com/{marker}/C{i:010d}/", "value": f"user{i % 977}"},
+                        "Added Time": {"timestamp": 1600000000 + i},
+                    }
+                }
+            f.write(("    " if i == 0 else ",\n    ") + json.dumps(item))
+        f.write('\n  ]\n}\n')
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def run_mode(mode, path):
+    from src.ingest import iter_posts
+
+    start = time.perf_counter()
+    if mode == "streaming":
+        count = sum(1 for _ in iter_posts(path))
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        count = sum(1 for item in data['saved_saved_collections'] if item.get('title') != 'Collection')
+    elapsed = time.perf_counter() - start
+    return {"mode": mode, "records": count, "seconds": round(elapsed, 2),
+            "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=1_000_000)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(*args.child)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "saved_collections.json"
+        write_export(path, args.items)
+        print(f"Synthetic export: {args.items} items, {path.stat().st_size / 1e6:.0f} MB")
+        for mode in ("json.load", "streaming"):
+            proc = subprocess.run([sys.executable, __file__, "--child", mode, str(path)],
+                                  capture_output=True, text=True, cwd=ROOT)
+            if proc.returncode != 0:
+                print(proc.stderr)
+                continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"{r['mode']:<10} {r['records']:>9} records  {r['seconds']:6.2f}s  "
+                  f"{r['records'] / max(r['seconds'], 1e-9):10.0f} rec/s  peak RSS {r['peak_rss_mb']:.0f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares indexing throughput (docs/sec) of the per-document path against
+the batched bulk path, with and without precomputed embeddings.
+
+Runs in a scratch data directory: the benchmark posts never reach the
+real Chroma collection, keyword index or collection version.
+
+Usage:
+    python benchmarks/bench_ingest.py --docs 500 --batch-size 64
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from src import rag_db
+
+WORDS = ("recipe bottle movie camera lens travel istanbul coffee workout reel "
+         "caption sunset baby product review tutorial guitar pasta garden").split()
+
+def make_docs(n, seed=0):
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n):
+        caption = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 120)))
+        docs.append({"shortcode": f"bench{i:07d}", "content": caption, "image_path": None})
+    return docs
+
+def run(label, fn, docs):
+    # Fresh collection per run so upserts are inserts in every mode
+    name = "bench_ingest"
+    client = rag_db.get_client()
+    try:
+        client.delete_collection(name)
+    except Exception:
+        pass
+    rag_db._collection = client.get_or_create_collection(
+        name=name, embedding_function=rag_db.get_embedding_function()
+    )
+
+    start = time.perf_counter()
+    fn(docs)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(docs) / elapsed:8.1f} docs/sec  ({elapsed:.2f}s)")
+    client.delete_collection(name)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=rag_db.EMBED_BATCH_SIZE)
+    args = parser.parse_args()
+
+    docs = make_docs(args.docs)
+
+    # Every store lives under data/ relative to the working directory
+    work = tempfile.mkdtemp(prefix="bench_ingest_")
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        # Warm up the model so the first mode doesn't pay for loading it
+        rag_db.get_embedding_function()(["warm up"])
+        rag_db.embed_documents(["warm up"])
+
+        run("per-document", lambda d: [rag_db.ingest_document(r['shortcode'], r['content']) for r in d], docs)
+        run(f"batched ({args.batch_size})", lambda d: rag_db.ingest_documents(d, batch_size=args.batch_size), docs)
+        run(f"batched+precompute ({args.batch_size})",
+            lambda d: rag_db.ingest_documents(d, batch_size=args.batch_size, precompute=True), docs)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
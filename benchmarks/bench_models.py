@@ -0,0 +1,192 @@
+"""
+Runs each model profile (src/profiles.py) over a local fixture corpus and
+reports speed, peak memory and transcript/OCR quality.
+
+Fixture layout (any flat directory):
+    clip1.mp4              videos to transcribe
+    clip1.transcript.txt   optional reference transcript -> WER
+    slide1.jpg             images to OCR
+    slide1.ocr.txt         optional reference text -> CER
+
+Each profile runs in its own process, in a scratch data directory with a
+fresh copy of the fixtures, so models, decodes, peak RSS and cached results
+don't leak between runs or into the real data/ stores.
+
+No corpus ships with the repo. --make-fixtures writes synthetic slides with
+reference text; for WER, copy a few Reels (data/raw/<shortcode>/*.mp4) into
+the same directory and write their transcripts next to them.
+
+Usage:
+    python benchmarks/bench_models.py --make-fixtures benchmarks/fixtures
+    python benchmarks/bench_models.py --fixtures benchmarks/fixtures --profiles fast,balanced
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+def edit_distance(a, b):
+    prev = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        cur = [i]
+        for j, y in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (x != y)))
+        prev = cur
+    return prev[-1]
+
+def error_rate(hypothesis, reference):
+    if not reference:
+        return None
+    return edit_distance(hypothesis, reference) / len(reference)
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+def reference_for(media, suffix):
+    path = media.with_name(f"{media.stem}.{suffix}.txt")
+    if path.exists():
+        return normalize(path.read_text(encoding='utf-8'))
+    return None
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KB on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def make_fixtures(directory, count=12, seed=0):
+    """
+    Writes count synthetic slides with overlay text, each with its reference
+    (slide_NN.jpg + slide_NN.ocr.txt). Videos have to be added by hand.
+    """
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    words = ["recipe", "pasta", "travel", "istanbul", "tips", "save", "for", "later", "best", "coffee"]
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        small = rng.integers(0, 120, (1350 // 60, 1080 // 60, 3), dtype=np.uint8)
+        image = cv2.resize(small, (1080, 1350), interpolation=cv2.INTER_CUBIC)
+        lines = [" ".join(rng.choice(words, size=3)) for _ in range(rng.integers(1, 4))]
+        for n, line in enumerate(lines):
+            cv2.putText(image, line, (60, 250 + 150 * n), cv2.FONT_HERSHEY_DUPLEX, 2, (255, 255, 255), 4)
+        cv2.imwrite(str(directory / f"slide_{i:02d}.jpg"), image)
+        (directory / f"slide_{i:02d}.ocr.txt").write_text(" ".join(lines), encoding='utf-8')
+    print(f"Wrote {count} slides to {directory}. Add .mp4 files with <name>.transcript.txt for WER.")
+
+def run_profile(profile_name, fixtures):
+    from src.profiles import set_profile
+
+    # The media cache, fingerprints and metrics live under data/ relative to the working directory
+    work = Path(tempfile.mkdtemp(prefix="bench_models_"))
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        corpus = work / "fixtures"
+        shutil.copytree(fixtures, corpus)
+        set_profile(profile_name)
+
+        from src import processor
+        from src.audio import decode_audio, SAMPLE_RATE
+        from src.filters import speech_segments
+
+        start = time.perf_counter()
+        processor.get_whisper()
+        processor.get_ocr()
+        load_seconds = time.perf_counter() - start
+
+        videos = sorted(corpus.glob("*.mp4"))
+        media_seconds = 0.0
+        wers = []
+        start = time.perf_counter()
+        for vid in videos:
+            media_seconds += len(decode_audio(vid)) / SAMPLE_RATE
+            text = processor.transcribe(vid, speech_segments(vid))
+            ref = reference_for(vid, "transcript")
+            if ref:
+                wers.append(error_rate(normalize(text).split(), ref.split()))
+        transcribe_seconds = time.perf_counter() - start
+
+        images = sorted(corpus.glob("*.jpg"))
+        cers = []
+        start = time.perf_counter()
+        for img in images:
+            text = processor.ocr_image(img)
+            ref = reference_for(img, "ocr")
+            if ref:
+                cers.append(error_rate(normalize(text), ref))
+        ocr_seconds = time.perf_counter() - start
+
+        media_minutes = media_seconds / 60
+        return {
+            "profile": profile_name,
+            "load_seconds": round(load_seconds, 2),
+            "videos": len(videos),
+            "media_minutes": round(media_minutes, 2),
+            "sec_per_media_minute": round(transcribe_seconds / media_minutes, 2) if media_minutes else None,
+            "images": len(images),
+            "sec_per_image": round(ocr_seconds / len(images), 3) if images else None,
+            "wer": round(sum(wers) / len(wers), 3) if wers else None,
+            "cer": round(sum(cers) / len(cers), 3) if cers else None,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+def main():
+    from src.profiles import load_profiles
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", default=str(ROOT / "benchmarks" / "fixtures"))
+    parser.add_argument("--profiles", default=",".join(load_profiles()))
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--make-fixtures", metavar="DIR", help="write synthetic OCR fixtures to DIR and exit")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.make_fixtures:
+        make_fixtures(args.make_fixtures)
+        return
+    if args.child:
+        print(json.dumps(run_profile(args.child, Path(args.fixtures))))
+        return
+
+    # The profile runs start in the repo root
+    args.fixtures = str(Path(args.fixtures).resolve())
+    if not Path(args.fixtures).is_dir():
+        sys.exit(f"Fixture directory not found: {args.fixtures} (create one with --make-fixtures {args.fixtures})")
+
+    results = []
+    for name in args.profiles.split(","):
+        print(f"Running profile '{name}'...", file=sys.stderr)
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", name, "--fixtures", args.fixtures],
+            capture_output=True, text=True, cwd=ROOT
+        )
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    columns = ["profile", "load_seconds", "sec_per_media_minute", "sec_per_image", "wer", "cer", "peak_rss_mb"]
+    print("  ".join(f"{c:>20}" for c in columns))
+    for r in results:
+        print("  ".join(f"{str(r[c]):>20}" for c in columns))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
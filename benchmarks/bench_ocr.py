@@ -0,0 +1,118 @@
+"""
+Batched OCR (processor.ocr_images) vs the old one-readtext-per-file loop.
+
+Images come from a fixture directory (*.jpg) or are generated: Instagram
+sized slides (1080x1080, 1080x1350), some with overlay text and some plain,
+so the text gate has something to skip.
+
+Both modes load the reader before timing and start from an empty media cache.
+
+Usage:
+    python benchmarks/bench_ocr.py --images 64
+    python benchmarks/bench_ocr.py --fixtures benchmarks/fixtures --profile fast
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+def write_images(directory, count, text_share=0.6, seed=0):
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    words = ["recipe", "pasta", "travel", "istanbul", "tips", "save", "for", "later", "best", "coffee"]
+    paths = []
+    for i in range(count):
+        h, w = (1080, 1080) if i % 2 else (1350, 1080)
+        # Smooth random colours, like an out-of-focus photo
+        small = rng.integers(0, 255, (h // 60, w // 60, 3), dtype=np.uint8)
+        image = cv2.resize(small, (w, h), interpolation=cv2.INTER_CUBIC)
+        if rng.random() < text_share:
+            for line in range(rng.integers(1, 4)):
+                text = " ".join(rng.choice(words, size=3))
+                cv2.putText(image, text, (60, 200 + 150 * line), cv2.FONT_HERSHEY_DUPLEX, 2, (255, 255, 255), 4)
+        path = Path(directory) / f"slide_{i:03d}.jpg"
+        cv2.imwrite(str(path), image)
+        paths.append(path)
+    return paths
+
+def per_image_loop(paths, profile):
+    # What ocr_image did before batching: full-size file, one readtext call each
+    from src.processor import get_ocr
+    from src.profiles import OCR_MODES
+    reader = get_ocr(profile)
+    return [" ".join(reader.readtext(str(path), detail=0, **OCR_MODES[profile['ocr_mode']])) for path in paths]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=64, help="synthetic images (ignored with --fixtures)")
+    parser.add_argument("--fixtures", help="directory of .jpg files to use instead")
+    parser.add_argument("--profile", default=None, help="model profile (see src/profiles.py)")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    from src import processor
+    from src.profiles import get_profile, set_profile
+
+    if args.profile:
+        set_profile(args.profile)
+    profile = get_profile()
+
+    fixtures = Path(args.fixtures).resolve() if args.fixtures else None
+    # The media cache, fingerprints and metrics all live under data/ relative to
+    # the working directory: run in a scratch one so the real stores are untouched
+    work = Path(tempfile.mkdtemp(prefix="bench_ocr_"))
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        if fixtures:
+            paths = []
+            for fixture in sorted(fixtures.glob("*.jpg")):
+                paths.append(Path(shutil.copy(fixture, work)))
+        else:
+            paths = write_images(work, args.images)
+        if not paths:
+            sys.exit("No images to OCR")
+
+        processor.get_ocr(profile)  # model load is not part of either timing
+
+        results = []
+        start = time.perf_counter()
+        baseline = per_image_loop(paths, profile)
+        seconds = time.perf_counter() - start
+        results.append({"mode": "per-image", "images": len(paths), "seconds": round(seconds, 2),
+                        "images_per_s": round(len(paths) / seconds, 2), "with_text": sum(1 for t in baseline if t)})
+
+        batch_size = args.batch_size or processor.OCR_BATCH_SIZE
+        start = time.perf_counter()
+        batched = processor.ocr_images(paths, batch_size=batch_size)
+        seconds = time.perf_counter() - start
+        results.append({"mode": f"batched (gate {'on' if profile['ocr_text_gate'] else 'off'})",
+                        "images": len(paths), "seconds": round(seconds, 2),
+                        "images_per_s": round(len(paths) / seconds, 2), "with_text": sum(1 for t in batched if t),
+                        # Text the per-image loop found but the gate skipped
+                        "missed_by_gate": sum(1 for a, b in zip(baseline, batched) if a.strip() and not b)})
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+    print(f"Profile '{profile['name']}', {len(paths)} images")
+    for r in results:
+        extra = f", {r['missed_by_gate']} missed by gate" if "missed_by_gate" in r else ""
+        print(f"{r['mode']:<18} {r['seconds']:7.2f}s  {r['images_per_s']:7.2f} img/s  "
+              f"{r['with_text']} with text{extra}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Offline retrieval quality and latency benchmark: no Instagram, no LLM server.
+
+Builds a corpus of processed posts (process_pipeline output: caption plus
+[Image Text] / [Audio Transcript] sections) around a fixed set of labeled
+items, pads it with topical distractors, indexes it into a fresh data
+directory and runs labeled queries through query_similar in each mode.
+
+Each labeled item (a dish, a film, a place...) appears in 1-2 posts, once
+by name in OCR text or the transcript and described in other words. Every
+item has two queries: its name ("keyword") and a paraphrase that doesn't use
+the name ("semantic"). A query's relevant posts are the ones about its item.
+
+Reports ingestion throughput, recall@k, MRR and p50/p99 latency per mode
+and query kind, plus the answer path (context packing + prompt + a stub LLM
+that streams back the post ids it was given). Caches are cleared before
+every query, so latencies are for queries the app hasn't seen.
+
+A fixture corpus can be used instead: --corpus posts.json ([{"shortcode",
+"content"}]) with --queries queries.json ([{"query", "relevant": [shortcodes],
+"kind"}]).
+
+With --baseline, exits 1 if recall/MRR dropped or p50 latency grew by more
+than the tolerances compared with an earlier --output file.
+
+Usage:
+    python benchmarks/bench_retrieval.py --posts 2000 --output retrieval.json
+    python benchmarks/bench_retrieval.py --modes hybrid,dense --rerank --baseline retrieval.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+# (topic, name, how a post describes it, how a user asks for it without the name)
+ITEMS = [
+    ("food", "menemen", "eggs scrambled with tomatoes and green peppers in a pan", "breakfast eggs cooked with tomato and pepper"),
+    ("food", "carbonara", "spaghetti with guanciale, egg yolks and pecorino cheese", "creamy pasta made with eggs and cured pork"),
+    ("food", "lahmacun", "thin crispy flatbread topped with spiced minced meat", "turkish thin pizza with ground beef"),
+    ("food", "shakshuka", "eggs poached in a spicy tomato and cumin sauce", "eggs baked in spicy tomato sauce"),
+    ("food", "tiramisu", "layers of coffee soaked ladyfingers and mascarpone cream", "italian coffee dessert with mascarpone"),
+    ("food", "ramen", "noodle soup with a rich pork broth and a soft boiled egg", "japanese noodle soup with broth"),
+    ("film", "Interstellar", "astronauts travel through a wormhole to find a new planet for humanity", "space movie about a wormhole and saving humanity"),
+    ("film", "Parasite", "a poor family slowly infiltrates the house of a rich family", "korean thriller about class and a rich household"),
+    ("film", "Whiplash", "a young drummer pushed to the limit by an abusive music teacher", "film about a jazz drummer and a harsh instructor"),
+    ("film", "Amelie", "a shy waitress in Montmartre secretly improves the lives of others", "charming french film about a Paris waitress"),
+    ("film", "Inception", "thieves enter dreams within dreams to plant an idea", "movie about stealing secrets inside dreams"),
+    ("travel", "Cappadocia", "hot air balloons at sunrise over fairy chimneys and cave hotels", "balloon ride over rock formations in turkey"),
+    ("travel", "Kyoto", "old temples, bamboo forest paths and wooden tea houses", "japanese city with temples and bamboo groves"),
+    ("travel", "Lofoten", "fishing villages with red cabins under steep arctic mountains", "norwegian islands with red huts and mountains"),
+    ("travel", "Santorini", "white houses with blue domes above the caldera at sunset", "greek island with blue domed churches"),
+    ("travel", "Patagonia", "glaciers, granite peaks and long windy hiking trails", "hiking among glaciers at the southern tip of south america"),
+    ("fitness", "deadlift", "lifting a loaded barbell from the floor with a neutral spine", "how to pick up a heavy barbell from the ground safely"),
+    ("fitness", "kettlebell swing", "hip hinge explosive swing of a cast iron weight to chest height", "explosive hip exercise with a round weight"),
+    ("fitness", "plank", "holding a straight body on forearms to strengthen the core", "static core hold on the elbows"),
+    ("fitness", "pull-up", "hanging from a bar and pulling the chin above it", "bodyweight back exercise on a bar"),
+    ("tech", "Raspberry Pi", "a credit card sized computer running a home media server", "tiny single board computer for a home server"),
+    ("tech", "mechanical keyboard", "clicky switches and custom keycaps for typing", "typing setup with tactile switches"),
+    ("tech", "e-ink tablet", "a paper like screen for reading and handwritten notes", "device for taking notes that looks like paper"),
+    ("tech", "Obsidian", "a markdown notes app with linked pages and a graph view", "app for linked markdown notes"),
+    ("home", "monstera", "a big leafy houseplant with split leaves that likes indirect light", "houseplant with holes in its leaves"),
+    ("home", "sourdough starter", "feeding flour and water daily to keep wild yeast alive", "keeping wild yeast alive for bread"),
+    ("home", "cold brew", "coarse ground coffee steeped in cold water overnight", "coffee steeped overnight in cold water"),
+    ("home", "capsule wardrobe", "a small set of clothes that all combine with each other", "minimal closet where every piece matches"),
+]
+
+TOPIC_WORDS = {
+    "food": "recipe kitchen cook bake delicious easy homemade dinner lunch sauce salt oil oven minutes ingredients".split(),
+    "film": "movie watch cinema director scene actor plot review trailer netflix weekend classic rating".split(),
+    "travel": "trip travel hotel view flight itinerary hidden gem city beach sunset guide budget explore".split(),
+    "fitness": "workout gym reps sets form muscle training routine strength beginner warm up stretch".split(),
+    "tech": "setup gadget desk software review battery screen productivity tips cable build project".split(),
+    "home": "home apartment cozy decor plant routine morning cleaning organize weekend diy budget".split(),
+}
+FILLER = "follow for more save this for later link in bio tag a friend who needs this part two soon".split()
+
+def make_corpus(n_posts, seed=0):
+    """
+    (posts, queries): process_pipeline-style posts and the labeled query set.
+    """
+    rng = random.Random(seed)
+    posts, queries = [], []
+
+    def sentence(topic, size):
+        return " ".join(rng.choice(TOPIC_WORDS[topic] + FILLER) for _ in range(size)).capitalize() + "."
+
+    for n, (topic, name, description, paraphrase) in enumerate(ITEMS):
+        relevant = []
+        for n_copy in range(1 + n % 2):
+            code = f"item{n:02d}{'ab'[n_copy]}"
+            lines = [f"{sentence(topic, 12)} {description.capitalize()}. {sentence(topic, 8)}"]
+            # The name only appears in the media text, like most Reels and slides
+            if (n + n_copy) % 2:
+                lines.append(f"[Image Text]: {name.upper()} | {sentence(topic, 4)}")
+            else:
+                lines.append(f"[Audio Transcript]: {sentence(topic, 30)} Today it is {name}. {sentence(topic, 40)}")
+            posts.append({"shortcode": code, "content": "\n".join(lines), "image_path": None})
+            relevant.append(code)
+        queries.append({"query": name, "relevant": relevant, "kind": "keyword"})
+        queries.append({"query": paraphrase, "relevant": relevant, "kind": "semantic"})
+
+    topics = sorted(TOPIC_WORDS)
+    for i in range(max(0, n_posts - len(posts))):
+        topic = topics[i % len(topics)]
+        lines = [sentence(topic, rng.randint(10, 40))]
+        if rng.random() < 0.5:
+            lines.append(f"[Audio Transcript]: {' '.join(sentence(topic, 15) for _ in range(rng.randint(1, 12)))}")
+        if rng.random() < 0.3:
+            lines.append(f"[Image Text]: {sentence(topic, 6)}")
+        posts.append({"shortcode": f"post{i:06d}", "content": "\n".join(lines), "image_path": None})
+    return posts, queries
+
+class StubLLM:
+    """
+    Stands in for the chat model: streams back the ids of the posts in the prompt.
+    """
+    def stream(self, prompt):
+        for line in prompt.splitlines():
+            if line.startswith("[Post "):
+                yield line[len("[Post "):line.index("]")] + " "
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 2) if values else None
+
+def evaluate(search, queries, k, repeats):
+    """
+    Runs every query `repeats` times through search(query) -> ids.
+    Returns recall@k, MRR and latency, overall and per query kind.
+    """
+    from src import query_cache
+    from src import rerank
+
+    rows = []
+    for q in queries:
+        for _ in range(repeats):
+            query_cache.results_cache.clear()
+            query_cache.embedding_cache.clear()
+            rerank.score_cache.clear()
+            start = time.perf_counter()
+            ids = search(q['query'])
+            seconds = time.perf_counter() - start
+        relevant = set(q['relevant'])
+        top = ids[:k]
+        hits = len(relevant & set(top))
+        rank = next((n for n, i in enumerate(ids, start=1) if i in relevant), None)
+        rows.append({"kind": q['kind'], "recall": hits / min(k, len(relevant)),
+                     "rr": 1.0 / rank if rank else 0.0, "seconds": seconds})
+
+    def summary(subset):
+        latencies = [r['seconds'] for r in subset]
+        return {"queries": len(subset),
+                f"recall@{k}": round(float(np.mean([r['recall'] for r in subset])), 4),
+                "mrr": round(float(np.mean([r['rr'] for r in subset])), 4),
+                "p50_ms": percentile(latencies, 50), "p99_ms": percentile(latencies, 99)}
+
+    result = summary(rows)
+    result["by_kind"] = {kind: summary([r for r in rows if r['kind'] == kind])
+                         for kind in sorted({r['kind'] for r in rows})}
+    return result
+
+def answer_path(queries, mode, k):
+    """
+    Retrieval + context packing + prompt + stub LLM, as app.py does it.
+    """
+    from src import query_cache
+    from src.context import pack_context, build_prompt, estimate_tokens
+    from src.rag_db import query_similar
+
+    llm = StubLLM()
+    seconds, tokens = [], []
+    for q in queries:
+        query_cache.results_cache.clear()
+        start = time.perf_counter()
+        results = query_similar(q['query'], n_results=k, mode=mode)
+        prompt = build_prompt(q['query'], pack_context(results['ids'][0], results['documents'][0], q['query']))
+        "".join(llm.stream(prompt))
+        seconds.append(time.perf_counter() - start)
+        tokens.append(estimate_tokens(prompt))
+    return {"mode": mode, "p50_ms": percentile(seconds, 50), "p99_ms": percentile(seconds, 99),
+            "prompt_tokens_mean": round(float(np.mean(tokens)), 1)}
+
+def regressions(current, baseline, quality_tolerance, latency_tolerance, k):
+    problems = []
+    for mode, now in current['modes'].items():
+        before = baseline.get('modes', {}).get(mode)
+        if not before:
+            continue
+        for metric in (f"recall@{k}", "mrr"):
+            if metric in before and now[metric] < before[metric] - quality_tolerance:
+                problems.append(f"{mode} {metric}: {before[metric]} -> {now[metric]}")
+        if before.get('p50_ms') and now['p50_ms'] > before['p50_ms'] * (1 + latency_tolerance):
+            problems.append(f"{mode} p50_ms: {before['p50_ms']} -> {now['p50_ms']}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=2000, help="corpus size incl. distractors (synthetic corpus)")
+    parser.add_argument("--corpus", help="JSON list of processed posts to use instead")
+    parser.add_argument("--queries", help="JSON list of labeled queries (required with --corpus)")
+    parser.add_argument("--modes", default="hybrid,dense,lexical")
+    parser.add_argument("--rerank", action="store_true", help="also evaluate hybrid + cross-encoder re-ranking")
+    parser.add_argument("-k", type=int, default=15)
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per query (the last one is kept)")
+    parser.add_argument("--backend", choices=("chroma", "numpy"), default=None, help="vector backend")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="earlier --output file to compare against")
+    parser.add_argument("--quality-tolerance", type=float, default=0.02)
+    parser.add_argument("--latency-tolerance", type=float, default=0.5, help="allowed relative p50 growth")
+    args = parser.parse_args()
+
+    if args.corpus:
+        if not args.queries:
+            sys.exit("--corpus needs --queries")
+        with open(args.corpus, 'r', encoding='utf-8') as f:
+            posts = json.load(f)
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            queries = [{"kind": "labeled", **q} for q in json.load(f)]
+    else:
+        posts, queries = make_corpus(args.posts)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+    if args.backend:
+        os.environ["INSTARAG_VECTOR_BACKEND"] = args.backend
+
+    # Every store lives under data/ relative to the working directory: index into a scratch one
+    work = tempfile.mkdtemp(prefix="bench_retrieval_")
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        from src import rag_db, rerank
+        from src.vector_store import get_backend
+
+        # Model loading is not part of the ingestion timing
+        rag_db.get_embedding_function()(["warm up"])
+        batch_size = args.batch_size or rag_db.EMBED_BATCH_SIZE
+        start = time.perf_counter()
+        written = rag_db.ingest_documents(posts, batch_size=batch_size)
+        ingest_s = time.perf_counter() - start
+        chunks = rag_db.get_collection().count()
+
+        results = {
+            "config": {"posts": len(posts), "queries": len(queries), "k": args.k, "backend": get_backend(),
+                       "batch_size": batch_size, "corpus": args.corpus or "synthetic"},
+            "ingest": {"posts": written, "chunks": chunks, "seconds": round(ingest_s, 2),
+                       "posts_per_s": round(written / ingest_s, 1)},
+            "modes": {},
+        }
+        for mode in args.modes.split(","):
+            search = lambda q, mode=mode: rag_db.query_similar(q, n_results=args.k, mode=mode)['ids'][0]
+            results["modes"][mode] = evaluate(search, queries, args.k, args.repeats)
+        if args.rerank:
+            rerank.get_reranker()
+
+            def reranked(q):
+                candidates = rag_db.query_similar(q, n_results=rerank.RERANK_CANDIDATES)
+                # Everything re-ordered, so recall@k is comparable with the other modes
+                return rerank.rerank(q, candidates, top_k=rerank.RERANK_CANDIDATES, budget=float("inf"))['ids'][0]
+            results["modes"]["hybrid+rerank"] = evaluate(reranked, queries, args.k, args.repeats)
+        results["answer"] = answer_path(queries, args.modes.split(",")[0], args.k)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+    ingest = results["ingest"]
+    print(f"Indexed {ingest['posts']} posts ({ingest['chunks']} chunks) in {ingest['seconds']}s, "
+          f"{ingest['posts_per_s']} posts/s")
+    for mode, r in results["modes"].items():
+        kinds = "  ".join(f"{kind} {v[f'recall@{args.k}']:.3f}/{v['mrr']:.3f}" for kind, v in r["by_kind"].items())
+        print(f"{mode:<14} recall@{args.k} {r[f'recall@{args.k}']:.3f}  MRR {r['mrr']:.3f}  "
+              f"p50 {r['p50_ms']:7.2f} ms  p99 {r['p99_ms']:7.2f} ms  ({kinds})")
+    answer = results["answer"]
+    print(f"answer path ({answer['mode']}, stub LLM): p50 {answer['p50_ms']} ms, p99 {answer['p99_ms']} ms, "
+          f"{answer['prompt_tokens_mean']} prompt tokens")
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if baseline:
+        problems = regressions(results, baseline, args.quality_tolerance, args.latency_tolerance, args.k)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
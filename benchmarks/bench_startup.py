@@ -0,0 +1,90 @@
+"""
+Measures cold start: each scenario runs in a fresh Python process.
+
+    app imports        the top-level imports of app.py (read from the file,
+                       so the scenario follows app.py's import list)
+    first search       app imports + opening the index + one query
+    pipeline imports   modules only loaded when Run Pipeline is clicked
+    eager (old app)    what app.py used to load up front: chromadb client,
+                       MiniLM embedding function, easyocr, faster_whisper, torch
+
+Usage:
+    python benchmarks/bench_startup.py --repeat 3 --output startup.json
+"""
+import argparse
+import ast
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def app_imports():
+    """
+    Source of the module-level import statements of app.py.
+    """
+    source = (ROOT / "app.py").read_text(encoding="utf-8")
+    return "\n".join(ast.get_source_segment(source, node) for node in ast.parse(source).body
+                     if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+SCENARIOS = {
+    "app imports": app_imports(),
+    "first search": app_imports() + """
+from src.rag_db import query_similar, get_collection, reopen
+reopen()
+get_collection()
+query_similar("movie", n_results=15)
+""",
+    "pipeline imports": """
+import src.pipeline
+""",
+    "eager (old app)": """
+import streamlit
+import chromadb
+from chromadb.utils import embedding_functions
+client = chromadb.PersistentClient(path="data/chroma_db")
+ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2", device="cpu")
+client.get_or_create_collection(name="insta_posts", embedding_function=ef)
+import easyocr, faster_whisper, torch
+""",
+}
+
+TEMPLATE = """
+import time, json, sys
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+{body}
+print(json.dumps(time.perf_counter() - start))
+"""
+
+def measure(body):
+    code = TEMPLATE.format(root=str(ROOT), body=body)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else "failed")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for name, body in SCENARIOS.items():
+        try:
+            times = [measure(body) for _ in range(args.repeat)]
+            print(f"{name:<18} median {statistics.median(times):6.2f}s  (min {min(times):.2f}s)")
+            results.append({"scenario": name, "median_s": round(statistics.median(times), 3),
+                            "min_s": round(min(times), 3)})
+        except RuntimeError as e:
+            print(f"{name:<18} error: {e}")
+            results.append({"scenario": name, "error": str(e)})
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
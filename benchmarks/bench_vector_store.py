@@ -0,0 +1,164 @@
+"""
+Recall@15 and query latency of the quantized NumPy store (src/vector_store.py)
+against Chroma, plus build time, disk size and cold load (open + first query).
+
+Vectors are synthetic: unit 384-d vectors scattered around cluster centres,
+like sentence embeddings of posts on a limited set of topics. Queries are
+perturbed corpus vectors; the ground truth is an exact float32 search.
+Chroma is skipped when it isn't installed.
+
+Usage:
+    python benchmarks/bench_vector_store.py --sizes 10000,100000
+    python benchmarks/bench_vector_store.py --sizes 1000000 --nprobe 8,24,64 --output vs.json
+"""
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from src import vector_store
+
+DIM = 384
+K = 15
+BATCH = 5000
+
+def make_vectors(n, dim=DIM, clusters=None, seed=0):
+    rng = np.random.default_rng(seed)
+    clusters = clusters or max(10, n // 200)
+    centres = vector_store._normalize(rng.standard_normal((clusters, dim), dtype=np.float32))
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 100000):
+        stop = min(start + 100000, n)
+        noise = rng.standard_normal((stop - start, dim), dtype=np.float32) * 0.05
+        vectors[start:stop] = vector_store._normalize(centres[rng.integers(0, clusters, stop - start)] + noise)
+    return vectors
+
+def ground_truth(vectors, queries, k=K):
+    truth = []
+    for q in queries:
+        scores = np.concatenate([vectors[s:s + 100000] @ q for s in range(0, len(vectors), 100000)])
+        truth.append(set(vector_store._top(scores, k).tolist()))
+    return truth
+
+def measure(query_fn, queries, truth):
+    latencies, hits = [], 0
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        ids = query_fn(q)
+        latencies.append(time.perf_counter() - start)
+        hits += len(expected & {int(i) for i in ids})
+    latencies = np.array(latencies) * 1000
+    return {"recall@15": round(hits / (K * len(queries)), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 2)}
+
+def disk_mb(path):
+    return round(sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file()) / 1e6, 1)
+
+def bench_numpy(work, vectors, queries, truth, dtype, nprobes):
+    path = Path(work) / f"numpy_{dtype}"
+    start = time.perf_counter()
+    store = vector_store.NumpyCollection(path, dtype=dtype)
+    # Index once at the end, like a migration
+    min_rows, vector_store.IVF_MIN_ROWS = vector_store.IVF_MIN_ROWS, len(vectors) + 1
+    try:
+        for s in range(0, len(vectors), BATCH):
+            ids = [str(i) for i in range(s, min(s + BATCH, len(vectors)))]
+            store.upsert(ids=ids, metadatas=[{"shortcode": i} for i in ids], embeddings=vectors[s:s + BATCH])
+    finally:
+        vector_store.IVF_MIN_ROWS = min_rows
+    nlist = store.build_index()
+    build_s = time.perf_counter() - start
+    del store
+
+    start = time.perf_counter()
+    store = vector_store.NumpyCollection(path)
+    store.query(query_embeddings=[queries[0]], n_results=K, include=[])
+    cold_s = time.perf_counter() - start
+
+    rows = []
+    base = {"backend": f"numpy {dtype}", "vectors": len(vectors), "build_s": round(build_s, 1),
+            "disk_mb": disk_mb(path), "cold_load_ms": round(cold_s * 1000, 1)}
+    exact = lambda q: store.query(query_embeddings=[q], n_results=K, include=[])['ids'][0]
+    if nlist:
+        for nprobe in nprobes:
+            vector_store.IVF_NPROBE = nprobe
+            rows.append({**base, "index": f"ivf{nlist} nprobe={nprobe}", **measure(exact, queries, truth)})
+    centroids, store.centroids = store.centroids, None
+    rows.append({**base, "index": "exact scan", **measure(exact, queries, truth)})
+    store.centroids = centroids
+    return rows
+
+def bench_chroma(work, vectors, queries, truth):
+    try:
+        import chromadb
+    except ImportError:
+        print("chromadb not installed, skipping Chroma")
+        return []
+    from chromadb.api.client import SharedSystemClient
+
+    path = Path(work) / "chroma"
+    start = time.perf_counter()
+    collection = chromadb.PersistentClient(path=str(path)).get_or_create_collection("bench", embedding_function=None)
+    for s in range(0, len(vectors), BATCH):
+        ids = [str(i) for i in range(s, min(s + BATCH, len(vectors)))]
+        collection.add(ids=ids, metadatas=[{"shortcode": i} for i in ids], embeddings=vectors[s:s + BATCH].tolist())
+    build_s = time.perf_counter() - start
+    del collection
+    SharedSystemClient.clear_system_cache()
+
+    start = time.perf_counter()
+    collection = chromadb.PersistentClient(path=str(path)).get_collection("bench", embedding_function=None)
+    collection.query(query_embeddings=[queries[0].tolist()], n_results=K, include=[])
+    cold_s = time.perf_counter() - start
+
+    query = lambda q: collection.query(query_embeddings=[q.tolist()], n_results=K, include=[])['ids'][0]
+    return [{"backend": "chroma", "index": "hnsw", "vectors": len(vectors), "build_s": round(build_s, 1),
+             "disk_mb": disk_mb(path), "cold_load_ms": round(cold_s * 1000, 1), **measure(query, queries, truth)}]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma separated corpus sizes")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dtypes", default="int8,float16")
+    parser.add_argument("--nprobe", default="8,24,64", help="IVF lists probed, comma separated")
+    parser.add_argument("--no-chroma", action="store_true")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        vectors = make_vectors(size)
+        rng = np.random.default_rng(1)
+        picked = vectors[rng.choice(size, args.queries, replace=False)]
+        queries = vector_store._normalize(picked + rng.standard_normal(picked.shape, dtype=np.float32) * 0.03)
+        truth = ground_truth(vectors, queries)
+
+        work = tempfile.mkdtemp(prefix="bench_vs_")
+        try:
+            rows = [] if args.no_chroma else bench_chroma(work, vectors, queries, truth)
+            for dtype in args.dtypes.split(","):
+                rows += bench_numpy(work, vectors, queries, truth, dtype, [int(n) for n in args.nprobe.split(",")])
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+        print(f"\n{size} vectors, {args.queries} queries, k={K}")
+        for r in rows:
+            print(f"{r['backend']:<14} {r['index']:<22} recall {r['recall@15']:.3f}  p50 {r['p50_ms']:7.2f} ms  "
+                  f"p95 {r['p95_ms']:7.2f} ms  build {r['build_s']:6.1f}s  {r['disk_mb']:8.1f} MB  "
+                  f"cold {r['cold_load_ms']:7.1f} ms")
+        results += rows
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
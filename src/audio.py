@@ -0,0 +1,72 @@
+import os
+import numpy as np
+from pathlib import Path
+from src.metrics import timed
+
+# Silero VAD and Whisper both work on 16 kHz mono float32
+SAMPLE_RATE = 16000
+
+# Silence inserted between speech segments when they are stitched together for Whisper
+SEGMENT_GAP_SECONDS = 0.3
+SEGMENT_PADDING_SECONDS = 0.2
+
+def decoded_path(media_path):
+    media_path = Path(media_path)
+    return media_path.with_name(f"{media_path.stem}_audio16k.npy")
+
+def decode_audio(media_path):
+    """
+    Decodes the audio track once to a 16 kHz mono float32 array and keeps it
+    next to the video as .npy. Later calls memory-map that file instead of
+    running the decoder again. Returns an empty array if there is no audio.
+    The file is only scratch space: remove it with remove_decoded() once the
+    post's audio stages are done.
+    """
+    npy_path = decoded_path(media_path)
+    if npy_path.exists():
+        return np.load(npy_path, mmap_mode='r')
+
+    # faster-whisper's PyAV based decoder, same one Whisper would use internally
+    from faster_whisper.audio import decode_audio as _decode
+    with timed("decode", bytes=os.path.getsize(media_path), items=1) as m:
+        audio = np.asarray(_decode(str(media_path), sampling_rate=SAMPLE_RATE), dtype=np.float32)
+        m["media_seconds"] = len(audio) / SAMPLE_RATE
+
+    tmp_path = npy_path.with_name(npy_path.stem + ".tmp.npy")
+    np.save(tmp_path, audio)
+    os.replace(tmp_path, npy_path)
+    return np.load(npy_path, mmap_mode='r')
+
+def remove_decoded(media_path):
+    """
+    Deletes the decoded audio of media_path. VAD, transcript and fingerprint
+    results are cached by the file hash, so a re-run doesn't need it.
+    """
+    decoded_path(media_path).unlink(missing_ok=True)
+
+def speech_audio(audio, segments, padding=SEGMENT_PADDING_SECONDS, gap=SEGMENT_GAP_SECONDS):
+    """
+    Concatenates only the speech parts of audio.
+    segments: [(start_sec, end_sec)] as returned by filters.speech_segments.
+    Segments are padded a little, merged when they overlap and separated by short silence.
+    """
+    merged = []
+    for start, end in sorted(segments):
+        start = max(0.0, start - padding)
+        end = end + padding
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    silence = np.zeros(int(gap * SAMPLE_RATE), dtype=np.float32)
+    parts = []
+    for start, end in merged:
+        chunk = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        if len(chunk):
+            if parts:
+                parts.append(silence)
+            parts.append(np.asarray(chunk, dtype=np.float32))
+    if not parts:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(parts)
@@ -0,0 +1,81 @@
+import re
+
+# Splits a post's combined text (see process_pipeline) into modality-tagged
+# chunks that fit the MiniLM encoder (256 word pieces, roughly 150 words),
+# and puts them back together for display.
+MAX_CHUNK_WORDS = 150
+
+# Section prefixes written by process_pipeline -> modality name
+PREFIXES = {
+    "[Image Text]: ": "image_text",
+    "[Video Overlay Text]: ": "video_text",
+    "[Audio Transcript]: ": "transcript",
+}
+MODALITY_PREFIX = {modality: prefix for prefix, modality in PREFIXES.items()}
+
+SENTENCE_RE = re.compile(r"[^.!?]+[.!?]*", re.UNICODE)
+
+def split_sections(content):
+    """
+    Returns [(modality, text)] in document order. Lines without a known
+    prefix (and the lines following them) belong to the caption.
+    """
+    sections = []
+    for line in content.split("\n"):
+        for prefix, modality in PREFIXES.items():
+            if line.startswith(prefix):
+                sections.append([modality, line[len(prefix):]])
+                break
+        else:
+            if sections and sections[-1][0] == "caption":
+                sections[-1][1] += "\n" + line
+            else:
+                sections.append(["caption", line])
+    return [(modality, text) for modality, text in sections if text.strip()]
+
+def _windows(text, max_words):
+    # Whole sentences per window where possible; very long sentences are cut by words
+    windows = []
+    current = []
+    for sentence in SENTENCE_RE.findall(text):
+        words = sentence.split()
+        while len(words) > max_words:
+            if current:
+                windows.append(" ".join(current))
+                current = []
+            windows.append(" ".join(words[:max_words]))
+            words = words[max_words:]
+        if len(current) + len(words) > max_words:
+            windows.append(" ".join(current))
+            current = []
+        current.extend(words)
+    if current:
+        windows.append(" ".join(current))
+    return [w for w in windows if w]
+
+def chunk_post(content, max_words=MAX_CHUNK_WORDS):
+    """
+    Returns [{"modality", "section", "text"}]; section numbers let
+    assemble_post() rebuild the post text in its original layout.
+    """
+    chunks = []
+    for section, (modality, text) in enumerate(split_sections(content)):
+        if modality == "caption":
+            # Keep caption line breaks out of the embedding text
+            text = " ".join(text.split())
+        for window in _windows(text, max_words):
+            chunks.append({"modality": modality, "section": section, "text": window})
+    return chunks
+
+def assemble_post(chunks):
+    """
+    Inverse of chunk_post: chunks (dicts with modality/section/chunk/text) of one post.
+    """
+    sections = {}
+    for chunk in sorted(chunks, key=lambda c: (c['section'], c['chunk'])):
+        sections.setdefault(chunk['section'], [chunk['modality'], []])[1].append(chunk['text'])
+    lines = []
+    for section in sorted(sections):
+        modality, texts = sections[section]
+        lines.append(MODALITY_PREFIX.get(modality, "") + " ".join(texts))
+    return "\n".join(lines)
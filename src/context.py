@@ -0,0 +1,97 @@
+import re
+
+# Packs retrieved posts into the LLM prompt under a token budget.
+# Posts stay in relevance order; long ones (mostly Reels transcripts) are
+# cut down to the sentences that best match the query.
+CONTEXT_TOKEN_BUDGET = 3000
+
+# Posts that would get fewer tokens than this are left out entirely
+MIN_PASSAGE_TOKENS = 40
+
+SENTENCE_RE = re.compile(r"[^.!?\n]+[.!?]*", re.UNICODE)
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Joins the sentences kept from a trimmed passage
+SEPARATOR = " ... "
+
+def estimate_tokens(text):
+    # ~4 characters per token for English-like text; close enough for budgeting
+    return max(1, len(text) // 4)
+
+def split_sentences(text):
+    return [s.strip() for s in SENTENCE_RE.findall(text) if s.strip()]
+
+def _terms(text):
+    return {w.lower() for w in WORD_RE.findall(text) if len(w) > 1}
+
+def trim_passage(text, query, max_tokens):
+    """
+    Returns text unchanged if it fits, otherwise the best-matching sentences
+    (by query word overlap) that fit in max_tokens, kept in their original order.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    sentences = split_sentences(text)
+    query_terms = _terms(query)
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(_terms(sentences[i]) & query_terms), i)
+    )
+
+    # Counted in characters, like estimate_tokens, so the joined result fits
+    max_chars = max_tokens * 4
+    chosen = []
+    used = -len(SEPARATOR)
+    for i in ranked:
+        cost = len(sentences[i]) + len(SEPARATOR)
+        if used + cost > max_chars:
+            continue
+        chosen.append(i)
+        used += cost
+
+    if not chosen:
+        # A single sentence longer than the budget: hard cut
+        return text[:max_chars]
+    return SEPARATOR.join(sentences[i] for i in sorted(chosen))
+
+def pack_context(ids, docs, query, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Fits posts (already in relevance order) into budget tokens.
+    Every remaining post gets an equal share of what is left, so an early
+    long transcript can't crowd out everything after it.
+    Returns [(id, text)] for the posts that made it in.
+    """
+    packed = []
+    remaining = budget
+    for n, (doc_id, doc) in enumerate(zip(ids, docs)):
+        share = remaining // (len(ids) - n)
+        # Short posts use less than their share, leaving more for the rest
+        allowance = max(share, min(MIN_PASSAGE_TOKENS, remaining))
+        if allowance < MIN_PASSAGE_TOKENS:
+            break
+        text = trim_passage(doc, query, allowance)
+        packed.append((doc_id, text))
+        remaining -= estimate_tokens(text)
+    return packed
+
+PROMPT_TEMPLATE = """
+You are an intelligent assistant summarizing personal saved Instagram posts.
+User Query: "{query}"
+
+Here are the retrieved posts (may be truncated):
+{context_text}
+
+INSTRUCTIONS:
+1. Analyze the provided posts to find information answering the User Query.
+2. If the user asks for a LIST, clearly itemize the findings.
+3. Combine details from multiple posts if they talk about the same topic.
+4. If NO posts look relevant in the context, state "I couldn't find specific details in the retrieved posts" and provide a general answer.
+5. Provide a helpful, concise summary. Do not output any special parsing codes.
+"""
+
+def build_prompt(query, packed):
+    """
+    The summary prompt for the posts returned by pack_context().
+    """
+    context_text = "".join(f"\n[Post {shortcode}]: {doc}\n" for shortcode, doc in packed)
+    return PROMPT_TEMPLATE.format(query=query, context_text=context_text)
@@ -0,0 +1,247 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from src.metrics import record
+
+# Downloads posts through one reused Instaloader session, throttled by a token
+# bucket, with exponential backoff on rate limits and a persistent retry queue
+# so an interrupted run picks up where it stopped.
+QUEUE_PATH = "data/download_queue.sqlite"
+
+# Sustained requests per second and short burst allowance
+DOWNLOAD_RATE = 0.5
+DOWNLOAD_BURST = 3
+
+# Backoff: base * 2^attempts seconds (with jitter), capped
+BACKOFF_BASE = 60
+BACKOFF_MAX = 6 * 3600
+MAX_ATTEMPTS = 8
+
+# Optional: log in with a session saved by `instaloader --login USER`
+SESSION_USER_ENV = "INSTARAG_IG_USER"
+
+class RateLimited(Exception):
+    """
+    Instagram answered 429 or put up a login wall; worth retrying later.
+    """
+
+class PermanentFailure(Exception):
+    """
+    Retrying won't help (post deleted, private, ...).
+    """
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() blocks until a token is available.
+    pause(seconds) stops all acquirers, used as a global cooldown after a 429.
+    """
+    def __init__(self, rate=DOWNLOAD_RATE, burst=DOWNLOAD_BURST):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.updated = self.paused_until
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+class InstaloaderFetcher:
+    """
+    Default fetch: one Instaloader instance (and HTTP session) for all posts.
+    Instaloader isn't thread-safe, so calls are serialized; the rate limit is
+    the real bottleneck anyway.
+    """
+    def __init__(self):
+        self._loader = None
+        self._lock = threading.Lock()
+
+    def _get_loader(self, target_dir):
+        import instaloader
+        if self._loader is None:
+            self._loader = instaloader.Instaloader(
+                download_pictures=True,
+                download_videos=True,
+                download_video_thumbnails=False,
+                download_geotags=False,
+                download_comments=False,
+                save_metadata=True,
+                compress_json=False,
+                max_connection_attempts=1  # retries are ours, with backoff
+            )
+            user = os.environ.get(SESSION_USER_ENV)
+            if user:
+                self._loader.load_session_from_file(user)
+        # Straight to the target folder, never touching the process-wide CWD
+        self._loader.dirname_pattern = str(Path(target_dir).resolve() / "{target}")
+        return self._loader
+
+    def __call__(self, shortcode, target_dir):
+        import instaloader
+        from instaloader import exceptions as ie
+        with self._lock:
+            L = self._get_loader(target_dir)
+            try:
+                post = instaloader.Post.from_shortcode(L.context, shortcode)
+                L.download_post(post, target=shortcode)
+            except (ie.TooManyRequestsException, ie.LoginRequiredException) as e:
+                raise RateLimited(str(e))
+            except (ie.QueryReturnedNotFoundException, ie.PrivateProfileNotFollowedException) as e:
+                raise PermanentFailure(str(e))
+            except ie.ConnectionException as e:
+                if "429" in str(e) or "login" in str(e).lower():
+                    raise RateLimited(str(e))
+                raise
+
+class Downloader:
+    """
+    download(shortcode) -> True on success. Failures are recorded in the retry
+    queue with their next attempt time; until then the post is skipped.
+    fetch(shortcode, target_dir) does the actual work and may raise
+    RateLimited / PermanentFailure (defaults to InstaloaderFetcher).
+    """
+    def __init__(self, target_dir="data/raw", fetch=None, rate=DOWNLOAD_RATE, burst=DOWNLOAD_BURST,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, max_attempts=MAX_ATTEMPTS,
+                 queue_path=QUEUE_PATH):
+        self.target_dir = Path(target_dir)
+        self.target_dir.mkdir(parents=True, exist_ok=True)
+        self.fetch = fetch or InstaloaderFetcher()
+        self.bucket = TokenBucket(rate, burst)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+
+        Path(queue_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(queue_path), timeout=30, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS retries (
+                shortcode TEXT PRIMARY KEY,
+                attempts INTEGER NOT NULL,
+                next_attempt REAL NOT NULL,
+                last_error TEXT
+            )""")
+        self.conn.commit()
+
+    def _entry(self, shortcode):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT attempts, next_attempt, last_error FROM retries WHERE shortcode = ?", (shortcode,)
+            ).fetchone()
+
+    def _record_failure(self, shortcode, error, permanent=False):
+        entry = self._entry(shortcode)
+        attempts = (entry[0] if entry else 0) + 1
+        if permanent or attempts >= self.max_attempts:
+            next_attempt = float("inf")
+        else:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+            next_attempt = time.time() + delay * random.uniform(1.0, 1.25)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO retries (shortcode, attempts, next_attempt, last_error) VALUES (?, ?, ?, ?)",
+                (shortcode, attempts, next_attempt, error)
+            )
+            self.conn.commit()
+
+    def _clear(self, shortcode):
+        with self.lock:
+            self.conn.execute("DELETE FROM retries WHERE shortcode = ?", (shortcode,))
+            self.conn.commit()
+
+    def last_error(self, shortcode):
+        entry = self._entry(shortcode)
+        return entry[2] if entry else None
+
+    def due(self, now=None):
+        """
+        Shortcodes in the retry queue whose next attempt time has passed.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT shortcode FROM retries WHERE next_attempt <= ? ORDER BY next_attempt", (now,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def pending(self):
+        """
+        [(shortcode, attempts, next_attempt, last_error)] still waiting for a retry.
+        """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT shortcode, attempts, next_attempt, last_error FROM retries ORDER BY next_attempt"
+            ).fetchall()
+
+    def download(self, shortcode):
+        entry = self._entry(shortcode)
+        if entry and entry[1] > time.time():
+            # Backing off (or given up); the existing folder, if any, is still used
+            return False
+
+        self.bucket.acquire()
+        print(f"Downloading post: {shortcode}")
+        start = time.perf_counter()
+        outcome = {"items": 1}
+        ok = False
+        try:
+            self.fetch(shortcode, self.target_dir)
+        except RateLimited as e:
+            print(f"Rate limited on {shortcode}: {e}")
+            outcome["rate_limited"] = 1
+            self._record_failure(shortcode, f"rate limited: {e}")
+            # Everyone backs off, not just this post
+            self.bucket.pause(self.backoff_base)
+            return False
+        except PermanentFailure as e:
+            print(f"Failed to download {shortcode}: {e}")
+            self._record_failure(shortcode, str(e), permanent=True)
+            return False
+        except Exception as e:
+            print(f"Failed to download {shortcode}: {e}")
+            self._record_failure(shortcode, str(e))
+            return False
+        else:
+            ok = True
+            post_dir = self.target_dir / shortcode
+            if post_dir.exists():
+                outcome["bytes"] = sum(f.stat().st_size for f in post_dir.iterdir() if f.is_file())
+        finally:
+            record("download", time.perf_counter() - start, ok=ok, **outcome)
+
+        self._clear(shortcode)
+        return True
+
+_downloaders = {}
+_downloaders_lock = threading.Lock()
+
+def get_downloader(target_dir="data/raw"):
+    """
+    Shared Downloader per target directory (one session and rate limit per process).
+    """
+    key = str(Path(target_dir).resolve())
+    with _downloaders_lock:
+        if key not in _downloaders:
+            _downloaders[key] = Downloader(target_dir)
+        return _downloaders[key]
@@ -1,6 +1,8 @@
-import torch
 import warnings
 from pathlib import Path
+from src.media_cache import cached, package_version
+from src.audio import decode_audio, SAMPLE_RATE
+from src.metrics import timed
 
 # Suppress warnings
 warnings.filterwarnings("ignore")
@@ -11,6 +13,7 @@ _utils = None
 def get_vad_model():
     global _model, _utils
     if _model is None:
+        import torch
         # Load Silero VAD
         # force_reload=True can be removed after first successful run if needed
         model, utils = torch.hub.load(repo_or_dir='snakers4/silero-vad',
@@ -21,28 +24,42 @@ def get_vad_model():
         _utils = utils
     return _model, _utils
 
+VAD_MODEL_ID = f"silero-vad:torch-{package_version('torch')}"
+
+def speech_segments(audio_path):
+    """
+    [(start_sec, end_sec)] of detected speech, cached per file.
+    Works on the shared 16 kHz decode (src.audio), which Whisper reuses.
+    Raises if the audio can't be decoded.
+    """
+    def run():
+        import torch
+        model, utils = get_vad_model()
+        get_speech_timestamps = utils[0]
+        
+        audio = decode_audio(audio_path)
+        if not len(audio):
+            return []
+        # Copy: the decoded array is a read-only memory map
+        with timed("vad", media_seconds=len(audio) / SAMPLE_RATE, items=1):
+            wav = torch.tensor(audio)
+            speech_timestamps = get_speech_timestamps(wav, model, sampling_rate=SAMPLE_RATE)
+        # get_speech_timestamps returns start/end in samples
+        return [[ts['start'] / SAMPLE_RATE, ts['end'] / SAMPLE_RATE] for ts in speech_timestamps]
+    return cached("vad_segments", audio_path, VAD_MODEL_ID, run)
+
+def speech_duration(audio_path):
+    """
+    Total seconds of detected speech. Raises if the audio can't be decoded.
+    """
+    return sum(end - start for start, end in speech_segments(audio_path))
+
 def check_audio_speech(audio_path, threshold_seconds=3.0):
     """
     Returns True if speech segments total > threshold_seconds.
     """
-    model, utils = get_vad_model()
-    (get_speech_timestamps, save_audio, read_audio, VADIterator, collect_chunks) = utils
-    
     try:
-        wav = read_audio(str(audio_path))
-        speech_timestamps = get_speech_timestamps(wav, model, sampling_rate=16000)
-        
-        total_duration = 0
-        for ts in speech_timestamps:
-            # timestamps are in samples (likely 16k rate? verify)
-            # Silero read_audio normalizes and returns tensor. 
-            # get_speech_timestamps returns dict with start/end in samples.
-            start = ts['start']
-            end = ts['end']
-            duration_samples = end - start
-            duration_sec = duration_samples / 16000
-            total_duration += duration_sec
-            
+        total_duration = speech_duration(audio_path)
         print(f"File: {audio_path}, Speech duration: {total_duration:.2f}s")
         return total_duration > threshold_seconds
         
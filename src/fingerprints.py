@@ -0,0 +1,292 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from src.media_cache import cached, cache_get
+
+# Near-duplicate media across posts: reposted memes, the same slide in two
+# carousels, a Reel re-uploaded by another account. Images and keyframes get a
+# 64-bit perceptual hash, videos an audio fingerprint. The hashes live in
+# their own index; the hashes/fingerprints themselves are cached per file in
+# the media cache like any other model output.
+FINGERPRINT_PATH = "data/fingerprints.sqlite"
+
+PHASH_MODEL = "phash-dct8"
+AUDIO_FP_MODEL = "hk-33band"
+
+# Differing bits (of 64) for two images to count as the same picture
+IMAGE_MAX_DISTANCE = 6
+# The hash is too coarse to see text: slides of one template with different
+# wording are only a few bits apart. Candidates are compared again as
+# grayscale images large enough for text to show (mean brightness removed);
+# the largest 3x3 average difference must stay below TEXT_MAX_DIFFERENCE
+TEXT_CHECK_SIZE = 320
+TEXT_MAX_DIFFERENCE = 27
+# The index looks candidates up by 8-bit bands of the hash: with at most 7
+# differing bits at least one band is identical, so no match is missed
+HASH_BANDS = 8
+
+# Share of a video's keyframes that need a near-identical keyframe in the other video
+KEYFRAME_MATCH_SHARE = 0.5
+# Audio bit error rate below which two soundtracks are the same recording
+AUDIO_MAX_BER = 0.25
+AUDIO_MIN_SECONDS = 3.0
+
+_conn = None
+_conn_pid = None
+_lock = threading.Lock()
+
+def _connect():
+    global _conn, _conn_pid
+    if _conn is None or _conn_pid != os.getpid():
+        Path(FINGERPRINT_PATH).parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(FINGERPRINT_PATH, timeout=30, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        bands = ", ".join(f"b{i} INTEGER" for i in range(HASH_BANDS))
+        # source: the video a keyframe was taken from (the image itself otherwise)
+        # path: the file, for the text check (NULL on rows from before it existed)
+        _conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS images (
+                media_hash TEXT PRIMARY KEY,
+                shortcode TEXT NOT NULL,
+                source TEXT NOT NULL,
+                phash INTEGER NOT NULL,
+                {bands},
+                path TEXT
+            )""")
+        if "path" not in {row[1] for row in _conn.execute("PRAGMA table_info(images)")}:
+            _conn.execute("ALTER TABLE images ADD COLUMN path TEXT")
+        for i in range(HASH_BANDS):
+            _conn.execute(f"CREATE INDEX IF NOT EXISTS images_b{i} ON images (b{i})")
+        _conn.execute("CREATE INDEX IF NOT EXISTS images_source ON images (source)")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS videos (
+                media_hash TEXT PRIMARY KEY,
+                shortcode TEXT NOT NULL
+            )""")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS duplicates (
+                shortcode TEXT PRIMARY KEY,
+                duplicate_of TEXT NOT NULL
+            )""")
+        _conn.commit()
+        _conn_pid = os.getpid()
+    return _conn
+
+# Hashing
+
+def image_phash(image, size=32, keep=8):
+    """
+    DCT perceptual hash: the signs of the lowest keep x keep frequencies of the
+    grayscale image (relative to their median), as a 64-bit int.
+    Survives re-encoding, resizing and small overlays such as watermarks.
+    """
+    import cv2
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:keep, :keep].flatten()
+    bits = low > np.median(low[1:])
+    return int(sum(1 << i for i, bit in enumerate(bits) if bit))
+
+def file_phash(path):
+    """
+    image_phash of an image file, cached. None if the file can't be decoded.
+    """
+    def run():
+        import cv2
+        image = cv2.imread(str(path), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+        return None if image is None else image_phash(image)
+    return cached("phash", path, PHASH_MODEL, run)
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def _text_check_image(path):
+    import cv2
+    image = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    small = cv2.resize(image, (TEXT_CHECK_SIZE, TEXT_CHECK_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    return small - small.mean()
+
+def text_difference(a, b):
+    """
+    Largest local difference between two _text_check_image() arrays: low for
+    re-encodes, resizes and brightness changes, high wherever the text differs.
+    """
+    import cv2
+    return float(cv2.blur(np.abs(a - b), (3, 3)).max())
+
+def audio_fingerprint(audio, sample_rate=16000, window=4096, hop=800, bands=33, low_hz=300, high_hz=2000):
+    """
+    Haitsma-Kalker style fingerprint: per 50 ms frame, 32 bits telling whether
+    the energy difference between neighbouring frequency bands went up or
+    down since the previous frame. Robust to re-encoding and volume changes.
+    Returns a uint32 array (empty for clips shorter than a window).
+    """
+    audio = np.asarray(audio, dtype=np.float32)
+    if len(audio) < window + hop:
+        return np.zeros(0, dtype=np.uint32)
+    frames = np.lib.stride_tricks.sliding_window_view(audio, window)[::hop]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(window), axis=1)) ** 2
+
+    freqs = np.fft.rfftfreq(window, 1.0 / sample_rate)
+    edges = np.geomspace(low_hz, high_hz, bands + 1)
+    energy = np.stack([spectrum[:, (freqs >= lo) & (freqs < hi)].sum(axis=1)
+                       for lo, hi in zip(edges[:-1], edges[1:])], axis=1)
+
+    band_diff = energy[:, :-1] - energy[:, 1:]
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    weights = (1 << np.arange(bands - 1, dtype=np.uint64))
+    return (bits.astype(np.uint64) * weights).sum(axis=1).astype(np.uint32)
+
+def file_audio_fingerprint(path):
+    """
+    audio_fingerprint of a video's soundtrack (from the shared 16 kHz decode), cached.
+    """
+    from src.audio import decode_audio
+    return cached("audio_fp", path, AUDIO_FP_MODEL, lambda: audio_fingerprint(decode_audio(path)).tolist())
+
+def bit_error_rate(a, b, max_shift=20, min_frames=None):
+    """
+    Lowest share of differing bits between two fingerprints over shifts of up
+    to max_shift frames (1 s). None if they don't overlap for long enough.
+    """
+    a = np.asarray(a, dtype=np.uint32)
+    b = np.asarray(b, dtype=np.uint32)
+    if min_frames is None:
+        min_frames = int(AUDIO_MIN_SECONDS * 20)
+    best = None
+    for shift in range(-max_shift, max_shift + 1):
+        x = a[max(shift, 0):]
+        y = b[max(-shift, 0):]
+        n = min(len(x), len(y))
+        if n < min_frames:
+            continue
+        differing = np.unpackbits((x[:n] ^ y[:n]).view(np.uint8)).sum()
+        ber = differing / (32.0 * n)
+        if best is None or ber < best:
+            best = ber
+    return best
+
+# Index
+
+def _signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def _unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+def _bands(phash):
+    return [(phash >> (8 * i)) & 0xFF for i in range(HASH_BANDS)]
+
+def add_image(media_hash, shortcode, phash, source=None, path=None):
+    conn = _connect()
+    with _lock:
+        conn.execute(
+            f"INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, {', '.join('?' * HASH_BANDS)}, ?)",
+            (media_hash, shortcode, source or media_hash, _signed(phash), *_bands(phash),
+             str(path) if path else None)
+        )
+        conn.commit()
+
+def similar_images(phash, max_distance=IMAGE_MAX_DISTANCE, exclude_shortcode=None, path=None):
+    """
+    [(media_hash, shortcode, source, distance)] of indexed images within
+    max_distance bits of phash, closest first.
+    With path (the file phash was taken from), candidates must also pass the
+    text check against it; candidates whose file is unknown or gone are dropped.
+    """
+    conn = _connect()
+    where = " OR ".join(f"b{i} = ?" for i in range(HASH_BANDS))
+    with _lock:
+        rows = conn.execute(f"SELECT media_hash, shortcode, source, phash, path FROM images WHERE {where}",
+                            _bands(phash)).fetchall()
+    matches = []
+    image = None
+    for media_hash, shortcode, source, other, other_path in rows:
+        if shortcode == exclude_shortcode:
+            continue
+        distance = hamming(phash, _unsigned(other))
+        if distance > max_distance:
+            continue
+        if path is not None:
+            if image is None:
+                image = _text_check_image(path)
+            other_image = _text_check_image(other_path) if other_path else None
+            if image is None or other_image is None or text_difference(image, other_image) > TEXT_MAX_DIFFERENCE:
+                continue
+        matches.append((media_hash, shortcode, source, distance))
+    return sorted(matches, key=lambda m: m[3])
+
+def add_video(media_hash, shortcode, keyframes):
+    """
+    Registers a video and its keyframes [(keyframe media_hash, phash, path)].
+    """
+    conn = _connect()
+    with _lock:
+        conn.execute("INSERT OR REPLACE INTO videos VALUES (?, ?)", (media_hash, shortcode))
+        conn.commit()
+    for frame_hash, phash, path in keyframes:
+        add_image(frame_hash, shortcode, phash, source=media_hash, path=path)
+
+def similar_video(shortcode, keyframes, audio_fp=None):
+    """
+    (media_hash, shortcode) of an indexed video from another post that shows
+    the same keyframes [(phash, path)] (KEYFRAME_MATCH_SHARE of them) and,
+    when both have a soundtrack, has the same audio. Audio alone is not
+    enough: many Reels use the same trending sound.
+    """
+    if not keyframes:
+        return None
+    conn = _connect()
+    votes = {}
+    for phash, path in keyframes:
+        sources = {source for _, _, source, _ in similar_images(phash, exclude_shortcode=shortcode, path=path)}
+        for source in sources:
+            votes[source] = votes.get(source, 0) + 1
+
+    needed = max(1, int(np.ceil(KEYFRAME_MATCH_SHARE * len(keyframes))))
+    for source, count in sorted(votes.items(), key=lambda v: -v[1]):
+        if count < needed:
+            break
+        with _lock:
+            row = conn.execute("SELECT shortcode FROM videos WHERE media_hash = ?", (source,)).fetchone()
+        if not row:
+            continue
+        other_fp = cache_get("audio_fp", source, AUDIO_FP_MODEL)
+        if audio_fp is not None and len(audio_fp) and other_fp:
+            ber = bit_error_rate(audio_fp, other_fp)
+            if ber is None or ber > AUDIO_MAX_BER:
+                continue
+        return source, row[0]
+    return None
+
+def set_duplicate(shortcode, duplicate_of=None):
+    """
+    Records that shortcode's media all appeared in duplicate_of first
+    (None clears it). Chains are resolved, so the link is always to the original.
+    """
+    conn = _connect()
+    with _lock:
+        if duplicate_of:
+            conn.execute("INSERT OR REPLACE INTO duplicates VALUES (?, ?)", (shortcode, _canonical(conn, duplicate_of)))
+        else:
+            conn.execute("DELETE FROM duplicates WHERE shortcode = ?", (shortcode,))
+        conn.commit()
+
+def _canonical(conn, shortcode):
+    row = conn.execute("SELECT duplicate_of FROM duplicates WHERE shortcode = ?", (shortcode,)).fetchone()
+    return row[0] if row else shortcode
+
+def canonical(shortcode):
+    """
+    The post shortcode is a duplicate of, or shortcode itself.
+    """
+    conn = _connect()
+    with _lock:
+        return _canonical(conn, shortcode)
@@ -1,122 +1,258 @@
 import json
-import os
-import instaloader
+from collections import namedtuple
 from pathlib import Path
 
-def load_shortcodes(path):
+# URL path marker -> media kind
+KINDS = {'p': 'post', 'reel': 'reel', 'reels': 'reel', 'tv': 'tv'}
+
+def _parse_url(url):
     """
-    Parses the user provided JSON(s) to extract shortcodes.
-    Accepts a file path or a directory path.
+    Returns (shortcode, kind) for an Instagram post URL, or (None, None).
+    """
+    # expected: https://www.instagram.com/reel/C0ZlFU_Ndua/
+    parts = url.strip('/').split('/')
+    for marker in ['p', 'reel', 'reels', 'tv']:
+        if marker in parts:
+            idx = parts.index(marker)
+            if len(parts) > idx + 1:
+                return parts[idx+1], KINDS[marker]
+    return None, None
+
+def _fix_text(text):
+    # Instagram exports UTF-8 text escaped as Latin-1 ("BeÄ\x9fendiÄ\x9fim" -> "Beğendiğim")
+    try:
+        return text.encode('latin-1').decode('utf-8')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return text
+
+def _collection_header(item):
+    # Collection exports list a header item, followed by the posts saved in it
+    if item.get('title') == 'Collection':
+        name = item.get('string_map_data', {}).get('Name', {})
+        if 'href' not in name:
+            return _fix_text(name.get('value', ''))
+    return None
+
+def _added_time(item):
+    fields = item.get('string_map_data', {})
+    return (fields.get('Added Time', {}).get('timestamp')
+            or fields.get('Saved on', {}).get('timestamp'))
+
+# Top-level keys whose arrays hold the saved items
+ARRAY_KEYS = ('saved_saved_media', 'saved_saved_collections')
+
+# Characters that can continue a JSON number
+NUMBER_CHARS = frozenset("0123456789+-.eE")
+
+PostRecord = namedtuple("PostRecord", ["shortcode", "collection", "added_time", "kind"])
+
+class _Stream:
+    """
+    Minimal incremental JSON reader: decodes one value at a time from a file
+    read in chunks, so only the current item is held in memory.
+    """
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        # Drop what has been consumed, then read the next chunk
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buf += chunk
+
+    def peek(self):
+        """
+        Next non-whitespace character without consuming it ("" at end of file).
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos] if self.pos < len(self.buf) else ""
+            self._fill()
+
+    def take(self, expected):
+        if self.peek() != expected:
+            raise ValueError(f"Expected '{expected}' at offset {self.pos}, got '{self.peek()}'")
+        self.pos += 1
+
+    def value(self):
+        """
+        Decodes the next complete JSON value, reading more of the file as needed.
+        """
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number touching the end of the buffer may continue in the next chunk
+                # ("-2.5e10" read as far as "-2." decodes as -2)
+                if (self.eof or not isinstance(obj, (int, float))
+                        or (end < len(self.buf) and self.buf[end] not in NUMBER_CHARS)):
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def array_items(self):
+        self.take('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.take(']')
+            return
+
+def _iter_items(f):
+    """
+    Yields the saved items of one export file: the items of the known arrays
+    of a top-level object, the items of a top-level array, or a single item.
+    """
+    stream = _Stream(f)
+    first = stream.peek()
+    if first == '[':
+        yield from stream.array_items()
+        return
+    if first != '{':
+        raise ValueError("Not a JSON object or array")
+
+    stream.take('{')
+    found_array = False
+    rest = {}
+    while stream.peek() != '}':
+        key = stream.value()
+        stream.take(':')
+        if key in ARRAY_KEYS and stream.peek() == '[':
+            found_array = True
+            yield from stream.array_items()
+        else:
+            rest[key] = stream.value()
+        if stream.peek() == ',':
+            stream.pos += 1
+
+    # If no known keys found, check if it looks like a single item
+    if not found_array and 'string_map_data' in rest:
+        yield rest
+
+def _item_record(item, collection):
+    shortcode = None
+    kind = None
+    # 1. Try 'string_map_data' -> 'Shortcode' -> 'value' (saved_media format)
+    if 'string_map_data' in item:
+        # Case A: Explicit Shortcode
+        shortcode = item['string_map_data'].get('Shortcode', {}).get('value')
+        
+        # Case B: Name -> href (collections format)
+        # Case C: Saved on -> href (saved_posts format)
+        for field in ('Name', 'Saved on'):
+            if shortcode:
+                break
+            href = item['string_map_data'].get(field, {}).get('href')
+            if href:
+                shortcode, kind = _parse_url(href)
+
+    # 2. Fallback: direct keys
+    if not shortcode and 'shortcode' in item:
+        shortcode = item['shortcode']
+    elif not shortcode and 'link' in item:
+        # https://www.instagram.com/p/Cz7.../
+        shortcode, kind = _parse_url(item['link'])
+
+    if not shortcode:
+        return None
+    return PostRecord(shortcode, collection, _added_time(item), kind)
+
+def iter_posts(path):
+    """
+    Streams PostRecord(shortcode, collection, added_time, kind) tuples from an
+    export file or a directory of them, in export order, while reading.
+    Memory stays flat regardless of export size. Duplicates are not removed
+    (a post saved in two collections appears twice).
     """
     path_obj = Path(path)
     if path_obj.is_dir():
-        files = list(path_obj.glob("*.json"))
+        files = sorted(path_obj.glob("*.json"))
     else:
         files = [path_obj]
-        
-    shortcodes = []
-    
+
     for json_path in files:
         if not json_path.exists():
             continue
             
         try:
             with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            posts_list = []
-            if isinstance(data, dict):
-                # Try to find list in known keys
-                if 'saved_saved_media' in data:
-                    posts_list.extend(data['saved_saved_media'])
-                if 'saved_saved_collections' in data:
-                    posts_list.extend(data['saved_saved_collections'])
-                
-                # If no known keys found, check if it looks like a single item or unknown list
-                if not posts_list:
-                    if 'string_map_data' in data:
-                        posts_list.append(data)
-            elif isinstance(data, list):
-                posts_list = data
-
-            for item in posts_list:
-                if not isinstance(item, dict):
-                    continue
-
-                # 1. Try 'string_map_data' -> 'Shortcode' -> 'value' (saved_media format)
-                if 'string_map_data' in item:
-                    # Case A: Explicit Shortcode
-                    shortcode = item['string_map_data'].get('Shortcode', {}).get('value')
-                    if shortcode:
-                        shortcodes.append(shortcode)
+                collection = None
+                for item in _iter_items(f):
+                    if not isinstance(item, dict):
                         continue
-                    
-                    # Case B: Name -> href (collections format)
-                    href = item['string_map_data'].get('Name', {}).get('href')
-                    if href:
-                        # expected: https://www.instagram.com/reel/C0ZlFU_Ndua/
-                        parts = href.strip('/').split('/')
-                        for marker in ['p', 'reel', 'reels', 'tv']:
-                            if marker in parts:
-                                idx = parts.index(marker)
-                                if len(parts) > idx + 1:
-                                    shortcodes.append(parts[idx+1])
-                                    break
-                        continue # Found or not, we processed this item via string_map_data
-
-                # 2. Fallback: direct keys
-                if 'shortcode' in item:
-                    shortcodes.append(item['shortcode'])
-                elif 'link' in item:
-                    # https://www.instagram.com/p/Cz7.../
-                    url = item['link']
-                    parts = url.strip('/').split('/')
-                    for marker in ['p', 'reel', 'reels', 'tv']:
-                        if marker in parts:
-                            idx = parts.index(marker)
-                            if len(parts) > idx + 1:
-                                shortcodes.append(parts[idx+1])
-                                break
+
+                    header = _collection_header(item)
+                    if header is not None:
+                        collection = header
+                        continue
+
+                    record = _item_record(item, collection)
+                    if record:
+                        yield record
                                 
         except Exception as e:
             print(f"Error parsing {json_path}: {e}")
-            
-    return list(set(shortcodes)) # Unique
+
+def load_shortcodes(path):
+    """
+    Parses the user provided JSON(s) to extract shortcodes.
+    Accepts a file path or a directory path.
+    """
+    return [post['shortcode'] for post in load_posts(path)]
+
+def load_posts(path):
+    """
+    Like load_shortcodes, but returns one dict per unique post, in export order:
+    {"shortcode": ..., "added_time": unix timestamp or None,
+     "kind": "post" / "reel" / "tv" / None, "collections": [collection titles]}
+    A post saved in several collections is returned once with all of them.
+    """
+    # Unique, keeping the first occurrence and merging what later ones add
+    unique = {}
+    for record in iter_posts(path):
+        post = unique.get(record.shortcode)
+        if post is None:
+            unique[record.shortcode] = {
+                "shortcode": record.shortcode,
+                "added_time": record.added_time,
+                "kind": record.kind,
+                "collections": [record.collection] if record.collection else [],
+            }
+            continue
+        if post['added_time'] is None:
+            post['added_time'] = record.added_time
+        post['kind'] = post['kind'] or record.kind
+        if record.collection and record.collection not in post['collections']:
+            post['collections'].append(record.collection)
+    return list(unique.values())
 
 def download_post(shortcode, target_dir="data/raw"):
     """
     Downloads a post by shortcode using Instaloader.
     Saves to data/raw/{shortcode}
+    Goes through the shared Downloader: one session, rate limited, failures
+    queued for a later retry with backoff (see src/downloader.py).
     """
-    # Ensure target directory exists
-    raw_dir = Path(target_dir).resolve()
-    raw_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Initialize Instaloader
-    L = instaloader.Instaloader(
-        download_pictures=True,
-        download_videos=True, 
-        download_video_thumbnails=False,
-        download_geotags=False,
-        download_comments=False,
-        save_metadata=True,
-        compress_json=False
-    )
-    
-    print(f"Downloading post: {shortcode}")
-    
-    # Change CWD to target_dir so instaloader creates the folder there
-    original_cwd = os.getcwd()
-    try:
-        os.chdir(raw_dir)
-        post = instaloader.Post.from_shortcode(L.context, shortcode)
-        L.download_post(post, target=shortcode)
-        return True
-    except Exception as e:
-        print(f"Failed to download {shortcode}: {e}")
-        return False
-    finally:
-        os.chdir(original_cwd)
+    from src.downloader import get_downloader
+    return get_downloader(target_dir).download(shortcode)
 
 if __name__ == "__main__":
     # Test
@@ -0,0 +1,124 @@
+import cv2
+import numpy as np
+from pathlib import Path
+from src.metrics import timed
+
+# Default number of distinct frames OCR'd per video (recall vs CPU time)
+KEYFRAME_BUDGET = 6
+
+# Frames are compared on small HSV histograms; frames closer than this
+# (Bhattacharyya distance, 0 = identical) to an already chosen frame are skipped
+SCENE_CHANGE_THRESHOLD = 0.3
+
+def _signature(frame, width=160):
+    h, w = frame.shape[:2]
+    small = cv2.resize(frame, (width, max(1, int(h * width / w))), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, [8, 4, 4], [0, 180, 0, 256, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+def _read_at(cap, index):
+    # Seek instead of decoding every frame in between
+    cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+    ok, frame = cap.read()
+    return frame if ok else None
+
+def select_keyframes(video_path, max_frames=KEYFRAME_BUDGET, candidates_per_frame=4,
+                     threshold=SCENE_CHANGE_THRESHOLD):
+    """
+    Picks up to max_frames visually distinct frames from a video.
+    Samples max_frames * candidates_per_frame evenly spaced positions, fingerprints
+    each with a small colour histogram, then greedily keeps the frame farthest from
+    everything chosen so far until the budget is used or the rest look the same.
+    Returns [(frame_index, frame)] in time order.
+    """
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        return []
+    try:
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total <= 0:
+            frame = _read_at(cap, 0)
+            return [(0, frame)] if frame is not None else []
+
+        n_candidates = min(total, max(1, max_frames * candidates_per_frame))
+        # Skip the very last frames, they are often black/fade-out
+        positions = np.linspace(0, max(total - 2, 0), n_candidates).astype(int)
+
+        signatures = {}
+        for pos in dict.fromkeys(positions.tolist()):
+            frame = _read_at(cap, pos)
+            if frame is not None:
+                signatures[pos] = _signature(frame)
+        if not signatures:
+            return []
+
+        order = list(signatures)
+        chosen = [order[0]]
+        distance = {
+            pos: cv2.compareHist(signatures[pos], signatures[order[0]], cv2.HISTCMP_BHATTACHARYYA)
+            for pos in order
+        }
+        while len(chosen) < max_frames:
+            pos = max((p for p in order if p not in chosen), key=lambda p: distance[p], default=None)
+            if pos is None or distance[pos] < threshold:
+                break
+            chosen.append(pos)
+            for p in order:
+                d = cv2.compareHist(signatures[p], signatures[pos], cv2.HISTCMP_BHATTACHARYYA)
+                distance[p] = min(distance[p], d)
+
+        frames = []
+        for pos in sorted(chosen):
+            frame = _read_at(cap, pos)
+            if frame is not None:
+                frames.append((pos, frame))
+        return frames
+    finally:
+        cap.release()
+
+def extract_keyframes(video_path, max_frames=KEYFRAME_BUDGET, max_side=1280):
+    """
+    Writes the selected keyframes next to the video as {stem}_keyframe_NN.jpg
+    (downscaled so the long side is at most max_side) and returns their paths.
+    Keyframes from an earlier run are reused as-is.
+    """
+    video_path = Path(video_path)
+    existing = sorted(video_path.parent.glob(f"{video_path.stem}_keyframe_*.jpg"))
+    if existing:
+        return existing[:max_frames]
+
+    paths = []
+    with timed("keyframes", bytes=video_path.stat().st_size) as m:
+        for i, (pos, frame) in enumerate(select_keyframes(video_path, max_frames=max_frames)):
+            h, w = frame.shape[:2]
+            scale = max_side / max(h, w)
+            if scale < 1:
+                frame = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+            path = video_path.with_name(f"{video_path.stem}_keyframe_{i:02d}.jpg")
+            cv2.imwrite(str(path), frame)
+            paths.append(path)
+        m["items"] = len(paths)
+    return paths
+
+def dedupe_lines(texts):
+    """
+    Merges OCR output of several frames, dropping text already seen
+    (overlays usually stay on screen across many frames).
+    """
+    seen = []
+    lines = []
+    for text in texts:
+        norm = " ".join(text.lower().split())
+        if not norm:
+            continue
+        if any(norm in s for s in seen):
+            continue
+        # A longer version of an earlier line replaces it
+        replaced = [i for i, s in enumerate(seen) if s in norm]
+        for i in reversed(replaced):
+            del seen[i]
+            del lines[i]
+        seen.append(norm)
+        lines.append(text.strip())
+    return lines
@@ -0,0 +1,80 @@
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+# BM25 keyword index (SQLite FTS5) kept next to the Chroma collection.
+# Dense MiniLM search is weak on exact tokens such as handles, product
+# names or prices; this index catches those and rag_db fuses both rankings.
+LEXICAL_PATH = "data/lexical.sqlite"
+
+_conn = None
+_lock = threading.Lock()
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def _connect():
+    global _conn
+    if _conn is None:
+        Path(LEXICAL_PATH).parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(LEXICAL_PATH, timeout=30, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        # remove_diacritics: "fotoğraf" also matches "fotograf"
+        _conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+                shortcode UNINDEXED,
+                content,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )""")
+        # shortcode -> FTS rowid. The shortcode column of posts_fts can't be
+        # indexed, so replacing a post looks its row up here instead of scanning.
+        created = not _conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'post_rows'").fetchone()
+        _conn.execute("CREATE TABLE IF NOT EXISTS post_rows (shortcode TEXT PRIMARY KEY, fts_rowid INTEGER NOT NULL)")
+        if created:
+            # Indexes built before the lookup table existed
+            _conn.execute("INSERT OR REPLACE INTO post_rows (shortcode, fts_rowid) SELECT shortcode, rowid FROM posts_fts")
+        _conn.commit()
+    return _conn
+
+def upsert_documents(items):
+    """
+    items: [(shortcode, content)]. Replaces any previous text for those shortcodes.
+    """
+    items = list(items)
+    if not items:
+        return
+    conn = _connect()
+    with _lock:
+        for code, content in items:
+            row = conn.execute("SELECT fts_rowid FROM post_rows WHERE shortcode = ?", (code,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM posts_fts WHERE rowid = ?", row)
+            rowid = conn.execute("INSERT INTO posts_fts (shortcode, content) VALUES (?, ?)", (code, content)).lastrowid
+            conn.execute("INSERT OR REPLACE INTO post_rows (shortcode, fts_rowid) VALUES (?, ?)", (code, rowid))
+        conn.commit()
+
+def count():
+    conn = _connect()
+    with _lock:
+        return conn.execute("SELECT COUNT(*) FROM posts_fts").fetchone()[0]
+
+def to_match_query(text):
+    # Any of the query words; each quoted so FTS5 syntax in user input is inert
+    tokens = dict.fromkeys(t.lower() for t in TOKEN_RE.findall(text))
+    return " OR ".join(f'"{t}"' for t in tokens)
+
+def search(query_text, limit=50):
+    """
+    Returns [(shortcode, bm25_score)] best first (lower bm25 = better in SQLite).
+    """
+    match = to_match_query(query_text)
+    if not match:
+        return []
+    conn = _connect()
+    with _lock:
+        return conn.execute(
+            "SELECT shortcode, bm25(posts_fts) AS score FROM posts_fts WHERE posts_fts MATCH ? "
+            "ORDER BY score LIMIT ?",
+            (match, limit)
+        ).fetchall()
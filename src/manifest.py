@@ -0,0 +1,262 @@
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Per-shortcode sync state, so re-runs only touch new or failed posts.
+MANIFEST_PATH = "data/sync_manifest.sqlite"
+
+# Held by the process running the pipeline, so the app and a cron job never ingest at once
+LOCK_PATH = "data/pipeline.pid"
+
+LISTED = "listed"
+DOWNLOADED = "downloaded"
+PROCESSED = "processed"
+INDEXED = "indexed"
+FAILED = "failed"
+# Processed without error but nothing to index; not retried unless its export entry changes
+EMPTY = "empty"
+STATES = (LISTED, DOWNLOADED, PROCESSED, INDEXED, FAILED, EMPTY)
+
+_conn = None
+
+def _connect():
+    global _conn
+    if _conn is None:
+        Path(MANIFEST_PATH).parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(MANIFEST_PATH, timeout=30, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                shortcode TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                added_time INTEGER,
+                reason TEXT,
+                updated_at REAL NOT NULL,
+                collections TEXT,
+                kind TEXT,
+                result TEXT,
+                result_key TEXT
+            )""")
+        # Manifests created before these were recorded
+        columns = {row[1] for row in _conn.execute("PRAGMA table_info(posts)")}
+        for column in ("collections", "kind", "result", "result_key"):
+            if column not in columns:
+                _conn.execute(f"ALTER TABLE posts ADD COLUMN {column} TEXT")
+        _conn.commit()
+    return _conn
+
+def sync(posts, indexed_ids):
+    """
+    Bulk diff of the export (load_posts output) against what the index holds.
+    New posts are recorded as listed, posts found in the index are marked indexed.
+    Empty posts are left out until their export entry (saved time or kind) changes.
+    Returns the shortcodes that still need work, in export order. Their
+    downloaded/processed states are kept, so run_pipeline resumes each one
+    from its last completed stage.
+    """
+    conn = _connect()
+    now = time.time()
+    indexed_ids = set(indexed_ids)
+
+    known = {code: (state, added_time, kind) for code, state, added_time, kind
+             in conn.execute("SELECT shortcode, state, added_time, kind FROM posts")}
+    rows = []
+    pending = []
+    for post in posts:
+        code = post['shortcode']
+        state, added_time, kind = known.get(code, (LISTED, None, None))
+        if code in indexed_ids:
+            state = INDEXED
+        elif state == INDEXED:
+            # Recorded as indexed but gone from the collection (e.g. DB was reset)
+            state = LISTED
+        elif state == EMPTY and ((post.get('added_time') or added_time) != added_time
+                                 or (post.get('kind') or kind) != kind):
+            # Saved again or now listed differently: worth another look
+            state = LISTED
+        rows.append((code, state, post.get('added_time'), "|".join(post.get('collections') or []), post.get('kind'), now))
+        if state not in (INDEXED, EMPTY):
+            pending.append(code)
+
+    conn.executemany("""
+        INSERT INTO posts (shortcode, state, added_time, collections, kind, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(shortcode) DO UPDATE SET
+            state = excluded.state,
+            added_time = COALESCE(excluded.added_time, posts.added_time),
+            collections = excluded.collections,
+            kind = COALESCE(excluded.kind, posts.kind),
+            reason = CASE WHEN excluded.state = posts.state THEN posts.reason ELSE NULL END,
+            result = CASE WHEN excluded.state = posts.state THEN posts.result ELSE NULL END,
+            updated_at = excluded.updated_at
+    """, rows)
+    conn.commit()
+    return pending
+
+def mark(shortcodes, state, reason=None, result=None, result_key=None):
+    """
+    Record a state transition for one shortcode or a list of them.
+    result: the processed post (with state PROCESSED), kept until the next
+    transition so a killed run can index it without processing it again;
+    result_key identifies its inputs (see processor.post_signature).
+    """
+    if isinstance(shortcodes, str):
+        shortcodes = [shortcodes]
+    conn = _connect()
+    now = time.time()
+    stored = json.dumps(result) if result is not None else None
+    conn.executemany("""
+        INSERT INTO posts (shortcode, state, reason, result, result_key, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(shortcode) DO UPDATE SET
+            state = excluded.state, reason = excluded.reason, result = excluded.result,
+            result_key = excluded.result_key, updated_at = excluded.updated_at
+    """, [(code, state, reason, stored, result_key, now) for code in shortcodes])
+    conn.commit()
+
+def processed_result(shortcode, result_key):
+    """
+    The result stored by mark(shortcode, PROCESSED, result=...), or None if
+    the post has moved on or its inputs changed (result_key differs).
+    """
+    if result_key is None:
+        return None
+    row = _connect().execute(
+        "SELECT result FROM posts WHERE shortcode = ? AND state = ? AND result_key = ? AND result IS NOT NULL",
+        (shortcode, PROCESSED, result_key)
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+def states(shortcodes):
+    """
+    {shortcode: state} for the given shortcodes that are in the manifest.
+    """
+    conn = _connect()
+    shortcodes = list(shortcodes)
+    found = {}
+    # Stays under SQLite's bound-parameter limit
+    for start in range(0, len(shortcodes), 500):
+        batch = shortcodes[start:start + 500]
+        found.update(conn.execute(
+            f"SELECT shortcode, state FROM posts WHERE shortcode IN ({','.join('?' * len(batch))})", batch
+        ).fetchall())
+    return found
+
+def summary():
+    """
+    Number of posts per state.
+    """
+    conn = _connect()
+    counts = dict.fromkeys(STATES, 0)
+    counts.update(conn.execute("SELECT state, COUNT(*) FROM posts GROUP BY state").fetchall())
+    return counts
+
+def collections():
+    """
+    Sorted names of all collections seen in the exports.
+    """
+    conn = _connect()
+    names = set()
+    for (joined,) in conn.execute("SELECT DISTINCT collections FROM posts WHERE collections != ''"):
+        names.update(joined.split("|"))
+    return sorted(names)
+
+def years():
+    """
+    Years in which listed posts were saved, newest first.
+    """
+    conn = _connect()
+    rows = conn.execute("""
+        SELECT DISTINCT CAST(strftime('%Y', added_time, 'unixepoch') AS INTEGER) AS year
+        FROM posts WHERE added_time IS NOT NULL ORDER BY year DESC
+    """).fetchall()
+    return [row[0] for row in rows]
+
+def failures():
+    """
+    (shortcode, reason) for every failed post.
+    """
+    conn = _connect()
+    return conn.execute("SELECT shortcode, reason FROM posts WHERE state = ? ORDER BY updated_at", (FAILED,)).fetchall()
+
+class AlreadyRunning(Exception):
+    """
+    Another process holds the pipeline lock.
+    """
+
+def running_pid():
+    """
+    PID of the pipeline run currently holding the lock, or None.
+    """
+    try:
+        with open(LOCK_PATH, 'r') as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+    except (FileNotFoundError, ValueError, ProcessLookupError):
+        return None
+    except PermissionError:
+        # Alive, but owned by another user
+        pass
+    return pid
+
+def _acquire_lock():
+    """
+    Opens LOCK_PATH and takes an exclusive lock on it. Returns the open fd.
+    The lock is an fcntl.flock: the OS drops it when the holder dies, so a
+    killed run never blocks the next one. Without fcntl (Windows) the file is
+    created with O_EXCL and a file left by a dead process is replaced.
+    """
+    Path(LOCK_PATH).parent.mkdir(parents=True, exist_ok=True)
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+
+    for _ in range(10):
+        if fcntl is None:
+            try:
+                return os.open(LOCK_PATH, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if running_pid() is not None:
+                    break
+                try:
+                    os.remove(LOCK_PATH)
+                except FileNotFoundError:
+                    pass
+                continue
+
+        fd = os.open(LOCK_PATH, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            break
+        try:
+            # The previous holder may have removed the file between our open and flock
+            if os.fstat(fd).st_ino == os.stat(LOCK_PATH).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+    raise AlreadyRunning(f"A pipeline run is already in progress (pid {running_pid()}, {LOCK_PATH})")
+
+@contextmanager
+def run_lock():
+    """
+    Held for the duration of a pipeline run; raises AlreadyRunning if another
+    run holds it. Taking the lock is atomic, so two runs started at the same
+    moment can't both get it.
+    """
+    fd = _acquire_lock()
+    try:
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        yield
+    finally:
+        # Removed while still locked, so nobody locks the old file afterwards unnoticed
+        try:
+            os.remove(LOCK_PATH)
+        except FileNotFoundError:
+            pass
+        os.close(fd)
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from importlib import metadata
+from pathlib import Path
+
+# Results of expensive model calls (OCR text, VAD verdicts, transcripts),
+# keyed by media content hash + model identity so they survive re-indexing.
+CACHE_PATH = "data/media_cache.sqlite"
+
+_conn = None
+_conn_pid = None
+_lock = threading.Lock()
+
+def _connect():
+    global _conn, _conn_pid
+    # One connection per process (the pipeline runs processing in a process pool)
+    if _conn is None or _conn_pid != os.getpid():
+        Path(CACHE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(CACHE_PATH, timeout=30, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                kind TEXT NOT NULL,
+                media_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (kind, media_hash, model)
+            )""")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                media_hash TEXT NOT NULL
+            )""")
+        _conn.commit()
+        _conn_pid = os.getpid()
+    return _conn
+
+def package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    sha256 of the file contents. Remembered per (path, size, mtime) so
+    unchanged files are not re-read on every run.
+    """
+    path = Path(path).resolve()
+    st = path.stat()
+    conn = _connect()
+    with _lock:
+        row = conn.execute(
+            "SELECT media_hash FROM file_hashes WHERE path = ? AND size = ? AND mtime = ?",
+            (str(path), st.st_size, st.st_mtime)
+        ).fetchone()
+    if row:
+        return row[0]
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    digest = h.hexdigest()
+
+    with _lock:
+        conn.execute(
+            "INSERT OR REPLACE INTO file_hashes (path, size, mtime, media_hash) VALUES (?, ?, ?, ?)",
+            (str(path), st.st_size, st.st_mtime, digest)
+        )
+        conn.commit()
+    return digest
+
+def cache_get(kind, media_hash, model, default=None):
+    """
+    The stored value, or default if there is none (a stored None is returned as None).
+    """
+    conn = _connect()
+    with _lock:
+        row = conn.execute(
+            "SELECT value FROM results WHERE kind = ? AND media_hash = ? AND model = ?",
+            (kind, media_hash, model)
+        ).fetchone()
+    return json.loads(row[0]) if row else default
+
+def cache_put(kind, media_hash, model, value):
+    conn = _connect()
+    with _lock:
+        conn.execute(
+            "INSERT OR REPLACE INTO results (kind, media_hash, model, value) VALUES (?, ?, ?, ?)",
+            (kind, media_hash, model, json.dumps(value))
+        )
+        conn.commit()
+
+_MISSING = object()
+
+def cached(kind, path, model, compute):
+    """
+    Returns the cached result for this file/model, or runs compute() and stores it.
+    None and empty results are cached like any other ("no speech" is a result).
+    Exceptions from compute() propagate and nothing is cached.
+    """
+    media_hash = file_hash(path)
+    value = cache_get(kind, media_hash, model, default=_MISSING)
+    if value is _MISSING:
+        value = compute()
+        cache_put(kind, media_hash, model, value)
+    return value
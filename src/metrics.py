@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: rotation still re-checks the size, without the file lock
+    fcntl = None
+
+# Structured timings for every hot path (download, decode, VAD, Whisper,
+# keyframes, OCR, embedding, upsert, query, LLM), one JSON object per line.
+# Appended from any thread or process; summarize() turns them into p50/p95.
+METRICS_PATH = "data/metrics.jsonl"
+# Past this size the file is moved to METRICS_PATH + ".1" (replacing the previous one)
+MAX_BYTES = 16 * 1024 * 1024
+
+_lock = threading.Lock()
+
+def record(stage, seconds, ok=True, **fields):
+    """
+    Appends one measurement. fields are free-form numbers such as bytes,
+    media_seconds or items.
+    """
+    entry = {"ts": time.time(), "stage": stage, "seconds": round(seconds, 6), "ok": ok, "pid": os.getpid()}
+    entry.update(fields)
+    line = json.dumps(entry) + "\n"
+    try:
+        with _lock:
+            Path(METRICS_PATH).parent.mkdir(parents=True, exist_ok=True)
+            with open(METRICS_PATH, 'a', encoding='utf-8') as f:
+                f.write(line)
+                size = f.tell()
+            if size > MAX_BYTES:
+                _rotate()
+    except OSError as e:
+        print(f"Could not write metrics: {e}")
+
+def _rotate():
+    # Pipeline workers are separate processes: the size check and the rename
+    # happen under a file lock, so a file another process just rotated in isn't
+    # renamed over the one it replaced
+    with open(METRICS_PATH + ".lock", 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.getsize(METRICS_PATH) > MAX_BYTES:
+                os.replace(METRICS_PATH, METRICS_PATH + ".1")
+        except FileNotFoundError:
+            pass
+
+@contextmanager
+def timed(stage, **fields):
+    """
+    with timed("ocr", items=3) as m:
+        ...
+        m["bytes"] = size      # add fields known only at the end
+    An exception is recorded as ok=False and re-raised.
+    """
+    extra = dict(fields)
+    start = time.perf_counter()
+    ok = True
+    try:
+        yield extra
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, ok=ok, **extra)
+
+def load(limit=100000, since=None):
+    """
+    The most recent `limit` measurements (optionally only those after `since`),
+    from the current file and the last rotated one.
+    """
+    lines = deque(maxlen=limit)
+    for path in (METRICS_PATH + ".1", METRICS_PATH):
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                lines.extend(f)
+    entries = []
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if since is None or entry['ts'] >= since:
+            entries.append(entry)
+    return entries
+
+def stamp():
+    """
+    (mtime, size) of the metrics file, to tell whether a summary is still current.
+    """
+    try:
+        stat = os.stat(METRICS_PATH)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(entries):
+    """
+    Per stage: count, errors, p50/p95 latency, total time, and throughput
+    (items, bytes and media seconds per second of stage time, when recorded).
+    Returns a list of dicts sorted by total time, largest first.
+    """
+    stages = {}
+    for entry in entries:
+        stages.setdefault(entry['stage'], []).append(entry)
+
+    rows = []
+    for stage, items in stages.items():
+        durations = sorted(e['seconds'] for e in items)
+        total = sum(durations)
+        row = {
+            "stage": stage,
+            "count": len(items),
+            "errors": sum(1 for e in items if not e.get('ok', True)),
+            "p50_s": round(_percentile(durations, 0.50), 4),
+            "p95_s": round(_percentile(durations, 0.95), 4),
+            "total_s": round(total, 2),
+        }
+        for field, label in (("items", "items_per_s"), ("bytes", "MB_per_s"), ("media_seconds", "media_x_realtime")):
+            amount = sum(e.get(field, 0) for e in items)
+            if amount and total:
+                rate = amount / total
+                row[label] = round(rate / 1e6 if field == "bytes" else rate, 2)
+        rows.append(row)
+    return sorted(rows, key=lambda r: r['total_s'], reverse=True)
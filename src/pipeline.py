@@ -0,0 +1,379 @@
+import argparse
+import os
+import sys
+import time
+import cProfile
+import pstats
+import signal
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from src.ingest import download_post, load_posts
+from src.downloader import get_downloader
+from src.processor import process_posts, post_signature
+from src.keyframes import KEYFRAME_BUDGET
+from src.rag_db import IngestBuffer, EMBED_BATCH_SIZE, post_metadata, indexed_ids, update_post_metadata
+from src import manifest
+from src.profiles import set_profile
+from src.metrics import timed
+
+STAGES = ("downloaded", "processed", "indexed", "failed", "empty")
+
+# Up to this many downloaded posts go to a worker together, so their images are OCR'd as one batch
+POSTS_PER_TASK = 4
+
+# Buffered posts are indexed at least this often, so a killed run loses little work
+CHECKPOINT_SECONDS = 60
+
+def default_process_workers():
+    # Whisper/EasyOCR already use several threads each, so leave some headroom
+    return max(1, (os.cpu_count() or 2) // 2)
+
+def default_threads_per_worker(process_workers):
+    return max(1, (os.cpu_count() or 1) // process_workers)
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+def pin_threads(threads):
+    """
+    Process pool initializer: caps the math libraries of one worker at `threads`
+    threads so N workers don't each start one thread per core.
+    Runs before the worker imports torch/CTranslate2/OpenCV, which read these
+    variables on import (Whisper with cpu_threads=0 follows OMP_NUM_THREADS).
+    """
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    # Forked workers may already have them imported from the parent
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+    if "cv2" in sys.modules:
+        sys.modules["cv2"].setNumThreads(threads)
+
+class InlineExecutor:
+    """
+    Runs each submitted task right away in the calling thread. Used instead of
+    the process pool when profiling, so cProfile sees the OCR/Whisper work.
+    """
+    def __init__(self, max_workers=None, initializer=None, initargs=()):
+        if initializer:
+            initializer(*initargs)
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+@contextmanager
+def profiled(path):
+    """
+    cProfile the block and dump the stats to path (no-op when path is None).
+    """
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"Profile written to {path} (view with: python -m pstats {path})")
+        pstats.Stats(path).sort_stats("cumulative").print_stats(25)
+
+def run_pipeline(shortcodes, raw_dir="data/raw", download_workers=4, process_workers=None,
+                 index_batch_size=EMBED_BATCH_SIZE, precompute_embeddings=False,
+                 keyframe_budget=KEYFRAME_BUDGET, profile=None, posts=None, on_progress=None,
+                 profile_output=None, threads_per_worker=None, posts_per_task=POSTS_PER_TASK):
+    """
+    Runs download -> process -> index as concurrent stages.
+    - Downloads run on a bounded thread pool (network bound).
+    - OCR/transcription runs on a process pool (CPU bound). When posts queue up,
+      up to posts_per_task of them go to a worker together so their OCR is batched.
+    - Processed posts are buffered and indexed in batches.
+    Each stage only takes new work while the next one has room, so a slow
+    processing stage throttles downloads instead of piling up raw media.
+    Every state transition is recorded in the sync manifest, and a post is
+    picked up after the last stage a previous run completed: one recorded as
+    downloaded whose folder is still there isn't downloaded again, and one
+    recorded as processed is indexed from its stored result while its files
+    and the models are unchanged.
+    profile selects the Whisper/OCR model profile (see src/profiles.py).
+    posts: optional load_posts() records; their collection/date/kind are stored
+    as filterable metadata with each indexed post.
+    on_progress(stats) is called from the calling thread (safe for Streamlit).
+    profile_output: path for a cProfile .pstats dump. Processing then runs in
+    this process (one post at a time) so the profile covers it; the top
+    functions are printed at the end.
+    Per-stage timings always go to data/metrics.jsonl (see src/metrics.py).
+    threads_per_worker caps the threads of each processing worker
+    (default: cores / process_workers).
+    Returns the final stats dict.
+    """
+    if profile_output:
+        process_workers = 1
+    elif process_workers is None:
+        process_workers = default_process_workers()
+    if threads_per_worker is None:
+        threads_per_worker = default_threads_per_worker(process_workers)
+    posts_by_code = {post['shortcode']: post for post in posts or []}
+    if profile:
+        # Worker processes inherit the choice through the environment
+        set_profile(profile)
+
+    # Keep the process pool fed, but never queue more than that ahead of it
+    process_slots = process_workers * 2
+    max_ready = process_slots
+
+    todo = deque(shortcodes)
+    ready = deque()  # downloaded, waiting for a processing slot
+    downloading = {}
+    processing = {}
+    download_failed = set()
+    buffer = IngestBuffer(batch_size=index_batch_size, precompute=precompute_embeddings)
+
+    stats = {"total": len(shortcodes), "downloading": 0, "processing": 0, "buffered": 0}
+    for stage in STAGES:
+        stats[stage] = 0
+
+    def report():
+        stats["downloading"] = len(downloading)
+        stats["processing"] = sum(len(codes) for codes in processing.values()) + len(ready)
+        stats["buffered"] = len(buffer)
+        if on_progress:
+            on_progress(dict(stats))
+
+    last_flush = time.monotonic()
+
+    def index(result=None):
+        # add() flushes on its own once a batch is full; index() with no result drains the rest.
+        # A batch that has been filling for CHECKPOINT_SECONDS is written early.
+        nonlocal last_flush
+        codes = [r['shortcode'] for r in buffer.pending] + ([result['shortcode']] if result else [])
+        try:
+            written = buffer.add(result) if result else buffer.flush()
+            if not written and len(buffer) and time.monotonic() - last_flush > CHECKPOINT_SECONDS:
+                written = buffer.flush()
+            if written or not len(buffer):
+                last_flush = time.monotonic()
+            if written:
+                stats["indexed"] += written
+                manifest.mark(codes, manifest.INDEXED)
+        except Exception as e:
+            print(f"Indexing Error ({len(codes)} posts): {e}")
+            stats["failed"] += len(codes)
+            manifest.mark(codes, manifest.FAILED, f"indexing error: {e}")
+
+    # States recorded by earlier (possibly killed) runs
+    known = manifest.states(shortcodes)
+
+    def resume(code):
+        # True if the post needs no download (and, with a stored result, no processing either)
+        if known.get(code) not in (manifest.DOWNLOADED, manifest.PROCESSED):
+            return False
+        if not (Path(raw_dir) / code).exists():
+            return False
+        stats["downloaded"] += 1
+        if known[code] == manifest.PROCESSED:
+            result = manifest.processed_result(code, post_signature(code, raw_dir, keyframe_budget))
+            if result is not None:
+                finish(code, result, None)
+                return True
+        ready.append(code)
+        return True
+
+    def finish(code, result, reason):
+        if result is None and code in download_failed:
+            reason = f"download failed: {get_downloader(raw_dir).last_error(code)}"
+        if result and result['content'].strip():
+            stats["processed"] += 1
+            manifest.mark(code, manifest.PROCESSED, result=result,
+                          result_key=post_signature(code, raw_dir, keyframe_budget))
+            if code in posts_by_code:
+                result['metadata'] = post_metadata(posts_by_code[code])
+            index(result)
+        elif result is not None and code not in download_failed:
+            # Nothing to index, and running it again won't change that
+            stats["empty"] += 1
+            manifest.mark(code, manifest.EMPTY, reason)
+        else:
+            stats["failed"] += 1
+            manifest.mark(code, manifest.FAILED, reason)
+
+    # The process pool would hide the processing work from cProfile
+    cpu_executor = InlineExecutor if profile_output else ProcessPoolExecutor
+
+    with profiled(profile_output), timed("pipeline", items=len(shortcodes)), \
+         ThreadPoolExecutor(max_workers=download_workers) as io_pool, \
+         cpu_executor(max_workers=process_workers, initializer=pin_threads,
+                      initargs=(threads_per_worker,)) as cpu_pool:
+        print(f"Pipeline pid {os.getpid()}: {process_workers} workers x {threads_per_worker} threads "
+              f"(sample it live with: py-spy top --subprocesses --pid {os.getpid()})")
+
+        try:
+            while todo or ready or downloading or processing:
+                while ready and len(processing) < process_slots:
+                    # Spread the queue over the free slots rather than making one big task
+                    size = min(posts_per_task, -(-len(ready) // (process_slots - len(processing))))
+                    codes = [ready.popleft() for _ in range(size)]
+                    processing[cpu_pool.submit(process_posts, codes, raw_dir, keyframe_budget)] = codes
+
+                while todo and len(downloading) < download_workers and len(downloading) + len(ready) < max_ready:
+                    code = todo.popleft()
+                    if resume(code):
+                        continue
+                    downloading[io_pool.submit(download_post, code, raw_dir)] = code
+
+                report()
+
+                done, _ = wait(list(downloading) + list(processing), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in downloading:
+                        code = downloading.pop(future)
+                        try:
+                            ok = future.result()
+                        except Exception as e:
+                            print(f"Download Error {code}: {e}")
+                            ok = False
+                        if ok:
+                            manifest.mark(code, manifest.DOWNLOADED)
+                        else:
+                            download_failed.add(code)
+                        # Even a failed download may have left a usable folder from a previous run
+                        stats["downloaded"] += 1
+                        ready.append(code)
+                    else:
+                        codes = processing.pop(future)
+                        try:
+                            outcomes = future.result()
+                        except Exception as e:
+                            print(f"Processing Error {', '.join(codes)}: {e}")
+                            outcomes = [(None, str(e))] * len(codes)
+                        for code, (result, error) in zip(codes, outcomes):
+                            finish(code, result, f"processing error: {error}" if error else "no extractable content")
+        finally:
+            # Also on Ctrl-C / SIGTERM: whatever finished processing gets indexed,
+            # and queued work is dropped instead of waited for
+            for future in list(downloading) + list(processing):
+                future.cancel()
+            index()
+
+    report()
+    return stats
+
+def print_progress(interval=10):
+    last = [0.0]
+
+    def show(stats):
+        now = time.monotonic()
+        if now - last[0] >= interval:
+            last[0] = now
+            print(f"[{time.strftime('%H:%M:%S')}] downloaded {stats['downloaded']}/{stats['total']}, "
+                  f"processed {stats['processed']}, indexed {stats['indexed']}, failed {stats['failed']}, empty {stats['empty']} "
+                  f"({stats['processing']} processing, {stats['buffered']} buffered)", flush=True)
+    return show
+
+def run_command(args):
+    posts = load_posts(args.export)
+    print(f"Found {len(posts)} posts in {args.export}.")
+    # Everything not yet in the index; a killed run resumes from the manifest
+    pending = manifest.sync(posts, indexed_ids())
+    updated = update_post_metadata(posts)
+    if updated:
+        print(f"Updated filter metadata on {updated} indexed chunks.")
+    if args.limit:
+        pending = pending[:args.limit]
+    print(f"{len(pending)} posts to process.")
+    if not pending:
+        return
+
+    stats = run_pipeline(pending, raw_dir=args.raw_dir, download_workers=args.download_workers,
+                         process_workers=args.workers, threads_per_worker=args.threads,
+                         index_batch_size=args.batch_size, precompute_embeddings=args.precompute,
+                         profile=args.profile, posts=posts, on_progress=print_progress(),
+                         profile_output=args.profile_output, posts_per_task=args.posts_per_task)
+    print(f"Done: {stats['indexed']} indexed, {stats['failed']} failed, {stats['empty']} without content.")
+
+def redirect_output(path):
+    """
+    Sends this process's stdout/stderr (and its workers') to path, replacing the file.
+    Called once the run lock is held, so a run that loses the race never wipes
+    the log of the one in progress.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    os.close(fd)
+
+def status_command(args):
+    pid = manifest.running_pid()
+    print(f"Run in progress (pid {pid})" if pid else "No run in progress")
+    for state, count in manifest.summary().items():
+        print(f"{state:<11}{count}")
+    pending = get_downloader(args.raw_dir).pending()
+    if pending:
+        print(f"{len(pending)} downloads waiting for a retry")
+
+def main(argv=None):
+    """
+    Headless ingestion, e.g. nightly from cron:
+        python -m src.pipeline run --export saved_posts.json --workers 8
+        python -m src.pipeline status
+    """
+    parser = argparse.ArgumentParser(prog="python -m src.pipeline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="download, process and index every post not yet indexed")
+    run.add_argument("--export", default="saved_posts.json", help="Instagram export file or folder")
+    run.add_argument("--raw-dir", default="data/raw")
+    run.add_argument("--workers", type=int, default=None, help="processing processes (default: cores / 2)")
+    run.add_argument("--threads", type=int, default=None, help="threads per worker (default: cores / workers)")
+    run.add_argument("--download-workers", type=int, default=4)
+    run.add_argument("--posts-per-task", type=int, default=POSTS_PER_TASK, help="posts OCR'd together by one worker")
+    run.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="posts per index batch")
+    run.add_argument("--precompute", action="store_true", help="embed with sentence-transformers before upserting")
+    run.add_argument("--profile", default=None, help="model profile (see src/profiles.py)")
+    run.add_argument("--profile-output", default=None, help="write a cProfile dump here (runs single-process)")
+    run.add_argument("--limit", type=int, default=None, help="only process this many posts")
+    run.add_argument("--log", default=None, help="write the output of the run to this file once the lock is taken")
+    run.set_defaults(handler=run_command)
+
+    status = commands.add_parser("status", help="show manifest counts and whether a run is in progress")
+    status.add_argument("--raw-dir", default="data/raw")
+    status.set_defaults(handler=status_command)
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        # Same cleanup path as Ctrl-C when cron or the app stops the run
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            with manifest.run_lock():
+                if args.log:
+                    redirect_output(args.log)
+                args.handler(args)
+        except manifest.AlreadyRunning as e:
+            print(e)
+            return 1
+        except KeyboardInterrupt:
+            print("Interrupted; finished posts were indexed, run again to resume.")
+            return 130
+    else:
+        args.handler(args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
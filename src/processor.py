@@ -1,41 +1,298 @@
+import hashlib
 import os
-import easyocr
-from faster_whisper import WhisperModel
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from src.filters import check_audio_speech
+from src.filters import check_audio_speech, speech_segments
+from src.audio import decode_audio, remove_decoded, speech_audio
+from src.media_cache import cached, cache_get, cache_put, file_hash, package_version
+from src.keyframes import KEYFRAME_BUDGET, extract_keyframes, dedupe_lines
+from src.profiles import get_profile, OCR_MODES
+from src.metrics import timed
+from src import fingerprints
+from src.thumbnails import THUMB_SUFFIX, make_thumbnail
 
-# Global models to avoid reloading
-_whisper_model = None
-_ocr_reader = None
+# Global models to avoid reloading (one per profile).
+# easyocr/faster_whisper (and torch behind them) are only imported when a model is first needed.
+_whisper_models = {}
+_ocr_readers = {}
 
-def get_whisper():
-    global _whisper_model
-    if _whisper_model is None:
+def get_whisper(profile=None):
+    profile = profile or get_profile()
+    key = (profile['whisper_size'], profile['compute_type'], profile['cpu_threads'], profile['num_workers'])
+    if key not in _whisper_models:
+        from faster_whisper import WhisperModel
         # Int8 quantization for CPU speed
-        _whisper_model = WhisperModel("small", device="cpu", compute_type="int8")
-    return _whisper_model
-
-def get_ocr():
-    global _ocr_reader
-    if _ocr_reader is None:
-        _ocr_reader = easyocr.Reader(['en'], gpu=False) # CPU mode
-    return _ocr_reader
-
-def transcribe(audio_path):
-    model = get_whisper()
-    segments, info = model.transcribe(str(audio_path), beam_size=5)
-    
-    text = ""
-    for segment in segments:
-        text += segment.text + " "
-    return text.strip()
+        _whisper_models[key] = WhisperModel(
+            profile['whisper_size'],
+            device="cpu",
+            compute_type=profile['compute_type'],
+            cpu_threads=profile['cpu_threads'],
+            num_workers=profile['num_workers']
+        )
+    return _whisper_models[key]
+
+def get_ocr(profile=None):
+    profile = profile or get_profile()
+    key = tuple(profile['ocr_languages'])
+    if key not in _ocr_readers:
+        import easyocr
+        _ocr_readers[key] = easyocr.Reader(list(key), gpu=False) # CPU mode
+    return _ocr_readers[key]
+
+# Cache keys: everything that changes the output of a model goes in here
+def whisper_model_id(profile=None):
+    profile = profile or get_profile()
+    return (f"faster-whisper-{package_version('faster-whisper')}:"
+            f"{profile['whisper_size']}:{profile['compute_type']}:beam{profile['beam_size']}")
+
+def ocr_model_id(profile=None):
+    profile = profile or get_profile()
+    return f"easyocr-{package_version('easyocr')}:{'+'.join(profile['ocr_languages'])}:{profile['ocr_mode']}"
+
+def transcribe(audio_path, speech=None):
+    """
+    Transcribes a media file. With speech=[(start_sec, end_sec)] from the VAD, only
+    those parts of the shared 16 kHz decode are sent to Whisper.
+    """
+    profile = get_profile()
+
+    def run():
+        model = get_whisper(profile)
+        if speech is None:
+            audio = str(audio_path)
+        else:
+            audio = speech_audio(decode_audio(audio_path), speech)
+            if not len(audio):
+                return ""
+        with timed("whisper", items=1) as m:
+            segments, info = model.transcribe(audio, beam_size=profile['beam_size'])
+            m["media_seconds"] = info.duration
+
+            text = ""
+            # Segments are generated lazily, so the loop is where the work happens
+            for segment in segments:
+                text += segment.text + " "
+        return text.strip()
+    # Speech-only transcripts differ from whole-file ones, keep them apart in the cache
+    model_id = whisper_model_id(profile)
+    if speech is not None:
+        model_id += ":vad"
+    return cached("transcript", audio_path, model_id, run)
+
+# Images are downscaled to this long side before OCR (Instagram slides are up to 1080x1350)
+OCR_MAX_SIDE = 1280
+OCR_BATCH_SIZE = 8
+OCR_DECODE_THREADS = 4
+
+# Hashes of images the text gate rejected in this process (process_posts and
+# process_pipeline would otherwise decode them twice)
+_textless = set()
 
 def ocr_image(image_path):
-    reader = get_ocr()
-    result = reader.readtext(str(image_path), detail=0)
-    return " ".join(result)
+    return ocr_images([image_path])[0]
+
+def load_ocr_image(image_path, max_side=OCR_MAX_SIDE, text_gate=False):
+    """
+    Decodes and downscales an image for OCR. Returns None if it can't be read,
+    or (with text_gate) if the cheap detector finds nothing that looks like text.
+    """
+    import cv2
+    image = cv2.imread(str(image_path))
+    if image is None:
+        return None
+    h, w = image.shape[:2]
+    scale = max_side / max(h, w)
+    if scale < 1:
+        image = cv2.resize(image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    if text_gate:
+        from src.text_detect import has_text
+        if not has_text(image):
+            return None
+    return image
+
+def ocr_images(image_paths, batch_size=OCR_BATCH_SIZE):
+    """
+    OCR text of several images, in order, with as few reader calls as possible.
+    Cached images are skipped; the rest are decoded and downscaled on a thread
+    pool, dropped if they show no sign of text (profile's ocr_text_gate) and
+    recognized with readtext_batched, one call per image size.
+    Results are cached per image.
+    """
+    profile = get_profile()
+    model_id = ocr_model_id(profile)
+    texts = {}
+    misses = []
+    for path in image_paths:
+        media_hash = file_hash(path)
+        if profile['ocr_text_gate'] and media_hash in _textless:
+            text = ""
+        else:
+            text = cache_get("ocr", media_hash, model_id)
+        if text is None:
+            misses.append((path, media_hash))
+        else:
+            texts[path] = text
+
+    # Reposts and re-encodes of an image OCR'd before take over its text.
+    # Not cached under this image's hash: only OCR of the file itself is
+    remaining = []
+    for path, media_hash in misses:
+        text = duplicate_ocr(path, media_hash, model_id)
+        if text is None:
+            remaining.append((path, media_hash))
+        else:
+            texts[path] = text
+    misses = remaining
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=OCR_DECODE_THREADS) as pool:
+            images = list(pool.map(lambda m: load_ocr_image(m[0], text_gate=profile['ocr_text_gate']), misses))
+
+        # readtext_batched resizes every image to one size, so batch equal sizes together
+        groups = {}
+        for (path, media_hash), image in zip(misses, images):
+            if image is None:
+                # Not stored in the cache: the detector is cheap, and a better one may come
+                texts[path] = ""
+                _textless.add(media_hash)
+            else:
+                groups.setdefault(image.shape[:2], []).append((path, media_hash, image))
+
+        if groups:
+            reader = get_ocr(profile)
+            batched = [item for group in groups.values() for item in group]
+            with timed("ocr", items=len(batched), skipped=len(misses) - len(batched),
+                       bytes=sum(os.path.getsize(p) for p, _ in misses)):
+                for (height, width), group in groups.items():
+                    results = reader.readtext_batched([image for _, _, image in group],
+                                                      n_width=width, n_height=height,
+                                                      batch_size=batch_size, detail=0,
+                                                      **OCR_MODES[profile['ocr_mode']])
+                    for (path, media_hash, _), result in zip(group, results):
+                        text = " ".join(result)
+                        cache_put("ocr", media_hash, model_id, text)
+                        texts[path] = text
+
+    return [texts[path] for path in image_paths]
+
+def duplicate_ocr(image_path, media_hash, model_id):
+    """
+    Cached OCR text of a near-identical image (same hash and same text, see
+    fingerprints.similar_images), or None.
+    """
+    try:
+        phash = fingerprints.file_phash(image_path)
+        if phash is None:
+            return None
+        for other_hash, _, _, _ in fingerprints.similar_images(phash, path=image_path):
+            if other_hash != media_hash:
+                text = cache_get("ocr", other_hash, model_id)
+                if text is not None:
+                    return text
+    except Exception as e:
+        print(f"Fingerprint Error {image_path}: {e}")
+    return None
+
+def link_image(shortcode, image_path):
+    """
+    Adds an image to the near-duplicate index. Returns the shortcodes of other
+    posts that have the same picture.
+    """
+    phash = fingerprints.file_phash(image_path)
+    if phash is None:
+        return set()
+    matches = fingerprints.similar_images(phash, exclude_shortcode=shortcode, path=image_path)
+    fingerprints.add_image(file_hash(image_path), shortcode, phash, path=image_path)
+    return {code for _, code, _, _ in matches}
+
+def link_video(shortcode, video_path, frame_paths):
+    """
+    Adds a video (keyframes + audio fingerprint) to the near-duplicate index.
+    Returns (media_hash, shortcode) of the same video in another post, or None.
+    """
+    keyframes = []
+    for path in frame_paths:
+        phash = fingerprints.file_phash(path)
+        if phash is not None:
+            keyframes.append((file_hash(path), phash, path))
+    try:
+        audio_fp = fingerprints.file_audio_fingerprint(video_path)
+    except Exception:
+        # No audio track; matched on keyframes alone
+        audio_fp = None
+    duplicate = fingerprints.similar_video(shortcode, [(phash, path) for _, phash, path in keyframes], audio_fp)
+    fingerprints.add_video(file_hash(video_path), shortcode, keyframes)
+    return duplicate
+
+def duplicate_transcript(media_hash):
+    """
+    A cached transcript of another copy of a video (speech-only or whole-file), or None.
+    """
+    model_id = whisper_model_id()
+    for variant in (model_id + ":vad", model_id):
+        text = cache_get("transcript", media_hash, variant)
+        if text is not None:
+            return text
+    return None
+
+def post_images(post_path):
+    # Instaloader saves images as .jpg; keyframes extracted on earlier runs are OCR'd with their video
+    return sorted(f for f in Path(post_path).glob("*.jpg") if "_keyframe" not in f.stem)
+
+# Written into a post folder by process_pipeline itself
+GENERATED_SUFFIXES = ("_transcript.txt", "_audio16k.npy", THUMB_SUFFIX)
+
+def post_signature(shortcode, raw_dir="data/raw", keyframe_budget=KEYFRAME_BUDGET):
+    """
+    Identifies what process_pipeline(shortcode) reads: the downloaded files
+    (name, size, mtime) and the models. None if the folder is gone.
+    A stored result is only reused while the signature is unchanged.
+    """
+    post_path = Path(raw_dir) / shortcode
+    if not post_path.exists():
+        return None
+    h = hashlib.sha1(f"{whisper_model_id()}|{ocr_model_id()}|{keyframe_budget}".encode())
+    for f in sorted(post_path.iterdir()):
+        if not f.is_file() or "_keyframe_" in f.stem or f.name.endswith(GENERATED_SUFFIXES):
+            continue
+        st = f.stat()
+        h.update(f"{f.name}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+def process_posts(shortcodes, raw_dir="data/raw", keyframe_budget=KEYFRAME_BUDGET):
+    """
+    process_pipeline for several posts, with the OCR of all their images and
+    keyframes done up front as one batch (the per-post calls then hit the cache).
+    Returns [(result, error)] in order; error is a message if the post raised.
+    """
+    paths = []
+    for shortcode in shortcodes:
+        post_path = Path(raw_dir) / shortcode
+        if not post_path.exists():
+            continue
+        paths.extend(post_images(post_path))
+        for vid in post_path.glob("*.mp4"):
+            try:
+                paths.extend(extract_keyframes(vid, max_frames=keyframe_budget))
+            except Exception as e:
+                print(f"Frame Extraction Error {vid}: {e}")
+    if paths:
+        try:
+            ocr_images(paths)
+        except Exception as e:
+            # process_pipeline retries per post and reports the error there
+            print(f"Batched OCR Error ({len(paths)} images): {e}")
+
+    results = []
+    for shortcode in shortcodes:
+        try:
+            results.append((process_pipeline(shortcode, raw_dir, keyframe_budget), None))
+        except Exception as e:
+            print(f"Processing Error {shortcode}: {e}")
+            results.append((None, str(e)))
+    return results
 
-def process_pipeline(shortcode, raw_dir="data/raw"):
+def process_pipeline(shortcode, raw_dir="data/raw", keyframe_budget=KEYFRAME_BUDGET):
     """
     Process a single post folder:
     1. Find media files.
@@ -51,7 +308,8 @@ def process_pipeline(shortcode, raw_dir="data/raw"):
     combined_text = []
     
     # 1. Caption
-    caption_files = list(post_path.glob("*.txt"))
+    # Skip our own transcript files, they are added below from the cache
+    caption_files = [f for f in post_path.glob("*.txt") if not f.name.endswith("_transcript.txt")]
     for cf in caption_files:
         try:
             with open(cf, 'r', encoding='utf-8') as f:
@@ -60,15 +318,22 @@ def process_pipeline(shortcode, raw_dir="data/raw"):
             pass
             
     # 2. Images (OCR)
-    # Instaloader saves as .jpg
-    image_files = list(post_path.glob("*.jpg"))
+    # All slides of a carousel in one batch
+    image_files = post_images(post_path)
+    # Per image/video: the other posts it also appears in
+    media_matches = []
     for img in image_files:
         try:
-            txt = ocr_image(img)
+            media_matches.append(link_image(shortcode, img))
+        except Exception as e:
+            print(f"Fingerprint Error {img}: {e}")
+            media_matches.append(set())
+    try:
+        for txt in ocr_images(image_files):
             if txt:
                 combined_text.append(f"[Image Text]: {txt}")
-        except Exception as e:
-            print(f"OCR Error {img}: {e}")
+    except Exception as e:
+        print(f"OCR Error {post_path}: {e}")
 
     # 3. Audio/Video
     # Instaloader saves video as .mp4
@@ -79,51 +344,72 @@ def process_pipeline(shortcode, raw_dir="data/raw"):
 
     for vid in video_files:
         # A. Frame Extraction & OCR
+        # A bounded set of visually distinct frames, OCR'd as one batch
+        frame_paths = []
         try:
-            import cv2
-            frame_path = vid.with_name(f"{vid.stem}_keyframe.jpg")
-            
-            # Extract if not exists
-            if not frame_path.exists():
-                cap = cv2.VideoCapture(str(vid))
-                if cap.isOpened():
-                    # Check first frame
-                    ret, frame = cap.read()
-                    if ret:
-                        cv2.imwrite(str(frame_path), frame)
-                    cap.release()
-            
-            # If successfully created/exists, OCR it
-            if frame_path.exists():
-                generated_images.append(frame_path)
-                txt = ocr_image(frame_path)
-                if txt:
-                   combined_text.append(f"[Video Overlay Text]: {txt}")
+            frame_paths = extract_keyframes(vid, max_frames=keyframe_budget)
+            if frame_paths:
+                generated_images.extend(frame_paths)
+                lines = dedupe_lines(ocr_images(frame_paths))
+                if lines:
+                   combined_text.append(f"[Video Overlay Text]: {' | '.join(lines)}")
         except Exception as e:
             print(f"Frame Extraction/OCR Error {vid}: {e}")
 
+        duplicate = None
+        try:
+            duplicate = link_video(shortcode, vid, frame_paths)
+        except Exception as e:
+            print(f"Fingerprint Error {vid}: {e}")
+        media_matches.append({duplicate[1]} if duplicate else set())
+
         # B. Audio Transcription
         try:
-            # Need to separate audio? faster-whisper handles mp4 files directly via ffmpeg
-            if check_audio_speech(vid):
+            # The same Reel seen in another post: its transcript is as good as a new one
+            txt = duplicate_transcript(duplicate[0]) if duplicate else None
+            if txt is not None:
+                print(f"Reusing transcript of {duplicate[1]} for {vid}")
+            # VAD and Whisper share one decode; Whisper only gets the speech segments
+            elif check_audio_speech(vid):
+                try:
+                    speech = speech_segments(vid)
+                except Exception:
+                    # VAD couldn't decode it, let Whisper try the whole file
+                    speech = None
                 print(f"Transcribing {vid}...")
-                txt = transcribe(vid)
-                if txt:
-                    # Save transcription to file
-                    try:
-                        transcription_path = vid.with_name(f"{vid.stem}_transcript.txt")
-                        with open(transcription_path, "w", encoding="utf-8") as f:
-                            f.write(txt)
-                        print(f"Saved transcript to {transcription_path}")
-                    except Exception as e:
-                        print(f"Could not save transcript file: {e}")
-
-                    combined_text.append(f"[Audio Transcript]: {txt}")
+                txt = transcribe(vid, speech)
             else:
                 print(f"Skipping transcription for {vid} (No speech detected)")
+
+            if txt:
+                # Save transcription to file
+                try:
+                    transcription_path = vid.with_name(f"{vid.stem}_transcript.txt")
+                    with open(transcription_path, "w", encoding="utf-8") as f:
+                        f.write(txt)
+                    print(f"Saved transcript to {transcription_path}")
+                except Exception as e:
+                    print(f"Could not save transcript file: {e}")
+
+                combined_text.append(f"[Audio Transcript]: {txt}")
         except Exception as e:
             print(f"Transcription Error {vid}: {e}")
-            
+        finally:
+            # Fingerprint, VAD and Whisper are done with the decoded audio
+            remove_decoded(vid)
+
+    # A post whose every image and video already appeared in one earlier post is linked to it
+    duplicate_of = ""
+    if media_matches and all(media_matches):
+        originals = {fingerprints.canonical(code) for code in set.intersection(*media_matches)}
+        # On a re-run the original finds its own duplicates; it stays the original
+        if originals and shortcode not in originals:
+            duplicate_of = sorted(originals)[0]
+    try:
+        fingerprints.set_duplicate(shortcode, duplicate_of)
+    except Exception as e:
+        print(f"Fingerprint Error {shortcode}: {e}")
+
     final_text = "\n".join(combined_text)
     
     # Prioritize original images, then generated frames
@@ -132,9 +418,19 @@ def process_pipeline(shortcode, raw_dir="data/raw"):
         final_image = image_files[0]
     elif generated_images:
         final_image = generated_images[0]
+
+    # Small preview for the results page
+    thumb_path = None
+    if final_image:
+        try:
+            thumb_path = make_thumbnail(final_image)
+        except Exception as e:
+            print(f"Thumbnail Error {final_image}: {e}")
     
     return {
         "shortcode": shortcode,
         "content": final_text,
-        "image_path": str(final_image) if final_image else None
+        "image_path": str(final_image) if final_image else None,
+        "thumb_path": thumb_path,
+        "duplicate_of": duplicate_of,
     }
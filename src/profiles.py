@@ -0,0 +1,82 @@
+import json
+import os
+from pathlib import Path
+
+# Model settings for transcription and OCR, selectable by name.
+# Pick one with the INSTARAG_PROFILE environment variable (or set_profile()).
+# Extra or overriding profiles can be defined in model_profiles.json in the
+# project root, e.g. {"tiny-tr": {"whisper_size": "tiny", "ocr_languages": ["tr"]}}
+PROFILES = {
+    "fast": {
+        "whisper_size": "base",
+        "compute_type": "int8",
+        "beam_size": 1,
+        "cpu_threads": 0,       # 0 = let CTranslate2 decide
+        "num_workers": 1,
+        "ocr_languages": ["en", "tr"],
+        "ocr_mode": "fast",     # greedy decoding on a smaller detector canvas
+        "ocr_text_gate": True,  # skip images where src/text_detect.py finds no text
+    },
+    "balanced": {
+        "whisper_size": "small",
+        "compute_type": "int8",
+        "beam_size": 5,
+        "cpu_threads": 0,
+        "num_workers": 1,
+        "ocr_languages": ["en", "tr"],
+        "ocr_mode": "full",
+        "ocr_text_gate": True,
+    },
+    "accurate": {
+        "whisper_size": "medium",
+        "compute_type": "int8",
+        "beam_size": 5,
+        "cpu_threads": 0,
+        "num_workers": 1,
+        "ocr_languages": ["en", "tr"],
+        "ocr_mode": "full",
+        "ocr_text_gate": False,
+    },
+}
+
+DEFAULT_PROFILE = "balanced"
+PROFILE_ENV = "INSTARAG_PROFILE"
+PROFILES_FILE = "model_profiles.json"
+
+# readtext() keyword arguments per ocr_mode
+OCR_MODES = {
+    "full": {},
+    "fast": {"decoder": "greedy", "canvas_size": 960, "mag_ratio": 1.0},
+}
+
+def load_profiles():
+    profiles = {name: dict(p) for name, p in PROFILES.items()}
+    path = Path(PROFILES_FILE)
+    if path.exists():
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                custom = json.load(f)
+            for name, overrides in custom.items():
+                # Custom profiles start from the default one
+                base = profiles.get(name, profiles[DEFAULT_PROFILE])
+                profiles[name] = {**base, **overrides}
+        except Exception as e:
+            print(f"Error reading {PROFILES_FILE}: {e}")
+    return profiles
+
+def get_profile(name=None):
+    """
+    Returns the settings dict of a profile (default: the active one), with its "name".
+    """
+    name = name or os.environ.get(PROFILE_ENV) or DEFAULT_PROFILE
+    profiles = load_profiles()
+    if name not in profiles:
+        raise ValueError(f"Unknown model profile '{name}'. Available: {', '.join(profiles)}")
+    return {"name": name, **profiles[name]}
+
+def set_profile(name):
+    """
+    Activates a profile for this process and any worker processes started afterwards.
+    """
+    get_profile(name)  # validate
+    os.environ[PROFILE_ENV] = name
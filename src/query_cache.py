@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# Caches for the search path: query embeddings and retrieval results in memory,
+# LLM summaries on disk. Retrieval results are tied to a collection version
+# that every ingestion bumps, so they never outlive the data they came from.
+VERSION_PATH = "data/collection_version"
+LLM_CACHE_PATH = "data/llm_cache.sqlite"
+
+class LRUCache:
+    """
+    Small thread-safe LRU with an optional time-to-live (seconds) per entry.
+    With max_bytes, values must be bytes and the total size is bounded too.
+    """
+    def __init__(self, maxsize=256, ttl=None, max_bytes=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _size(self, value):
+        return len(value) if self.max_bytes is not None else 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, stored_at = item
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                self.bytes -= self._size(value)
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self._size(self._data[key][0])
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            self.bytes += self._size(value)
+            while len(self._data) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, (evicted, _) = self._data.popitem(last=False)
+                self.bytes -= self._size(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+# Query text -> embedding. Independent of the collection contents.
+embedding_cache = LRUCache(maxsize=1024, ttl=None)
+# (collection version, mode, n_results, query) -> results
+results_cache = LRUCache(maxsize=256, ttl=3600)
+
+def collection_version():
+    """
+    Counter bumped on every ingestion; stored on disk so a separate ingestion
+    process (e.g. the CLI) invalidates the app's cached results too.
+    """
+    try:
+        with open(VERSION_PATH, 'r') as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def bump_collection_version():
+    Path(VERSION_PATH).parent.mkdir(parents=True, exist_ok=True)
+    version = collection_version() + 1
+    tmp_path = f"{VERSION_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(str(version))
+    os.replace(tmp_path, VERSION_PATH)
+    return version
+
+_llm_conn = None
+_llm_lock = threading.Lock()
+
+def _llm_connect():
+    global _llm_conn
+    if _llm_conn is None:
+        Path(LLM_CACHE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        _llm_conn = sqlite3.connect(LLM_CACHE_PATH, timeout=30, check_same_thread=False)
+        _llm_conn.execute("""
+            CREATE TABLE IF NOT EXISTS summaries (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                query TEXT NOT NULL,
+                ids TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )""")
+        _llm_conn.commit()
+    return _llm_conn
+
+def summary_key(model, query, ids, prompt):
+    # The prompt hash covers the retrieved text itself, so a re-indexed post
+    # with the same id doesn't get a stale summary
+    payload = json.dumps([model, query, list(ids), hashlib.sha256(prompt.encode('utf-8')).hexdigest()])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def get_summary(model, query, ids, prompt):
+    conn = _llm_connect()
+    with _llm_lock:
+        row = conn.execute(
+            "SELECT answer FROM summaries WHERE key = ?", (summary_key(model, query, ids, prompt),)
+        ).fetchone()
+    return row[0] if row else None
+
+def put_summary(model, query, ids, prompt, answer):
+    conn = _llm_connect()
+    with _llm_lock:
+        conn.execute(
+            "INSERT OR REPLACE INTO summaries (key, model, query, ids, answer, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (summary_key(model, query, ids, prompt), model, query, json.dumps(list(ids)), answer, time.time())
+        )
+        conn.commit()
@@ -1,50 +1,486 @@
-import chromadb
-from chromadb.utils import embedding_functions
-import uuid
+import copy
+import hashlib
+import json
+import time
 
-# Client setup
-client = chromadb.PersistentClient(path="data/chroma_db")
+from src import lexical, query_cache
+from src.metrics import timed
+from src.chunking import chunk_post, assemble_post
 
-# Embedding function
-# Use a local model to avoid API costs and keep it consistent with the "CPU/Offline" theme
-# sentence-transformers/all-MiniLM-L6-v2 is standard and fast
-sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="all-MiniLM-L6-v2",
-    device="cpu"  # Force CPU
-)
+# Chroma and the embedding model are created on first use, so importing this
+# module (e.g. for a search-only Streamlit session) stays cheap.
+DB_PATH = "data/chroma_db"
+COLLECTION_NAME = "insta_posts"
 
-collection = client.get_or_create_collection(
-    name="insta_posts",
-    embedding_function=sentence_transformer_ef
-)
+_client = None
+_embedding_function = None
+_collection = None
 
-def ingest_document(shortcode, content, image_path=None):
+def get_client():
+    global _client
+    if _client is None:
+        import chromadb
+        _client = chromadb.PersistentClient(path=DB_PATH)
+    return _client
+
+def get_embedding_function():
+    global _embedding_function
+    if _embedding_function is None:
+        from chromadb.utils import embedding_functions
+        # Use a local model to avoid API costs and keep it consistent with the "CPU/Offline" theme
+        # sentence-transformers/all-MiniLM-L6-v2 is standard and fast
+        _embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
+            model_name="all-MiniLM-L6-v2",
+            device="cpu"  # Force CPU
+        )
+    return _embedding_function
+
+def get_collection():
+    """
+    The post collection on the configured vector backend: Chroma, or the
+    quantized NumPy store (INSTARAG_VECTOR_BACKEND=numpy, see src/vector_store.py).
+    """
+    global _collection
+    if _collection is None:
+        # Imported here: it loads NumPy, which the app's start-up doesn't need
+        from src import vector_store
+        if vector_store.get_backend() == "numpy":
+            _collection = vector_store.NumpyCollection(embedding_function=get_embedding_function())
+        else:
+            _collection = get_client().get_or_create_collection(
+                name=COLLECTION_NAME,
+                embedding_function=get_embedding_function()
+            )
+    return _collection
+
+def reopen():
+    """
+    Drops the open client, so the next get_collection() sees what another process
+    (the CLI pipeline) has written. The embedding model stays loaded.
+    """
+    global _client, _collection
+    if _client is not None:
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient.clear_system_cache()
+    _client = None
+    _collection = None
+
+# Metadata keys marking collection membership start with this
+COLLECTION_KEY_PREFIX = "col_"
+
+def collection_key(name):
+    """
+    Metadata key of a collection. Names may hold any character, the key is a
+    plain word (a hash of the name) so every backend can filter on it.
+    """
+    return COLLECTION_KEY_PREFIX + hashlib.sha1(name.encode("utf-8")).hexdigest()[:12]
+
+def post_metadata(post):
+    """
+    Filterable Chroma metadata from a load_posts() record. Chroma metadata can't
+    hold lists, so every collection the post was saved in gets its own
+    collection_key() set to True (what filters match on); "collection" is the
+    first of them and "collections" lists all, "|"-separated, for display.
+    """
+    added_time = post.get('added_time') or 0
+    names = post.get('collections') or []
+    return {
+        "collection": names[0] if names else "",
+        "collections": "|".join(names),
+        **{collection_key(name): True for name in names},
+        "added_time": int(added_time),
+        "added_year": time.gmtime(added_time).tm_year if added_time else 0,
+        "kind": post.get('kind') or "",
+    }
+
+def build_filter(collections=None, years=None, kinds=None):
+    """
+    Chroma `where` filter from the sidebar choices (None/empty = no restriction).
+    """
+    clauses = []
+    if collections:
+        # A post matches if it is in any of the chosen collections
+        keys = [{collection_key(name): True} for name in collections]
+        clauses.append(keys[0] if len(keys) == 1 else {"$or": keys})
+    if years:
+        clauses.append({"added_year": {"$in": [int(y) for y in years]}})
+    if kinds:
+        clauses.append({"kind": {"$in": list(kinds)}})
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+def _chunk_records(results):
+    """
+    One Chroma record per chunk: id "{shortcode}#{n}", tagged with its post and modality.
+    """
+    ids, documents, metadatas = [], [], []
+    for r in results:
+        image_path = str(r['image_path']) if r.get('image_path') else ""
+        for n, chunk in enumerate(chunk_post(r['content'])):
+            ids.append(f"{r['shortcode']}#{n}")
+            documents.append(chunk['text'])
+            metadatas.append({
+                **r.get('metadata', {}),
+                "shortcode": r['shortcode'],
+                "image_path": image_path,
+                "thumb_path": r.get('thumb_path') or "",
+                "modality": chunk['modality'],
+                "section": chunk['section'],
+                "chunk": n,
+                # Set when all of the post's media appeared in an earlier post (see fingerprints.py)
+                "duplicate_of": r.get('duplicate_of') or "",
+            })
+    return ids, documents, metadatas
+
+def _write_posts(results, precompute=False, batch_size=None):
+    collection = get_collection()
+    # Drop the previous chunks of these posts first, their number may have changed.
+    # This also removes whole-post documents from before chunking.
+    collection.delete(where={"shortcode": {"$in": [r['shortcode'] for r in results]}})
+
+    ids, documents, metadatas = _chunk_records(results)
+    if not ids:
+        return
+    kwargs = {}
+    if precompute:
+        kwargs['embeddings'] = embed_documents(documents, batch_size=batch_size or EMBED_BATCH_SIZE)
+    # Without precomputed embeddings this includes Chroma embedding the chunks
+    with timed("upsert", items=len(ids), precomputed=int(precompute)):
+        collection.upsert(ids=ids, documents=documents, metadatas=metadatas, **kwargs)
+        lexical.upsert_documents((r['shortcode'], r['content']) for r in results)
+
+def ingest_document(shortcode, content, image_path=None, metadata=None):
     """
-    Upsert a document into ChromaDB.
+    Upsert a document into ChromaDB (as one record per chunk).
+    metadata: extra filterable fields, see post_metadata().
     """
     if not content or not content.strip():
         return
         
-    collection.upsert(
-        documents=[content],
-        metadatas=[{"shortcode": shortcode, "image_path": str(image_path) if image_path else ""}],
-        ids=[shortcode]
-    )
+    _write_posts([{"shortcode": shortcode, "content": content, "image_path": image_path, "metadata": metadata or {}}])
+    query_cache.bump_collection_version()
     print(f"Ingested {shortcode} into RAG.")
 
+# How many posts are embedded and upserted together
+EMBED_BATCH_SIZE = 64
+
+_st_model = None
+
+def get_embedding_model():
+    """
+    Same MiniLM model as the collection's embedding function, loaded directly
+    through sentence-transformers so a whole batch is encoded in one call.
+    """
+    global _st_model
+    if _st_model is None:
+        from sentence_transformers import SentenceTransformer
+        _st_model = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+    return _st_model
+
+def embed_documents(texts, batch_size=EMBED_BATCH_SIZE):
+    model = get_embedding_model()
+    texts = list(texts)
+    with timed("embed", items=len(texts)):
+        embeddings = model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    return embeddings.tolist()
+
+def ingest_documents(results, batch_size=EMBED_BATCH_SIZE, precompute=False):
+    """
+    Upsert several processed posts (process_pipeline outputs, optionally with
+    a "metadata" dict from post_metadata()).
+    Posts are embedded and written in batches of batch_size posts, one upsert per batch.
+    With precompute=True the embeddings are computed with sentence-transformers
+    up front instead of through Chroma's embedding function.
+    Returns the number of posts written.
+    """
+    results = [r for r in results if r and r.get('content') and r['content'].strip()]
+    
+    written = 0
+    for start in range(0, len(results), batch_size):
+        batch = results[start:start + batch_size]
+        _write_posts(batch, precompute=precompute, batch_size=batch_size)
+        written += len(batch)
+
+    if written:
+        query_cache.bump_collection_version()
+        print(f"Ingested {written} posts into RAG.")
+    return written
+
+class IngestBuffer:
+    """
+    Collects processed posts and flushes them to Chroma a full batch at a time.
+    """
+    def __init__(self, batch_size=EMBED_BATCH_SIZE, precompute=False):
+        self.batch_size = batch_size
+        self.precompute = precompute
+        self.pending = []
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, result):
+        """
+        Buffer a post. Returns the number of posts written (0 unless a batch was flushed).
+        """
+        self.pending.append(result)
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, []
+        return ingest_documents(batch, batch_size=self.batch_size, precompute=self.precompute)
+
 def document_exists(shortcode):
     """
     Check if a document exists in the collection.
     """
-    existing = collection.get(ids=[shortcode])
+    existing = get_collection().get(where={"shortcode": shortcode}, limit=1, include=[])
     return len(existing['ids']) > 0
 
-def query_similar(query_text, n_results=5):
+def indexed_ids():
     """
-    Query the database.
+    Shortcodes of all posts currently in the collection, fetched in one call.
     """
-    results = collection.query(
-        query_texts=[query_text],
-        n_results=n_results
+    existing = get_collection().get(include=["metadatas"])
+    return {meta['shortcode'] for meta in existing['metadatas'] if meta and meta.get('shortcode')}
+
+def update_post_metadata(posts, batch_size=1000):
+    """
+    Writes post_metadata() of load_posts() records onto already indexed chunks
+    whose metadata differs (e.g. indexed before it was recorded, or the post
+    was saved into another collection since). Returns the number of chunks updated.
+    """
+    wanted = {post['shortcode']: post_metadata(post) for post in posts}
+    existing = get_collection().get(include=["metadatas"])
+    ids, metadatas = [], []
+    for doc_id, meta in zip(existing['ids'], existing['metadatas']):
+        new = wanted.get(meta.get('shortcode'))
+        if new:
+            # Collections the post was removed from (Chroma's update can only overwrite keys)
+            left = {k: False for k, v in meta.items() if k.startswith(COLLECTION_KEY_PREFIX) and v and k not in new}
+            new = {**left, **new}
+        if new and any(meta.get(k) != v for k, v in new.items()):
+            ids.append(doc_id)
+            metadatas.append({**meta, **new})
+    for start in range(0, len(ids), batch_size):
+        get_collection().update(ids=ids[start:start + batch_size], metadatas=metadatas[start:start + batch_size])
+    if ids:
+        query_cache.bump_collection_version()
+    return len(ids)
+
+# Reciprocal rank fusion constant (60 is the value from the original RRF paper)
+RRF_K = 60
+
+# How many candidates each index contributes before fusion
+HYBRID_CANDIDATES = 50
+
+# Chunks fetched per requested post before they are grouped by post
+# (the window grows by this factor again while too few posts are found)
+CHUNK_OVERFETCH = 4
+
+# How chunk hits add up to a post score: "max" (best chunk) or "sum" (all matching chunks)
+CHUNK_AGGREGATION = "max"
+# query_similar fetches this many times n_results before collapsing near-duplicates
+DUPLICATE_OVERFETCH = 2
+
+def _assemble(ids, documents, metadatas):
+    """
+    Groups chunk records by post. Returns {shortcode: (post text, post metadata)}.
+    """
+    chunks = {}
+    for doc_id, doc, meta in zip(ids, documents, metadatas):
+        chunks.setdefault(meta.get('shortcode', doc_id), []).append((doc, meta))
+
+    posts = {}
+    for code, items in chunks.items():
+        if "section" in items[0][1]:
+            text = assemble_post([{**meta, "text": doc} for doc, meta in items])
+        else:
+            # Whole-post document from before chunking
+            text = items[0][0]
+        meta = {k: v for k, v in items[0][1].items() if k not in ("modality", "section", "chunk")}
+        posts[code] = (text, meta)
+    return posts
+
+def rebuild_lexical_index(batch_size=1000):
+    """
+    Fills the keyword index from the documents already in Chroma
+    (for collections built before the keyword index existed).
+    """
+    collection = get_collection()
+    total = collection.count()
+    ids, documents, metadatas = [], [], []
+    for offset in range(0, total, batch_size):
+        page = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        ids += page['ids']
+        documents += page['documents']
+        metadatas += page['metadatas']
+    posts = _assemble(ids, documents, metadatas)
+    lexical.upsert_documents((code, text) for code, (text, _) in posts.items())
+    print(f"Rebuilt keyword index with {len(posts)} posts.")
+
+def embed_query(query_text):
+    embedding = query_cache.embedding_cache.get(query_text)
+    if embedding is None:
+        embedding = [float(x) for x in get_embedding_function()([query_text])[0]]
+        query_cache.embedding_cache.put(query_text, embedding)
+    return embedding
+
+def query_chunks(query_text, n_results=5, aggregation=CHUNK_AGGREGATION, where=None):
+    """
+    Dense search over chunks, aggregated per post.
+    where narrows the candidates before the vector search (see build_filter).
+    Returns [(shortcode, score, best chunk distance)] best first.
+    """
+    kwargs = {"where": where} if where else {}
+    collection = get_collection()
+    embedding = embed_query(query_text)
+    fetch = n_results * CHUNK_OVERFETCH
+    while True:
+        hits = collection.query(
+            query_embeddings=[embedding],
+            n_results=fetch,
+            include=["metadatas", "distances"],
+            **kwargs
+        )
+        scores = {}
+        best = {}
+        for doc_id, meta, distance in zip(hits['ids'][0], hits['metadatas'][0], hits['distances'][0]):
+            code = meta.get('shortcode', doc_id)
+            similarity = 1.0 / (1.0 + distance)
+            if aggregation == "sum":
+                scores[code] = scores.get(code, 0.0) + similarity
+            else:
+                scores[code] = max(scores.get(code, 0.0), similarity)
+            best[code] = min(best.get(code, distance), distance)
+        # A few long posts can fill the window with their chunks: widen it
+        # until there are enough posts or the collection has no more chunks
+        if len(scores) >= n_results or len(hits['ids'][0]) < fetch:
+            break
+        fetch *= CHUNK_OVERFETCH
+    ranked = sorted(scores, key=scores.get, reverse=True)[:n_results]
+    return [(code, scores[code], best[code]) for code in ranked]
+
+def query_dense(query_text, n_results=5, aggregation=CHUNK_AGGREGATION, where=None):
+    hits = query_chunks(query_text, n_results=n_results, aggregation=aggregation, where=where)
+    return _results_for(
+        [code for code, _, _ in hits],
+        [score for _, score, _ in hits],
+        {code: distance for code, _, distance in hits}
     )
-    return results
+
+def _filter_ids(ids, where):
+    """
+    Keeps the shortcodes whose metadata matches where, in their original order.
+    """
+    if not where or not ids:
+        return list(ids)
+    found = get_collection().get(
+        where={"$and": [{"shortcode": {"$in": list(ids)}}, where]},
+        include=["metadatas"]
+    )
+    matching = {meta['shortcode'] for meta in found['metadatas']}
+    return [i for i in ids if i in matching]
+
+def _lexical_hits(query_text, limit, where=None):
+    # The keyword index has no metadata: over-fetch, then filter through Chroma
+    hits = lexical.search(query_text, limit=limit * CHUNK_OVERFETCH if where else limit)
+    scores = dict(hits)
+    ids = _filter_ids([code for code, _ in hits], where)[:limit]
+    return [(code, scores[code]) for code in ids]
+
+def query_lexical(query_text, n_results=5, where=None):
+    hits = _lexical_hits(query_text, n_results, where)
+    return _results_for([code for code, _ in hits], [score for _, score in hits])
+
+def _results_for(ids, scores, distances=None):
+    """
+    Fetches the posts' text/metadata and returns them in Chroma's query() shape,
+    one entry per post.
+    """
+    posts = {}
+    if ids:
+        found = get_collection().get(where={"shortcode": {"$in": list(ids)}}, include=["documents", "metadatas"])
+        posts = _assemble(found['ids'], found['documents'], found['metadatas'])
+    keep = [n for n, i in enumerate(ids) if i in posts]
+    return {
+        "ids": [[ids[n] for n in keep]],
+        "documents": [[posts[ids[n]][0] for n in keep]],
+        "metadatas": [[posts[ids[n]][1] for n in keep]],
+        "distances": [[distances.get(ids[n]) if distances else None for n in keep]],
+        "scores": [[scores[n] for n in keep]],
+    }
+
+def query_hybrid(query_text, n_results=5, candidates=HYBRID_CANDIDATES, k=RRF_K, where=None):
+    """
+    Dense (MiniLM) and keyword (BM25) search merged with reciprocal rank fusion:
+    score(doc) = sum over both rankings of 1 / (k + rank).
+    """
+    collection = get_collection()
+    if lexical.count() == 0 and collection.count() > 0:
+        rebuild_lexical_index()
+
+    dense = query_chunks(query_text, n_results=candidates, where=where)
+    dense_ids = [code for code, _, _ in dense]
+    distances = {code: distance for code, _, distance in dense}
+    lexical_ids = [code for code, _ in _lexical_hits(query_text, candidates, where)]
+
+    fused = {}
+    for ranking in (dense_ids, lexical_ids):
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+
+    top = sorted(fused, key=fused.get, reverse=True)[:n_results]
+    return _results_for(top, [fused[i] for i in top], distances)
+
+def collapse_duplicates(results, n_results):
+    """
+    Keeps the best ranked post of each group of near-duplicates (posts sharing
+    duplicate_of, or a post and its original). The others are listed in the
+    kept post's "duplicates" metadata, "|"-separated.
+    """
+    groups = {}
+    keep = []
+    for n, (doc_id, meta) in enumerate(zip(results['ids'][0], results['metadatas'][0])):
+        group = meta.get('duplicate_of') or doc_id
+        if group in groups:
+            kept = results['metadatas'][0][groups[group]]
+            kept['duplicates'] = "|".join(filter(None, [kept.get('duplicates'), doc_id]))
+        else:
+            groups[group] = n
+            keep.append(n)
+    keep = keep[:n_results]
+    return {field: [[values[0][n] for n in keep]] for field, values in results.items()}
+
+def query_similar(query_text, n_results=5, mode="hybrid", where=None, collapse=True):
+    """
+    Query the database.
+    mode: "hybrid" (dense + keyword, fused), "dense" or "lexical".
+    where: optional metadata filter, see build_filter().
+    collapse: near-duplicate posts take one result slot (see collapse_duplicates).
+    Results are cached until the next ingestion.
+    """
+    key = (query_cache.collection_version(), mode, n_results, collapse, query_text, json.dumps(where, sort_keys=True))
+    with timed("query", mode=mode, filtered=int(where is not None)) as m:
+        results = query_cache.results_cache.get(key)
+        m["cache_hit"] = int(results is not None)
+        if results is None:
+            # Room for the duplicates that get folded away
+            fetch = n_results * DUPLICATE_OVERFETCH if collapse else n_results
+            if mode == "dense":
+                results = query_dense(query_text, n_results=fetch, where=where)
+            elif mode == "lexical":
+                results = query_lexical(query_text, n_results=fetch, where=where)
+            else:
+                results = query_hybrid(query_text, n_results=fetch, where=where)
+            if collapse:
+                results = collapse_duplicates(results, n_results)
+            query_cache.results_cache.put(key, results)
+    # Callers get their own copy, the cached one stays intact
+    return copy.deepcopy(results)
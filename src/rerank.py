@@ -0,0 +1,79 @@
+import time
+
+from src import query_cache
+from src.context import trim_passage
+from src.metrics import timed
+
+# Optional second stage after query_similar: a small cross-encoder reads the
+# query and each candidate post together and re-orders the candidates, so the
+# LLM gets fewer, better posts. Runs on CPU; the model loads on first use.
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# Posts fetched from query_similar for re-ranking, and how many are kept
+RERANK_CANDIDATES = 30
+RERANK_TOP_K = 8
+RERANK_BATCH_SIZE = 16
+# Long transcripts are cut to the sentences matching the query (the model reads 512 tokens at most)
+RERANK_PASSAGE_TOKENS = 256
+# Seconds of scoring after which the vector order is used instead
+RERANK_BUDGET_SECONDS = 2.0
+
+_model = None
+
+def get_reranker():
+    global _model
+    if _model is None:
+        from sentence_transformers import CrossEncoder
+        _model = CrossEncoder(RERANK_MODEL, max_length=512, device="cpu")
+    return _model
+
+# (collection version, query, post id) -> score. A new ingestion may change a
+# post's text, so scores expire with the collection version like search results.
+score_cache = query_cache.LRUCache(maxsize=4096, ttl=3600)
+
+def _take(results, order):
+    return {field: [[values[0][n] for n in order]] for field, values in results.items()}
+
+def rerank(query_text, results, top_k=RERANK_TOP_K, budget=RERANK_BUDGET_SECONDS, batch_size=RERANK_BATCH_SIZE):
+    """
+    Re-orders query_similar() results by cross-encoder score and keeps the best
+    top_k, with the scores in results["rerank_scores"]. If scoring takes longer
+    than budget seconds (model loading not included), the candidates keep their
+    vector order instead; scores computed so far are still cached.
+    """
+    ids = results['ids'][0]
+    docs = results['documents'][0]
+    version = query_cache.collection_version()
+    scores = {}
+    pending = []
+    for n, doc_id in enumerate(ids):
+        score = score_cache.get((version, query_text, doc_id))
+        if score is None:
+            pending.append(n)
+        else:
+            scores[doc_id] = score
+
+    with timed("rerank", items=len(ids), cache_hits=len(ids) - len(pending)) as m:
+        model = get_reranker() if pending else None
+        start = time.perf_counter()
+        over_budget = False
+        for batch_start in range(0, len(pending), batch_size):
+            batch = pending[batch_start:batch_start + batch_size]
+            pairs = [(query_text, trim_passage(docs[n], query_text, RERANK_PASSAGE_TOKENS)) for n in batch]
+            for n, score in zip(batch, model.predict(pairs, batch_size=batch_size)):
+                scores[ids[n]] = float(score)
+                score_cache.put((version, query_text, ids[n]), float(score))
+            # Checked after every batch, the last one included
+            if time.perf_counter() - start > budget:
+                over_budget = True
+                break
+
+        m["fallback"] = int(over_budget)
+        if m["fallback"]:
+            order = list(range(min(top_k, len(ids))))
+        else:
+            order = sorted(range(len(ids)), key=lambda n: scores[ids[n]], reverse=True)[:top_k]
+
+    reranked = _take(results, order)
+    reranked['rerank_scores'] = [[scores.get(ids[n]) for n in order]]
+    return reranked
@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+
+# Cheap check for "could this image contain text?", run before OCR so plain
+# photos skip the EasyOCR detector entirely. Text shows up as short runs of
+# strong, evenly spaced edges; this finds such runs with a morphological
+# gradient and counts the ones shaped like words or lines.
+# It is tuned to let through anything that might be text (false positives
+# only cost an OCR call, a miss loses the text).
+DETECT_WIDTH = 480
+MIN_TEXT_REGIONS = 1
+
+def text_regions(image, width=DETECT_WIDTH):
+    """
+    Number of word/line shaped edge clusters in a BGR or grayscale image.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    h, w = gray.shape[:2]
+    if w > width:
+        gray = cv2.resize(gray, (width, int(h * width / w)), interpolation=cv2.INTER_AREA)
+    height = gray.shape[0]
+
+    grad = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, edges = cv2.threshold(grad, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    # Flat images: Otsu picks a threshold in the noise, nothing stands out
+    if grad.max() < 40:
+        return 0
+    # Join the letters of a word horizontally
+    joined = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+
+    contours, _ = cv2.findContours(joined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    count = 0
+    for contour in contours:
+        x, y, cw, ch = cv2.boundingRect(contour)
+        if ch < 6 or ch > height / 4 or cw < 8 or cw < 1.5 * ch:
+            continue
+        # Letters leave a fair share of the box covered with edges
+        fill = np.count_nonzero(edges[y:y + ch, x:x + cw]) / float(cw * ch)
+        if fill >= 0.25:
+            count += 1
+    return count
+
+def has_text(image, min_regions=MIN_TEXT_REGIONS):
+    return text_regions(image) >= min_regions
@@ -0,0 +1,71 @@
+import os
+from pathlib import Path
+
+from src.metrics import timed
+from src.query_cache import LRUCache
+
+# Small WebP previews for the result cards, written next to the post's image
+# at ingestion time ("<image>_thumb.webp"). The app serves them from memory,
+# so a results page is tens of kilobytes instead of full-size JPEGs.
+THUMB_SUFFIX = "_thumb.webp"
+# Cards are 150 px wide; twice that stays sharp on high-DPI screens
+THUMB_WIDTH = 300
+THUMB_QUALITY = 70
+CACHE_BYTES = 32 * 1024 * 1024
+
+def thumbnail_path(image_path):
+    image_path = Path(image_path)
+    return image_path.with_name(image_path.stem + THUMB_SUFFIX)
+
+def make_thumbnail(image_path, width=THUMB_WIDTH, quality=THUMB_QUALITY):
+    """
+    Writes the thumbnail of image_path unless an up-to-date one exists.
+    Returns its path, or None if the image can't be read.
+    """
+    thumb = thumbnail_path(image_path)
+    try:
+        if thumb.exists() and thumb.stat().st_mtime >= Path(image_path).stat().st_mtime:
+            return str(thumb)
+    except FileNotFoundError:
+        return None
+
+    import cv2
+    with timed("thumbnail") as m:
+        image = cv2.imread(str(image_path), cv2.IMREAD_REDUCED_COLOR_2)
+        if image is None:
+            return None
+        h, w = image.shape[:2]
+        if w > width:
+            image = cv2.resize(image, (width, max(1, int(h * width / w))), interpolation=cv2.INTER_AREA)
+        ok, data = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, quality])
+        if not ok:
+            return None
+        tmp_path = thumb.with_name(f"{thumb.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data.tobytes())
+        os.replace(tmp_path, thumb)
+        m["bytes"] = len(data)
+    return str(thumb)
+
+# Thumbnail path -> encoded WebP bytes, bounded by total size
+thumb_cache = LRUCache(maxsize=4096, ttl=None, max_bytes=CACHE_BYTES)
+
+def load_thumbnail(thumb_path=None, image_path=None):
+    """
+    WebP bytes for a result card, or None if there is no image.
+    Posts indexed before thumbnails existed get theirs made from image_path on first view.
+    """
+    if not thumb_path and image_path:
+        thumb_path = str(thumbnail_path(image_path))
+    if not thumb_path:
+        return None
+    data = thumb_cache.get(thumb_path)
+    if data is not None:
+        return data
+    if not os.path.exists(thumb_path):
+        if not image_path or not make_thumbnail(image_path):
+            return None
+    with open(thumb_path, 'rb') as f:
+        data = f.read()
+    thumb_cache.put(thumb_path, data)
+    return data
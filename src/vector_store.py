@@ -0,0 +1,530 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# Compact alternative to the Chroma collection: embeddings quantized to int8
+# (or float16) in memory-mapped files, an IVF index (k-means lists) built with
+# NumPy, and documents/metadata in SQLite. It implements the part of Chroma's
+# collection API that rag_db uses, so rag_db works the same on either backend.
+# Select it with INSTARAG_VECTOR_BACKEND=numpy after migrating:
+#     python -m src.vector_store migrate --to numpy
+VECTOR_STORE_PATH = "data/vector_store"
+BACKEND_ENV = "INSTARAG_VECTOR_BACKEND"
+BACKENDS = ("chroma", "numpy")
+DTYPES = ("int8", "float16")
+DEFAULT_DTYPE = "int8"
+
+# Below this many vectors a full scan is as fast as the index
+IVF_MIN_ROWS = 20000
+# Lists probed per query; more = better recall, slower
+IVF_NPROBE = 24
+IVF_TRAIN_ITERATIONS = 10
+# Rebuild the lists once the store has grown this much since training
+IVF_REBUILD_GROWTH = 2.0
+# Deleted rows are reclaimed once they make up this share of the store
+COMPACT_DEAD_RATIO = 0.25
+# Filtered queries matching at most this many vectors are scored exactly
+EXACT_FILTER_ROWS = 50000
+# Rows scored per block in full scans (bounds the float32 temporary)
+SCAN_BLOCK = 65536
+
+def get_backend():
+    backend = os.environ.get(BACKEND_ENV, "chroma")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown vector backend '{backend}'. Available: {', '.join(BACKENDS)}")
+    return backend
+
+_FIELD = re.compile(r"^\w+$")
+_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+def where_sql(where):
+    """
+    Chroma `where` filter -> (SQL condition, params) over the records table.
+    Supports field equality, $eq/$ne/$gt/$gte/$lt/$lte, $in/$nin, $and and $or.
+    """
+    if not where:
+        return "1", []
+    clauses, params = [], []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_sql(w) for w in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            params += [p for _, ps in parts for p in ps]
+            continue
+        if not _FIELD.match(key):
+            raise ValueError(f"Unsupported metadata field: {key!r}")
+        column = "shortcode" if key == "shortcode" else f"json_extract(metadata, '$.{key}')"
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, value in condition.items():
+            if op in ("$in", "$nin"):
+                if not value:
+                    clauses.append("0" if op == "$in" else "1")
+                    continue
+                negate = "NOT " if op == "$nin" else ""
+                clauses.append(f"{column} {negate}IN ({', '.join('?' * len(value))})")
+                params += list(value)
+            elif op in _OPERATORS:
+                clauses.append(f"{column} {_OPERATORS[op]} ?")
+                params.append(value)
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+    return " AND ".join(clauses) or "1", params
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _top(scores, k):
+    """
+    Indices of the k highest scores, best first.
+    """
+    if len(scores) <= k:
+        return np.argsort(-scores)
+    part = np.argpartition(-scores, k)[:k]
+    return part[np.argsort(-scores[part])]
+
+def _kmeans(data, k, iterations, seed=0):
+    """
+    Spherical k-means on unit vectors; returns unit centroids.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.concatenate([np.argmax(data[s:s + SCAN_BLOCK] @ centroids.T, axis=1)
+                                 for s in range(0, len(data), SCAN_BLOCK)])
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        counts = np.bincount(labels, minlength=k)
+        # Empty clusters restart from a random point
+        empty = counts == 0
+        sums[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+class NumpyCollection:
+    """
+    Vectors are stored L2-normalized; distances are squared L2 (2 - 2 cos),
+    the same values Chroma's default space gives for normalized embeddings.
+    Deleted rows are masked out and reclaimed by compact(), which runs on its
+    own once they pass COMPACT_DEAD_RATIO of the store.
+    """
+    def __init__(self, path=VECTOR_STORE_PATH, embedding_function=None, dtype=None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.embedding_function = embedding_function
+        self.lock = threading.RLock()
+
+        self.meta_path = self.path / "meta.json"
+        if self.meta_path.exists():
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+            if dtype and dtype != self.meta['dtype'] and self.meta['rows']:
+                raise ValueError(f"{self.path} holds {self.meta['dtype']} vectors; migrate to change the dtype")
+        else:
+            self.meta = {"dtype": dtype or DEFAULT_DTYPE, "dim": None, "rows": 0, "capacity": 0,
+                         "trained_rows": 0}
+        if self.meta['dtype'] not in DTYPES:
+            raise ValueError(f"Unsupported dtype {self.meta['dtype']}. Available: {', '.join(DTYPES)}")
+
+        self.conn = sqlite3.connect(str(self.path / "records.sqlite"), timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS records (
+                id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL,
+                shortcode TEXT,
+                document TEXT,
+                metadata TEXT NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_row ON records (row)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_shortcode ON records (shortcode)")
+        self.conn.commit()
+
+        self.centroids = None
+        if (self.path / "centroids.npy").exists():
+            self.centroids = np.load(self.path / "centroids.npy")
+        self._lists = None
+        self._open_arrays()
+
+    # Storage
+
+    def _files(self):
+        dim = self.meta['dim']
+        files = {"vectors": (self.meta['dtype'], (dim,)), "alive": ("uint8", ()), "lists": ("int32", ())}
+        if self.meta['dtype'] == "int8":
+            files["scales"] = ("float32", ())
+        return files
+
+    def _open_arrays(self):
+        self.arrays = {}
+        capacity = self.meta['capacity']
+        if not capacity:
+            return
+        for name, (dtype, shape) in self._files().items():
+            self.arrays[name] = np.memmap(self.path / f"{name}.bin", dtype=dtype, mode='r+',
+                                          shape=(capacity,) + shape)
+
+    def _grow(self, rows):
+        if rows <= self.meta['capacity']:
+            return
+        capacity = max(rows, 2 * self.meta['capacity'], 1024)
+        self._flush()
+        # Memory maps are released before the files are extended (required on Windows)
+        self.arrays = {}
+        for name, (dtype, shape) in self._files().items():
+            row_bytes = np.dtype(dtype).itemsize * int(np.prod(shape))
+            with open(self.path / f"{name}.bin", 'ab') as f:
+                f.truncate(capacity * row_bytes)
+        old_capacity = self.meta['capacity']
+        self.meta['capacity'] = capacity
+        self._open_arrays()
+        self.arrays['lists'][old_capacity:] = -1
+
+    def _flush(self):
+        for array in self.arrays.values():
+            array.flush()
+        tmp_path = self.meta_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _encode(self, vectors):
+        vectors = _normalize(vectors)
+        if self.meta['dtype'] == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(np.float16), None
+
+    def _decode(self, rows):
+        vectors = np.asarray(self.arrays['vectors'][rows], dtype=np.float32)
+        if self.meta['dtype'] == "int8":
+            vectors *= self.arrays['scales'][rows][:, None]
+        return vectors
+
+    def _scores(self, rows, query):
+        return self._decode(rows) @ query
+
+    # Chroma collection API (the parts rag_db uses)
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None):
+        # An id given twice keeps its last record, like consecutive upserts
+        last = {doc_id: n for n, doc_id in enumerate(ids)}
+        if len(last) < len(ids):
+            keep = sorted(last.values())
+            ids = [ids[n] for n in keep]
+            documents = [documents[n] for n in keep] if documents is not None else None
+            metadatas = [metadatas[n] for n in keep] if metadatas is not None else None
+            embeddings = [embeddings[n] for n in keep] if embeddings is not None else None
+        if embeddings is None:
+            embeddings = self.embedding_function(documents)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+        with self.lock:
+            if self.meta['dim'] is None:
+                self.meta['dim'] = len(embeddings[0])
+            existing = dict(self._select("id, row", "id IN ({})".format(", ".join('?' * len(ids))), list(ids)))
+            rows = []
+            next_row = self.meta['rows']
+            for doc_id in ids:
+                if doc_id in existing:
+                    rows.append(existing[doc_id])
+                else:
+                    rows.append(next_row)
+                    next_row += 1
+            self._grow(next_row)
+            self.meta['rows'] = next_row
+
+            rows = np.asarray(rows)
+            vectors, scales = self._encode(embeddings)
+            self.arrays['vectors'][rows] = vectors
+            if scales is not None:
+                self.arrays['scales'][rows] = scales
+            self.arrays['alive'][rows] = 1
+            self.arrays['lists'][rows] = self._assign(rows) if self.centroids is not None else -1
+
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO records (id, row, shortcode, document, metadata) VALUES (?, ?, ?, ?, ?)",
+                [(doc_id, int(row), (meta or {}).get('shortcode'), doc, json.dumps(meta or {}))
+                 for doc_id, row, doc, meta in zip(ids, rows, documents, metadatas)]
+            )
+            self.conn.commit()
+            self._lists = None
+            self._flush()
+            self._maybe_rebuild()
+
+    def update(self, ids, metadatas):
+        with self.lock:
+            current = {doc_id: json.loads(meta) for doc_id, meta in
+                       self._select("id, metadata", "id IN ({})".format(", ".join('?' * len(ids))), list(ids))}
+            rows = []
+            for doc_id, meta in zip(ids, metadatas):
+                if doc_id in current:
+                    # Like Chroma: given keys are replaced, the rest kept
+                    merged = {**current[doc_id], **meta}
+                    rows.append((merged.get('shortcode'), json.dumps(merged), doc_id))
+            self.conn.executemany("UPDATE records SET shortcode = ?, metadata = ? WHERE id = ?", rows)
+            self.conn.commit()
+
+    def delete(self, ids=None, where=None):
+        with self.lock:
+            sql, params = where_sql(where)
+            if ids is not None:
+                sql += " AND id IN ({})".format(", ".join('?' * len(ids)))
+                params += list(ids)
+            rows = [row for (row,) in self._select("row", sql, params)]
+            if rows:
+                self.arrays['alive'][np.asarray(rows)] = 0
+                self.conn.execute(f"DELETE FROM records WHERE {sql}", params)
+                self.conn.commit()
+                self._lists = None
+                self._flush()
+                self._maybe_rebuild()
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        with self.lock:
+            sql, params = where_sql(where)
+            if ids is not None:
+                sql += " AND id IN ({})".format(", ".join('?' * len(ids)))
+                params += list(ids)
+            sql += " ORDER BY row"
+            if limit is not None or offset:
+                sql += " LIMIT ? OFFSET ?"
+                params += [-1 if limit is None else limit, offset or 0]
+            records = self._select("id, row, document, metadata", sql, params)
+            result = {"ids": [r[0] for r in records]}
+            if "documents" in include:
+                result["documents"] = [r[2] for r in records]
+            if "metadatas" in include:
+                result["metadatas"] = [json.loads(r[3]) for r in records]
+            if "embeddings" in include:
+                rows = np.asarray([r[1] for r in records], dtype=np.int64)
+                result["embeddings"] = self._decode(rows).tolist() if len(rows) else []
+            return result
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, where=None,
+              include=("documents", "metadatas", "distances")):
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(query_texts)
+        out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self.lock:
+            allowed = None
+            if where:
+                sql, params = where_sql(where)
+                allowed = np.asarray([row for (row,) in self._select("row", sql, params)], dtype=np.int64)
+            for query in _normalize(query_embeddings):
+                rows, scores = self._search(query, n_results, allowed)
+                by_row = {r[1]: r for r in self._select(
+                    "id, row, document, metadata", "row IN ({})".format(", ".join('?' * len(rows))),
+                    [int(r) for r in rows])} if len(rows) else {}
+                found = [(by_row[int(r)], s) for r, s in zip(rows, scores) if int(r) in by_row]
+                out["ids"].append([rec[0] for rec, _ in found])
+                out["documents"].append([rec[2] for rec, _ in found])
+                out["metadatas"].append([json.loads(rec[3]) for rec, _ in found])
+                out["distances"].append([float(2.0 - 2.0 * s) for _, s in found])
+        return {key: value for key, value in out.items() if key == "ids" or key in include}
+
+    def _select(self, columns, where_clause, params):
+        return self.conn.execute(f"SELECT {columns} FROM records WHERE {where_clause}", params).fetchall()
+
+    # Search
+
+    def _search(self, query, k, allowed=None):
+        """
+        (rows, scores) of the k best live vectors, optionally restricted to `allowed` rows.
+        """
+        if not self.meta['rows'] or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if allowed is not None:
+            if len(allowed) <= EXACT_FILTER_ROWS or self.centroids is None:
+                return self._exact(query, k, allowed)
+        if self.centroids is None:
+            return self._exact(query, k)
+
+        candidates = self._probe(query)
+        if allowed is not None:
+            candidates = candidates[np.isin(candidates, allowed)]
+        if len(candidates) < k and allowed is not None:
+            # The filter removed too much of the probed lists
+            return self._exact(query, k, allowed)
+        scores = self._scores(candidates, query)
+        best = _top(scores, k)
+        return candidates[best], scores[best]
+
+    def _exact(self, query, k, rows=None):
+        alive = self.arrays['alive']
+        if rows is not None:
+            rows = rows[alive[rows] == 1]
+            scores = self._scores(rows, query)
+            best = _top(scores, k)
+            return rows[best], scores[best]
+
+        best_rows, best_scores = [], []
+        for start in range(0, self.meta['rows'], SCAN_BLOCK):
+            block = np.arange(start, min(start + SCAN_BLOCK, self.meta['rows']))
+            block = block[alive[block] == 1]
+            if not len(block):
+                continue
+            scores = self._scores(block, query)
+            top = _top(scores, k)
+            best_rows.append(block[top])
+            best_scores.append(scores[top])
+        if not best_rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows, scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        top = _top(scores, k)
+        return rows[top], scores[top]
+
+    # IVF index
+
+    def _assign(self, rows):
+        labels = []
+        for start in range(0, len(rows), SCAN_BLOCK):
+            block = rows[start:start + SCAN_BLOCK]
+            labels.append(np.argmax(self._decode(block) @ self.centroids.T, axis=1))
+        return np.concatenate(labels).astype(np.int32) if labels else np.zeros(0, dtype=np.int32)
+
+    def _probe(self, query, nprobe=None):
+        if self._lists is None:
+            lists = self.arrays['lists'][:self.meta['rows']]
+            live = np.nonzero((self.arrays['alive'][:self.meta['rows']] == 1) & (lists >= 0))[0]
+            order = live[np.argsort(lists[live], kind="stable")]
+            offsets = np.searchsorted(lists[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, offsets)
+        order, offsets = self._lists
+        probes = _top(self.centroids @ query, nprobe or IVF_NPROBE)
+        return np.concatenate([order[offsets[p]:offsets[p + 1]] for p in probes])
+
+    def build_index(self, nlist=None, sample=None, iterations=IVF_TRAIN_ITERATIONS):
+        """
+        Trains the k-means lists on a sample of the live vectors and assigns every vector.
+        """
+        with self.lock:
+            live = np.nonzero(self.arrays['alive'][:self.meta['rows']] == 1)[0] if self.meta['rows'] else []
+            if len(live) < IVF_MIN_ROWS:
+                # Too small to benefit; plain scans
+                self.centroids = None
+                (self.path / "centroids.npy").unlink(missing_ok=True)
+                return 0
+            nlist = nlist or int(min(4096, max(16, 2 * np.sqrt(len(live)))))
+            sample = sample or min(len(live), 64 * nlist)
+            rng = np.random.default_rng(0)
+            training = self._decode(np.sort(rng.choice(live, size=sample, replace=False)))
+            self.centroids = _kmeans(training, nlist, iterations)
+            np.save(self.path / "centroids.npy", self.centroids)
+            self.arrays['lists'][live] = self._assign(live)
+            self.meta['trained_rows'] = len(live)
+            self._lists = None
+            self._flush()
+            return nlist
+
+    def _maybe_rebuild(self):
+        live = self.count()
+        if self.meta['rows'] - live > COMPACT_DEAD_RATIO * self.meta['rows']:
+            self.compact()
+        trained = self.meta.get('trained_rows') or 0
+        if live >= IVF_MIN_ROWS and (self.centroids is None or live >= IVF_REBUILD_GROWTH * trained):
+            self.build_index()
+
+    def compact(self):
+        """
+        Rewrites the live vectors contiguously, dropping deleted rows.
+        """
+        with self.lock:
+            pairs = self.conn.execute("SELECT id, row FROM records ORDER BY row").fetchall()
+            old_rows = np.asarray([row for _, row in pairs], dtype=np.int64)
+            for name, array in self.arrays.items():
+                array[:len(old_rows)] = array[old_rows]
+            # Ascending order: a row only ever moves down into a slot already vacated
+            self.conn.executemany("UPDATE records SET row = ? WHERE id = ?",
+                                  [(new, doc_id) for new, (doc_id, _) in enumerate(pairs)])
+            self.conn.commit()
+            if self.arrays:
+                self.arrays['alive'][len(old_rows):] = 0
+            freed = self.meta['rows'] - len(old_rows)
+            self.meta['rows'] = len(old_rows)
+            self._lists = None
+            self._flush()
+            return freed
+
+    def stats(self):
+        files = [f for f in self.path.iterdir() if f.is_file()]
+        return {
+            "vectors": self.count(),
+            "rows": self.meta['rows'],
+            "dtype": self.meta['dtype'],
+            "dim": self.meta['dim'],
+            "nlist": 0 if self.centroids is None else len(self.centroids),
+            "disk_mb": round(sum(f.stat().st_size for f in files) / 1e6, 1),
+        }
+
+def migrate(source, target, batch_size=1000):
+    """
+    Copies ids, documents, metadata and stored embeddings from one collection to another.
+    """
+    total = source.count()
+    for offset in range(0, total, batch_size):
+        page = source.get(include=["documents", "metadatas", "embeddings"], limit=batch_size, offset=offset)
+        if not page['ids']:
+            break
+        target.upsert(ids=page['ids'], documents=page['documents'], metadatas=page['metadatas'],
+                      embeddings=[list(map(float, e)) for e in page['embeddings']])
+        print(f"Copied {min(offset + batch_size, total)}/{total}")
+    return total
+
+def main(argv=None):
+    """
+        python -m src.vector_store migrate --to numpy [--dtype int8|float16]
+        python -m src.vector_store migrate --to chroma
+        python -m src.vector_store build-index | compact | stats
+    """
+    from src import rag_db, query_cache
+
+    parser = argparse.ArgumentParser(prog="python -m src.vector_store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_cmd = commands.add_parser("migrate", help="copy the index between Chroma and the NumPy store")
+    migrate_cmd.add_argument("--to", choices=BACKENDS, required=True)
+    migrate_cmd.add_argument("--dtype", choices=DTYPES, default=DEFAULT_DTYPE)
+    commands.add_parser("build-index", help="(re)train the IVF lists of the NumPy store")
+    commands.add_parser("compact", help="reclaim space of deleted vectors in the NumPy store")
+    commands.add_parser("stats", help="size of the NumPy store")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        chroma = rag_db.get_client().get_or_create_collection(
+            name=rag_db.COLLECTION_NAME, embedding_function=rag_db.get_embedding_function())
+        store = NumpyCollection(embedding_function=rag_db.get_embedding_function(),
+                                dtype=args.dtype if args.to == "numpy" else None)
+        source, target = (chroma, store) if args.to == "numpy" else (store, chroma)
+        copied = migrate(source, target)
+        if args.to == "numpy":
+            store.build_index()
+            print(store.stats())
+        query_cache.bump_collection_version()
+        print(f"Migrated {copied} vectors. Use it with {BACKEND_ENV}={args.to}")
+        return 0
+
+    store = NumpyCollection()
+    if args.command == "build-index":
+        print(f"Built {store.build_index()} lists")
+    elif args.command == "compact":
+        print(f"Freed {store.compact()} rows")
+        store.build_index()
+    print(store.stats())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
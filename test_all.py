@@ -1,7 +1,16 @@
 import sys
 import os
+import json
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
+import pytest
+
 # Add src to path
 sys.path.append(os.getcwd())
 
@@ -9,6 +18,12 @@ from src.ingest import load_shortcodes, download_post
 from src.processor import process_pipeline
 from src.rag_db import ingest_document, query_similar
 
+@pytest.fixture(autouse=True)
+def metrics_path(tmp_path, monkeypatch):
+    # Timings recorded by the code under test stay out of the real data/metrics.jsonl
+    from src import metrics
+    monkeypatch.setattr(metrics, "METRICS_PATH", str(tmp_path / "metrics.jsonl"))
+
 def test_pipeline():
     print("=== Testing Pipeline ===")
     
@@ -53,5 +68,903 @@ def test_pipeline():
     else:
         print("Processing returned None.")
 
+class StubInstagram(BaseHTTPRequestHandler):
+    """
+    Local stand-in for Instagram: answers 429 to the first `rate_limited`
+    requests for a post, then serves its JSON.
+    """
+    rate_limited = 2
+    hits = {}
+
+    def do_GET(self):
+        code = self.path.strip('/').split('/')[-1]
+        StubInstagram.hits[code] = StubInstagram.hits.get(code, 0) + 1
+        if StubInstagram.hits[code] <= StubInstagram.rate_limited:
+            self.send_response(429)
+            self.end_headers()
+            return
+        body = json.dumps({"shortcode": code}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def http_fetcher(base_url):
+    from src.downloader import RateLimited
+
+    def fetch(shortcode, target_dir):
+        try:
+            with urllib.request.urlopen(f"{base_url}/p/{shortcode}/") as resp:
+                data = resp.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                raise RateLimited("429 Too Many Requests")
+            raise
+        post_dir = Path(target_dir) / shortcode
+        post_dir.mkdir(parents=True, exist_ok=True)
+        (post_dir / f"{shortcode}.json").write_bytes(data)
+    return fetch
+
+def test_downloader_backoff_and_resume():
+    from src.downloader import Downloader
+
+    StubInstagram.hits = {}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubInstagram)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            queue_path = Path(tmp) / "queue.sqlite"
+            settings = dict(fetch=http_fetcher(base_url), rate=1000, burst=10,
+                            backoff_base=0.05, queue_path=queue_path)
+            dl = Downloader(Path(tmp) / "raw", **settings)
+
+            # 429 -> queued for retry, not due yet
+            assert dl.download("ABC123") is False
+            assert "rate limited" in dl.last_error("ABC123")
+            assert dl.due() == []
+
+            # A new run (fresh Downloader, same queue) respects the backoff without hitting the server
+            dl = Downloader(Path(tmp) / "raw", **settings)
+            assert dl.download("ABC123") is False
+            assert StubInstagram.hits["ABC123"] == 1
+
+            # Backoff doubles per attempt; keep retrying once due until the stub gives in
+            for _ in range(10):
+                time.sleep(0.3)
+                if dl.download("ABC123"):
+                    break
+            assert StubInstagram.hits["ABC123"] == 3
+            assert dl.pending() == []
+            assert (Path(tmp) / "raw" / "ABC123" / "ABC123.json").exists()
+    finally:
+        server.shutdown()
+
+def test_token_bucket_rate():
+    from src.downloader import TokenBucket
+
+    bucket = TokenBucket(rate=20, burst=1)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    # 1 from the burst, 4 more at 20/s
+    assert time.monotonic() - start >= 0.18
+
+def test_run_lock():
+    import subprocess
+    from src import manifest
+
+    with tempfile.TemporaryDirectory() as tmp:
+        original = manifest.LOCK_PATH
+        manifest.LOCK_PATH = str(Path(tmp) / "pipeline.pid")
+        try:
+            # A lock left behind by a dead process is ignored
+            Path(manifest.LOCK_PATH).write_text("999999999")
+            assert manifest.running_pid() is None
+
+            with manifest.run_lock():
+                assert manifest.running_pid() == os.getpid()
+                # Taking it is exclusive, even for a second attempt in the same process
+                try:
+                    with manifest.run_lock():
+                        assert False, "lock should be held"
+                except manifest.AlreadyRunning:
+                    pass
+            assert manifest.running_pid() is None
+            assert not Path(manifest.LOCK_PATH).exists()
+
+            # Held by another run
+            holder = subprocess.Popen(
+                [sys.executable, "-c",
+                 "import sys; from src import manifest; manifest.LOCK_PATH = sys.argv[1]\n"
+                 "with manifest.run_lock():\n    print('locked', flush=True); sys.stdin.read()",
+                 manifest.LOCK_PATH],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, cwd=os.getcwd())
+            try:
+                assert holder.stdout.readline().strip() == "locked"
+                assert manifest.running_pid() == holder.pid
+                try:
+                    with manifest.run_lock():
+                        assert False, "lock should be held"
+                except manifest.AlreadyRunning:
+                    pass
+            finally:
+                # Killed without cleaning up: the OS releases the lock
+                holder.kill()
+                holder.wait()
+            with manifest.run_lock():
+                assert manifest.running_pid() == os.getpid()
+        finally:
+            manifest.LOCK_PATH = original
+
+def test_text_gate():
+    import cv2
+    import numpy as np
+    from src.text_detect import has_text
+
+    slide = np.full((1350, 1080, 3), 235, np.uint8)
+    assert not has_text(slide)
+    cv2.putText(slide, "3 ingredient pasta", (60, 300), cv2.FONT_HERSHEY_SIMPLEX, 2, (20, 20, 20), 4)
+    assert has_text(slide)
+
+    # A smooth photo-like gradient with no text
+    ramp = np.tile(np.linspace(0, 255, 1080, dtype=np.uint8), (1080, 1))
+    assert not has_text(cv2.GaussianBlur(ramp, (0, 0), 5))
+
+def test_near_duplicate_index():
+    import cv2
+    import numpy as np
+    from src import fingerprints
+
+    rng = np.random.default_rng(0)
+    photo = cv2.resize(rng.integers(0, 255, (20, 20, 3), dtype=np.uint8), (1080, 1080),
+                       interpolation=cv2.INTER_CUBIC)
+    other = cv2.resize(rng.integers(0, 255, (20, 20, 3), dtype=np.uint8), (1080, 1080),
+                       interpolation=cv2.INTER_CUBIC)
+    # A smaller, recompressed repost
+    _, jpg = cv2.imencode(".jpg", cv2.resize(photo, (640, 640)), [cv2.IMWRITE_JPEG_QUALITY, 50])
+    repost = cv2.imdecode(jpg, cv2.IMREAD_COLOR)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        original = fingerprints.FINGERPRINT_PATH
+        fingerprints.FINGERPRINT_PATH = str(Path(tmp) / "fingerprints.sqlite")
+        fingerprints._conn = None
+        try:
+            fingerprints.add_image("h1", "POST1", fingerprints.image_phash(photo))
+            fingerprints.add_image("h2", "POST2", fingerprints.image_phash(other))
+            matches = fingerprints.similar_images(fingerprints.image_phash(repost), exclude_shortcode="POST3")
+            assert [m[1] for m in matches] == ["POST1"]
+
+            # Two slides of one template with different wording: close hashes, different text
+            slides = {}
+            for n, text in enumerate(["Step 1: preheat oven to 200C", "Step 2: whisk the eggs well"]):
+                slide = np.full((1080, 1080, 3), (200, 220, 250), dtype=np.uint8)
+                cv2.putText(slide, text, (60, 540), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (40, 40, 120), 2)
+                slides[n] = Path(tmp) / f"slide{n}.jpg"
+                cv2.imwrite(str(slides[n]), slide)
+            repost_path = Path(tmp) / "repost.jpg"
+            cv2.imwrite(str(repost_path), cv2.resize(cv2.imread(str(slides[0])), (640, 640)),
+                        [cv2.IMWRITE_JPEG_QUALITY, 50])
+            hashes = {n: fingerprints.image_phash(cv2.imread(str(path))) for n, path in slides.items()}
+            assert fingerprints.hamming(hashes[0], hashes[1]) <= fingerprints.IMAGE_MAX_DISTANCE
+            fingerprints.add_image("s0", "SLIDES", hashes[0], path=slides[0])
+            assert not fingerprints.similar_images(hashes[1], path=slides[1])
+            repost_hash = fingerprints.image_phash(cv2.imread(str(repost_path)))
+            assert [m[0] for m in fingerprints.similar_images(repost_hash, path=repost_path)] == ["s0"]
+
+            fingerprints.set_duplicate("POST3", "POST1")
+            fingerprints.set_duplicate("POST4", "POST3")
+            assert fingerprints.canonical("POST4") == "POST1"
+        finally:
+            fingerprints.FINGERPRINT_PATH = original
+            fingerprints._conn = None
+
+    # Same soundtrack at half volume with a slight offset vs unrelated noise
+    t = np.arange(16000 * 8) / 16000
+    tone = np.sin(2 * np.pi * 440 * t * (1 + 0.1 * np.sin(t))).astype(np.float32)
+    tone += 0.3 * rng.standard_normal(len(t)).astype(np.float32) * np.sin(3 * t).astype(np.float32) ** 2
+    a = fingerprints.audio_fingerprint(tone)
+    b = fingerprints.audio_fingerprint(0.5 * tone[2400:])
+    c = fingerprints.audio_fingerprint(rng.standard_normal(len(t)).astype(np.float32))
+    assert fingerprints.bit_error_rate(a, b) < fingerprints.AUDIO_MAX_BER
+    assert fingerprints.bit_error_rate(a, c) > fingerprints.AUDIO_MAX_BER
+
+def test_numpy_vector_store():
+    import numpy as np
+    from src import vector_store
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((40, 16)).astype(np.float32)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = vector_store.NumpyCollection(Path(tmp) / "store", dtype="int8")
+        store.upsert(ids=[f"P{i}#0" for i in range(40)], documents=[f"doc {i}" for i in range(40)],
+                     metadatas=[{"shortcode": f"P{i}", "kind": "reel" if i % 2 else "image"} for i in range(40)],
+                     embeddings=vectors.tolist())
+        hits = store.query(query_embeddings=[vectors[7].tolist()], n_results=3)
+        assert hits['ids'][0][0] == "P7#0" and hits['distances'][0][0] < 0.01
+
+        hits = store.query(query_embeddings=[vectors[7].tolist()], n_results=3, where={"kind": "image"})
+        assert all(meta['kind'] == "image" for meta in hits['metadatas'][0])
+
+        store.delete(where={"shortcode": {"$in": ["P7"]}})
+        store.update(ids=["P8#0"], metadatas=[{"kind": "carousel"}])
+        assert store.compact() == 1
+        # Reopened from disk
+        store = vector_store.NumpyCollection(Path(tmp) / "store")
+        assert store.count() == 39 and not store.get(ids=["P7#0"])['ids']
+        assert store.get(ids=["P8#0"])['metadatas'] == [{"shortcode": "P8", "kind": "carousel"}]
+        hits = store.query(query_embeddings=[vectors[9].tolist()], n_results=1)
+        assert hits['ids'][0] == ["P9#0"]
+
+def test_numpy_vector_store_dedupe_and_compaction(tmp_path):
+    import numpy as np
+    from src import vector_store
+
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((8, 16)).astype(np.float32)
+    store = vector_store.NumpyCollection(tmp_path / "store")
+    # The same id twice in one call: the last one wins and there is one live row
+    store.upsert(ids=["A#0", "B#0", "A#0"], documents=["old", "b", "new"],
+                 metadatas=[{"shortcode": "A"}, {"shortcode": "B"}, {"shortcode": "A"}],
+                 embeddings=vectors[:3])
+    hits = store.query(query_embeddings=[vectors[2]], n_results=5)
+    assert hits['ids'][0] == ["A#0", "B#0"] and hits['documents'][0][0] == "new"
+    assert store.meta['rows'] == 2
+
+    # Re-ingesting deletes and re-adds; dead rows don't pile up
+    for n in range(20):
+        store.delete(where={"shortcode": {"$in": ["A"]}})
+        store.upsert(ids=["A#0", "A#1"], documents=["a0", "a1"], metadatas=[{"shortcode": "A"}] * 2,
+                     embeddings=vectors[3:5])
+        assert store.meta['rows'] - store.count() <= vector_store.COMPACT_DEAD_RATIO * store.meta['rows']
+    assert store.count() == 3 and store.meta['rows'] <= 4
+    assert store.query(query_embeddings=[vectors[4]], n_results=1)['ids'][0] == ["A#1"]
+
+def test_rerank_order_cache_and_budget():
+    from src import rerank
+
+    class WordOverlap:
+        delay = 0.0
+        calls = 0
+        def predict(self, pairs, batch_size=None):
+            self.calls += 1
+            time.sleep(self.delay)
+            return [len(set(q.split()) & set(d.split())) for q, d in pairs]
+
+    results = {"ids": [["A", "B", "C"]], "documents": [["pasta", "pasta recipe", "pasta recipe easy"]],
+               "metadatas": [[{}, {}, {}]], "distances": [[0.1, 0.2, 0.3]]}
+    original = rerank._model
+    rerank._model = WordOverlap()
+    rerank.score_cache.clear()
+    try:
+        ranked = rerank.rerank("easy pasta recipe", results, top_k=2)
+        assert ranked['ids'] == [["C", "B"]] and ranked['distances'] == [[0.3, 0.2]]
+        assert ranked['rerank_scores'] == [[3.0, 2.0]]
+        rerank.rerank("easy pasta recipe", results, top_k=2)
+        assert rerank._model.calls == 1
+
+        # A slow model: the one (and last) batch finishes past the budget, search order is kept
+        rerank.score_cache.clear()
+        rerank._model.delay = 0.05
+        fallback = rerank.rerank("easy pasta recipe", results, top_k=2, budget=0.01)
+        assert fallback['ids'] == [["A", "B"]]
+        # Several batches: scoring stops after the first one that ends over budget
+        fallback = rerank.rerank("pasta", results, top_k=3, budget=0.01, batch_size=1)
+        assert fallback['ids'] == [["A", "B", "C"]] and rerank._model.calls == 3
+    finally:
+        rerank._model = original
+        rerank.score_cache.clear()
+
+def test_thumbnails():
+    import cv2
+    import numpy as np
+    from src import thumbnails
+    from src.query_cache import LRUCache
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = Path(tmp) / "POST_1.jpg"
+        photo = cv2.resize(np.random.default_rng(0).integers(0, 255, (30, 30, 3), dtype=np.uint8), (1080, 1350))
+        cv2.imwrite(str(image_path), photo)
+
+        thumb_path = thumbnails.make_thumbnail(image_path)
+        assert thumb_path == str(Path(tmp) / "POST_1_thumb.webp")
+        thumb = cv2.imread(thumb_path)
+        assert thumb.shape[1] == thumbnails.THUMB_WIDTH
+        assert os.path.getsize(thumb_path) < os.path.getsize(image_path) / 5
+
+        # Indexed before thumbnails: made on first view, then served from memory
+        os.remove(thumb_path)
+        thumbnails.thumb_cache.clear()
+        data = thumbnails.load_thumbnail(None, str(image_path))
+        assert data and os.path.exists(thumb_path)
+        os.remove(thumb_path)
+        assert thumbnails.load_thumbnail(thumb_path, str(image_path)) == data
+        thumbnails.thumb_cache.clear()
+
+    cache = LRUCache(maxsize=10, max_bytes=10)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    cache.put("c", b"123")
+    assert cache.get("a") is None and cache.get("b") and cache.bytes == 8
+
+def test_metrics_rotation(monkeypatch):
+    from src import metrics
+
+    monkeypatch.setattr(metrics, "MAX_BYTES", 2000)
+    for n in range(60):
+        metrics.record("ocr", 0.01 * (n + 1), items=1)
+    assert os.path.getsize(metrics.METRICS_PATH) <= 2000
+    assert os.path.exists(metrics.METRICS_PATH + ".1")
+    # The summary still sees the rotated entries
+    entries = metrics.load()
+    assert len(entries) > 60 - 2000 // 80 and entries[-1]['seconds'] == 0.6
+    assert metrics.summarize(entries)[0]['stage'] == "ocr"
+
+def test_metrics_rotation_across_processes():
+    import subprocess
+    from src import metrics
+
+    # Four writers and room for one rotation: no process may rotate the file another just rotated in
+    script = ("import sys; from src import metrics\n"
+              "metrics.METRICS_PATH, metrics.MAX_BYTES = sys.argv[1], 60000\n"
+              "for n in range(250): metrics.record('ocr', 0.01, items=n)")
+    writers = [subprocess.Popen([sys.executable, "-c", script, metrics.METRICS_PATH], cwd=os.getcwd())
+               for _ in range(4)]
+    assert all(w.wait() == 0 for w in writers)
+    assert os.path.exists(metrics.METRICS_PATH + ".1")
+    assert len(metrics.load()) == 1000
+
+def test_collection_filter_matches_every_collection(tmp_path, monkeypatch):
+    import numpy as np
+    from src import query_cache, rag_db, vector_store
+
+    monkeypatch.setattr(query_cache, "VERSION_PATH", str(tmp_path / "collection_version"))
+
+    posts = [
+        {"shortcode": "P1", "collections": ["Recipes", "Weekend ideas"], "added_time": 1700000000, "kind": "reel"},
+        {"shortcode": "P2", "collections": ["Travel"], "added_time": 1700000000, "kind": "post"},
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = vector_store.NumpyCollection(Path(tmp) / "store")
+        store.upsert(ids=["P1#0", "P2#0"], documents=["a", "b"],
+                     metadatas=[{"shortcode": "P1"}, {"shortcode": "P2"}], embeddings=np.eye(2).tolist())
+        original = rag_db._collection
+        rag_db._collection = store
+        try:
+            assert rag_db.update_post_metadata(posts) == 2
+            matching = lambda names: store.get(where=rag_db.build_filter(names), include=[])['ids']
+            # A post's second collection matches too
+            assert matching(["Weekend ideas"]) == ["P1#0"]
+            assert matching(["Travel", "Weekend ideas"]) == ["P1#0", "P2#0"]
+
+            # Removed from a collection since the last sync
+            posts[0]['collections'] = ["Recipes"]
+            assert rag_db.update_post_metadata(posts) == 1
+            assert matching(["Weekend ideas"]) == []
+            assert matching(["Recipes"]) == ["P1#0"]
+        finally:
+            rag_db._collection = original
+
+def test_iter_posts_streaming(tmp_path, monkeypatch):
+    import io
+    from src import ingest
+
+    # Numbers split at every possible chunk boundary
+    for chunk_size in range(1, 9):
+        stream = ingest._Stream(io.StringIO('[1700000123, -2.5e10, {"t": 98765}, 7]'), chunk_size=chunk_size)
+        assert list(stream.array_items()) == [1700000123, -2.5e10, {"t": 98765}, 7]
+
+    # Instagram escapes UTF-8 text as Latin-1
+    name = "Beğendiğim".encode('utf-8').decode('latin-1')
+    collections = {"saved_saved_collections": [
+        {"title": "Collection", "string_map_data": {"Name": {"value": name}}},
+        {"string_map_data": {"Name": {"href": "https://www.instagram.com/reel/AAA111/"},
+                             "Added Time": {"timestamp": 1700000001}}},
+        {"string_map_data": {"Name": {"href": "https://www.instagram.com/p/BBB222/"},
+                             "Added Time": {"timestamp": 1700000002}}},
+        {"title": "Collection", "string_map_data": {"Name": {"value": "Recipes"}}},
+        {"string_map_data": {"Name": {"href": "https://www.instagram.com/p/BBB222/"},
+                             "Added Time": {"timestamp": 1700000003}}},
+    ]}
+    media = {"saved_saved_media": [
+        {"title": "CCC333", "string_map_data": {"Saved on": {"href": "https://www.instagram.com/p/CCC333/",
+                                                             "timestamp": 1700000004}}},
+        {"string_map_data": {"Shortcode": {"value": "DDD444"}, "Added Time": {"timestamp": 1700000005}}},
+    ]}
+    (tmp_path / "a_collections.json").write_text(json.dumps(collections), encoding='utf-8')
+    (tmp_path / "b_saved_posts.json").write_text(json.dumps(media), encoding='utf-8')
+    (tmp_path / "notes.txt").write_text("not an export", encoding='utf-8')
+
+    expected = [
+        ingest.PostRecord("AAA111", "Beğendiğim", 1700000001, "reel"),
+        ingest.PostRecord("BBB222", "Beğendiğim", 1700000002, "post"),
+        ingest.PostRecord("BBB222", "Recipes", 1700000003, "post"),
+        ingest.PostRecord("CCC333", None, 1700000004, "post"),
+        ingest.PostRecord("DDD444", None, 1700000005, None),
+    ]
+    original = ingest._Stream
+    for chunk_size in (1, 5, 13, 1 << 16):
+        monkeypatch.setattr(ingest, "_Stream", lambda f, n=chunk_size: original(f, chunk_size=n))
+        assert list(ingest.iter_posts(tmp_path)) == expected
+
+    # A directory of exports, merged per post
+    posts = ingest.load_posts(tmp_path)
+    assert [p['shortcode'] for p in posts] == ["AAA111", "BBB222", "CCC333", "DDD444"]
+    assert posts[1]['collections'] == ["Beğendiğim", "Recipes"]
+    assert posts[1]['added_time'] == 1700000002
+
+def test_chunk_round_trip_and_aggregation(tmp_path, monkeypatch):
+    import random
+    import numpy as np
+    from src import query_cache, rag_db, vector_store
+    from src.chunking import chunk_post, assemble_post
+
+    transcript = " ".join(f"Sentence number {n} is about pasta." for n in range(60))
+    content = "\n".join([
+        "Best pasta in town! Go early.",
+        "[Image Text]: OPEN 9-5 | MENU",
+        "[Video Overlay Text]: step 1 | step 2",
+        f"[Audio Transcript]: {transcript}",
+    ])
+    chunks = chunk_post(content, max_words=40)
+    assert [c['modality'] for c in chunks[:3]] == ["caption", "image_text", "video_text"]
+    assert len(chunks) > 4 and all(c['modality'] == "transcript" for c in chunks[3:])
+    assert all(len(c['text'].split()) <= 40 for c in chunks)
+    # Stored chunk order doesn't matter, the chunk number puts them back
+    records = [{**c, "chunk": n} for n, c in enumerate(chunks)]
+    random.Random(0).shuffle(records)
+    assert assemble_post(records) == content
+
+    # One very close chunk (A) against three fairly close ones (B)
+    monkeypatch.setattr(query_cache, "VERSION_PATH", str(tmp_path / "collection_version"))
+    monkeypatch.setattr(rag_db, "embed_query", lambda text: [1.0, 0.0, 0.0])
+    store = vector_store.NumpyCollection(tmp_path / "store")
+    store.upsert(ids=["A#0", "B#0", "B#1", "B#2", "C#0"],
+                 metadatas=[{"shortcode": code} for code in "ABBBC"],
+                 embeddings=[[1.0, 0.05, 0.0], [0.8, 0.6, 0.0], [0.8, 0.0, 0.6], [0.8, -0.6, 0.0], [0.0, 1.0, 0.0]])
+    monkeypatch.setattr(rag_db, "_collection", store)
+
+    by_max = rag_db.query_chunks("pasta", n_results=2, aggregation="max")
+    by_sum = rag_db.query_chunks("pasta", n_results=2, aggregation="sum")
+    assert [code for code, _, _ in by_max] == ["A", "B"]
+    assert [code for code, _, _ in by_sum] == ["B", "A"]
+    # B's three chunks are equally close: the sum is three times the best one
+    assert by_sum[0][1] == pytest.approx(3 * by_max[1][1], rel=0.05)
+    # The best chunk distance is reported either way
+    assert by_max[0][2] == by_sum[1][2] < 0.01
+
+def test_pack_context_budget():
+    from src.context import estimate_tokens, pack_context, trim_passage, MIN_PASSAGE_TOKENS
+
+    query = "best ramen broth"
+    filler = " ".join(f"Unrelated remark {n} about the weather today." for n in range(80))
+    transcript = f"{filler} The ramen broth simmers for twelve hours. {filler} Best served with soft eggs."
+
+    # Short text is left alone, long text keeps the matching sentences in order
+    assert trim_passage("Ramen at noon.", query, 50) == "Ramen at noon."
+    trimmed = trim_passage(transcript, query, 20)
+    assert trimmed == "The ramen broth simmers for twelve hours. ... Best served with soft eggs."
+    # Budget left over goes to the other sentences
+    trimmed = trim_passage(transcript, query, 60)
+    assert estimate_tokens(trimmed) <= 60
+    assert trimmed.index("Unrelated remark 0") < trimmed.index("ramen broth simmers") < trimmed.index("Best served")
+    # One sentence longer than the budget is cut
+    assert trim_passage("word " * 400, query, 20) == ("word " * 400)[:80]
+
+    ids = ["long", "short1", "short2", "long2"]
+    docs = [transcript, "Ramen place near the station.", "Broth recipe card.", transcript]
+    for budget in (120, 300, 1000, 5000):
+        packed = pack_context(ids, docs, query, budget=budget)
+        assert sum(estimate_tokens(text) for _, text in packed) <= budget
+        # Relevance order kept, and the first long transcript doesn't push the rest out
+        assert [doc_id for doc_id, _ in packed] == ids
+        assert dict(packed)["short1"] == docs[1]
+        assert "ramen broth simmers" in dict(packed)["long2"]
+
+    # Everything fits: nothing is trimmed
+    assert pack_context(ids, docs, query, budget=10000) == list(zip(ids, docs))
+    # Posts that would get less than MIN_PASSAGE_TOKENS are dropped
+    packed = pack_context(ids, docs, query, budget=MIN_PASSAGE_TOKENS + 10)
+    assert [doc_id for doc_id, _ in packed] == ["long"]
+
+@pytest.fixture
+def fake_pipeline(tmp_path, monkeypatch):
+    """
+    run_pipeline with downloads, processing and indexing replaced by recorders.
+    Processing runs inline; a post's content is the text of its content.txt.
+    """
+    from types import SimpleNamespace
+    from src import manifest, pipeline, rag_db
+
+    calls = SimpleNamespace(raw_dir=tmp_path / "raw", downloaded=[], processed=[], indexed=[], contents={})
+    monkeypatch.setattr(manifest, "MANIFEST_PATH", str(tmp_path / "manifest.sqlite"))
+    monkeypatch.setattr(manifest, "_conn", None)
+
+    def download_post(code, raw_dir):
+        calls.downloaded.append(code)
+        (Path(raw_dir) / code).mkdir(parents=True, exist_ok=True)
+        (Path(raw_dir) / code / "content.txt").write_text(f"caption of {code}", encoding='utf-8')
+        return True
+
+    def process_posts(codes, raw_dir, keyframe_budget):
+        calls.processed.extend(codes)
+        return [({"shortcode": code, "content": (Path(raw_dir) / code / "content.txt").read_text(encoding='utf-8'),
+                  "image_path": None}, None) for code in codes]
+
+    def ingest_documents(batch, batch_size=None, precompute=False):
+        calls.indexed.extend(r['shortcode'] for r in batch)
+        calls.contents.update((r['shortcode'], r['content']) for r in batch)
+        return len(batch)
+
+    monkeypatch.setattr(pipeline, "download_post", download_post)
+    monkeypatch.setattr(pipeline, "process_posts", process_posts)
+    monkeypatch.setattr(pipeline, "ProcessPoolExecutor", pipeline.InlineExecutor)
+    monkeypatch.setattr(rag_db, "ingest_documents", ingest_documents)
+    calls.run = lambda codes: pipeline.run_pipeline(codes, raw_dir=str(calls.raw_dir), download_workers=2,
+                                                    process_workers=1)
+    return calls
+
+def test_pipeline_resumes_after_download(fake_pipeline):
+    from src import manifest
+
+    for code in ("A", "D"):
+        (fake_pipeline.raw_dir / code).mkdir(parents=True)
+        (fake_pipeline.raw_dir / code / "content.txt").write_text(f"kept {code}", encoding='utf-8')
+    # A killed run had downloaded A, B and D; B's folder has been deleted since
+    manifest.mark(["A", "B", "D"], manifest.DOWNLOADED)
+    manifest.mark("C", manifest.LISTED)
+
+    stats = fake_pipeline.run(["A", "B", "C", "D"])
+    assert sorted(fake_pipeline.downloaded) == ["B", "C"]
+    assert sorted(fake_pipeline.processed) == ["A", "B", "C", "D"]
+    assert sorted(fake_pipeline.indexed) == ["A", "B", "C", "D"]
+    assert stats["downloaded"] == 4 and stats["indexed"] == 4
+    assert set(manifest.states(["A", "B", "C", "D"]).values()) == {manifest.INDEXED}
+
+def test_pipeline_resumes_after_processing(fake_pipeline):
+    from src import manifest
+    from src.processor import post_signature
+
+    raw = fake_pipeline.raw_dir
+    for code in ("A", "B"):
+        (raw / code).mkdir(parents=True)
+        (raw / code / "content.txt").write_text(f"caption of {code}", encoding='utf-8')
+        # Processed by a run that was killed before the index batch was written
+        manifest.mark(code, manifest.PROCESSED, result={"shortcode": code, "content": f"stored {code}"},
+                      result_key=post_signature(code, str(raw)))
+    assert manifest.processed_result("A", "other inputs") is None
+    # B's files changed since, so its stored result no longer applies
+    (raw / "B" / "content.txt").write_text("edited caption of B", encoding='utf-8')
+
+    fake_pipeline.run(["A", "B"])
+    assert fake_pipeline.downloaded == []
+    assert fake_pipeline.processed == ["B"]
+    assert fake_pipeline.contents == {"A": "stored A", "B": "edited caption of B"}
+    # Indexed posts don't keep their result
+    assert manifest.processed_result("A", post_signature("A", str(raw))) is None
+    assert set(manifest.states(["A", "B"]).values()) == {manifest.INDEXED}
+
+def test_empty_posts_are_not_retried(fake_pipeline):
+    from src import manifest
+
+    (fake_pipeline.raw_dir / "E").mkdir(parents=True)
+    (fake_pipeline.raw_dir / "E" / "content.txt").write_text("  ", encoding='utf-8')
+    posts = [{"shortcode": "E", "added_time": 1700000000}, {"shortcode": "F", "added_time": 1700000000}]
+    assert manifest.sync(posts, []) == ["E", "F"]
+    manifest.mark("E", manifest.DOWNLOADED)
+
+    stats = fake_pipeline.run(["E", "F"])
+    assert stats["empty"] == 1 and stats["failed"] == 0
+    assert manifest.states(["E", "F"]) == {"E": manifest.EMPTY, "F": manifest.INDEXED}
+    # Not a failure, and not listed again by the next run
+    assert manifest.failures() == []
+    assert manifest.sync(posts, ["F"]) == []
+    # Saved again: the export entry changed
+    posts[0]['added_time'] = 1800000000
+    assert manifest.sync(posts, ["F"]) == ["E"]
+    assert manifest.states(["E"]) == {"E": manifest.LISTED}
+
+def test_query_cache_eviction_and_invalidation(tmp_path, monkeypatch):
+    from src import query_cache, rag_db
+
+    # Size: least recently used goes first
+    cache = query_cache.LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and len(cache) == 2
+    # Total bytes
+    cache = query_cache.LRUCache(maxsize=10, max_bytes=10)
+    cache.put("x", b"123456")
+    cache.put("y", b"123456")
+    assert cache.get("x") is None and cache.bytes == 6
+    # Time to live
+    now = [1000.0]
+    with monkeypatch.context() as clock:
+        clock.setattr(query_cache.time, "monotonic", lambda: now[0])
+        cache = query_cache.LRUCache(ttl=60)
+        cache.put("q", "fresh")
+        now[0] += 59
+        assert cache.get("q") == "fresh"
+        now[0] += 2
+        assert cache.get("q") is None and len(cache) == 0
+
+    # Search results expire with the collection version, also when another process bumps it
+    monkeypatch.setattr(query_cache, "VERSION_PATH", str(tmp_path / "collection_version"))
+    monkeypatch.setattr(query_cache, "results_cache", query_cache.LRUCache())
+    searches = []
+
+    def query_hybrid(query_text, n_results=5, where=None):
+        searches.append(query_text)
+        return {"ids": [[f"hit {len(searches)}"]]}
+    monkeypatch.setattr(rag_db, "query_hybrid", query_hybrid)
+    first = rag_db.query_similar("pasta", collapse=False)
+    first['ids'][0].append("changed by the caller")
+    assert rag_db.query_similar("pasta", collapse=False) == {"ids": [["hit 1"]]}
+    assert len(searches) == 1
+    assert query_cache.bump_collection_version() == 1
+    assert rag_db.query_similar("pasta", collapse=False) == {"ids": [["hit 2"]]}
+    assert rag_db.query_similar("pasta", n_results=3, collapse=False) == {"ids": [["hit 3"]]}
+
+    # A summary is reused only for the same model, query, posts and prompt
+    monkeypatch.setattr(query_cache, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite"))
+    monkeypatch.setattr(query_cache, "_llm_conn", None)
+    query_cache.put_summary("llama3", "pasta", ["A", "B"], "prompt", "answer")
+    assert query_cache.get_summary("llama3", "pasta", ["A", "B"], "prompt") == "answer"
+    for changed in (("mistral", "pasta", ["A", "B"], "prompt"), ("llama3", "ramen", ["A", "B"], "prompt"),
+                    ("llama3", "pasta", ["B", "A"], "prompt"), ("llama3", "pasta", ["A", "B"], "re-indexed text")):
+        assert query_cache.get_summary(*changed) is None
+
+def test_hybrid_fusion_and_lexical_replacement(tmp_path, monkeypatch):
+    from src import lexical, rag_db, vector_store
+
+    monkeypatch.setattr(lexical, "LEXICAL_PATH", str(tmp_path / "lexical.sqlite"))
+    monkeypatch.setattr(lexical, "_conn", None)
+    monkeypatch.setattr(rag_db, "embed_query", lambda text: [1.0, 0.0, 0.0])
+    texts = {"P1": "harbour sunset walk", "P2": "coffee place downtown", "P3": "museum opening hours",
+             "P4": "tonkotsu ramen recipe"}
+    store = vector_store.NumpyCollection(tmp_path / "store")
+    # Dense ranking P1, P2, P3, P4
+    store.upsert(ids=[f"{code}#0" for code in texts], documents=list(texts.values()),
+                 metadatas=[{"shortcode": code, "modality": "caption", "section": 0, "chunk": 0} for code in texts],
+                 embeddings=[[1.0, 0.1, 0.0], [1.0, 0.4, 0.0], [1.0, 0.8, 0.0], [0.2, 1.0, 0.0]])
+    monkeypatch.setattr(rag_db, "_collection", store)
+    lexical.upsert_documents(texts.items())
+
+    k = rag_db.RRF_K
+    results = rag_db.query_hybrid("ramen", n_results=4)
+    # Only P4 matches the keyword: last by vector, first once fused
+    assert results['ids'][0] == ["P4", "P1", "P2", "P3"]
+    assert results['scores'][0][0] == pytest.approx(1 / (k + 4) + 1 / (k + 1))
+    assert results['scores'][0][1] == pytest.approx(1 / (k + 1))
+    assert results['documents'][0][0] == "tonkotsu ramen recipe"
+
+    # Re-indexing replaces a post's keyword text instead of adding to it
+    lexical.upsert_documents([("P4", "tonkotsu broth recipe"), ("P2", "ramen and coffee downtown")])
+    assert lexical.count() == 4
+    assert [code for code, _ in lexical.search("ramen")] == ["P2"]
+    assert rag_db.query_hybrid("ramen", n_results=2)['ids'][0] == ["P2", "P1"]
+
+def test_manifest_states(tmp_path, monkeypatch):
+    from src import manifest
+
+    monkeypatch.setattr(manifest, "MANIFEST_PATH", str(tmp_path / "manifest.sqlite"))
+    monkeypatch.setattr(manifest, "_conn", None)
+    posts = [{"shortcode": "A", "added_time": 1700000000, "collections": ["Recipes"], "kind": "reel"},
+             {"shortcode": "B", "added_time": 1600000000, "collections": [], "kind": "post"},
+             {"shortcode": "C", "added_time": None, "collections": ["Travel", "Recipes"]}]
+
+    # New posts are listed, the index decides what is already done
+    assert manifest.sync(posts, ["C"]) == ["A", "B"]
+    assert manifest.states(["A", "B", "C"]) == {"A": manifest.LISTED, "B": manifest.LISTED, "C": manifest.INDEXED}
+    assert manifest.collections() == ["Recipes", "Travel"]
+    assert manifest.years() == [2023, 2020]
+
+    manifest.mark(["A", "B"], manifest.DOWNLOADED)
+    manifest.mark("B", manifest.FAILED, "processing error: boom")
+    assert manifest.failures() == [("B", "processing error: boom")]
+    # A sync keeps the state and reason of posts still waiting
+    assert manifest.sync(posts, ["C"]) == ["A", "B"]
+    assert manifest.states(["A"]) == {"A": manifest.DOWNLOADED}
+    assert manifest.failures() == [("B", "processing error: boom")]
+
+    # A state change clears the reason
+    manifest.mark("B", manifest.DOWNLOADED)
+    assert manifest.failures() == []
+    manifest.mark("B", manifest.FAILED, "download failed: 404")
+    assert manifest.sync(posts, ["B", "C"]) == ["A"]
+    assert manifest.failures() == []
+    # Indexed, then gone from the index (e.g. the DB was reset)
+    assert manifest.sync(posts, []) == ["A", "B", "C"]
+    counts = manifest.summary()
+    assert counts[manifest.LISTED] == 2 and counts[manifest.DOWNLOADED] == 1 and sum(counts.values()) == 3
+
+def test_media_cache_keeps_empty_results(tmp_path, monkeypatch):
+    from src import media_cache
+
+    monkeypatch.setattr(media_cache, "CACHE_PATH", str(tmp_path / "media_cache.sqlite"))
+    monkeypatch.setattr(media_cache, "_conn", None)
+    clip = tmp_path / "clip.mp4"
+    clip.write_bytes(b"no speech in here")
+    runs = []
+
+    def compute(value):
+        def run():
+            runs.append(value)
+            return value
+        return run
+
+    # No speech, nothing read, undecodable: computed once, then served from the cache
+    for kind, value in (("vad_segments", []), ("transcript", ""), ("phash", None)):
+        assert media_cache.cached(kind, clip, "model-1", compute(value)) == value
+        assert media_cache.cached(kind, clip, "model-1", compute("recomputed")) == value
+    assert runs == [[], "", None]
+    # A different model is a different result
+    assert media_cache.cached("phash", clip, "model-2", compute(7)) == 7
+    assert media_cache.cache_get("phash", media_cache.file_hash(clip), "model-3") is None
+
+def test_speech_audio_merges_segments():
+    import numpy as np
+    from src.audio import SAMPLE_RATE, speech_audio
+
+    audio = np.arange(10 * SAMPLE_RATE, dtype=np.float32)
+    at = lambda seconds: int(seconds * SAMPLE_RATE)
+    # Padded by 0.2 s: the first two overlap and merge, the third stays apart
+    out = speech_audio(audio, [(6.0, 7.0), (1.0, 2.0), (2.3, 3.0)], padding=0.2, gap=0.3)
+    first, gap, second = out[:at(2.4)], out[at(2.4):at(2.7)], out[at(2.7):]
+    assert out.dtype == np.float32 and len(out) == at(2.4) + at(0.3) + at(1.4)
+    assert first[0] == at(0.8) and first[-1] == at(3.2) - 1
+    assert not gap.any()
+    assert second[0] == at(5.8) and second[-1] == at(7.2) - 1
+    # Clipped to the audio, nothing left without segments
+    out = speech_audio(audio, [(0.1, 0.5), (9.9, 12.0)], padding=0.2, gap=0.3)
+    assert out[0] == 0 and out[-1] == len(audio) - 1
+    assert len(speech_audio(audio, [])) == 0
+
+def test_keyframe_budget_and_line_dedupe(tmp_path):
+    import cv2
+    import numpy as np
+    from src.keyframes import dedupe_lines, select_keyframes
+
+    # Three scenes of 30 frames: red, green, blue
+    path = tmp_path / "clip.avi"
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 30, (64, 48))
+    for colour in ((0, 0, 255), (0, 255, 0), (255, 0, 0)):
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        frame[:] = colour
+        for _ in range(30):
+            writer.write(frame)
+    writer.release()
+
+    scene = lambda frame: int(np.argmax(frame.reshape(-1, 3).mean(axis=0)))
+    # Budget left over: repeats of a scene aren't spent on it
+    frames = select_keyframes(path, max_frames=6)
+    assert sorted(scene(f) for _, f in frames) == [0, 1, 2]
+    assert [pos for pos, _ in frames] == sorted(pos for pos, _ in frames)
+    # Budget smaller than the scenes: still distinct frames, never more than asked
+    frames = select_keyframes(path, max_frames=2)
+    assert len(frames) == 2 and len({scene(f) for _, f in frames}) == 2
+    assert select_keyframes(tmp_path / "missing.mp4") == []
+
+    # Overlays repeated across frames are kept once; a longer version replaces a shorter one
+    texts = ["SALE 50%", "  sale   50% ", "", "Follow @shop", "SALE 50% today only", "follow @shop"]
+    assert dedupe_lines(texts) == ["Follow @shop", "SALE 50% today only"]
+
+@pytest.fixture
+def scratch_index(tmp_path, monkeypatch):
+    """
+    rag_db writing to a NumPy collection, keyword index and collection version
+    under tmp_path. The collection's embedding function records each call.
+    """
+    from src import lexical, query_cache, rag_db, vector_store
+
+    calls = []
+
+    def embed(texts):
+        calls.append(len(texts))
+        return [[1.0, float(len(t)), float(n)] for n, t in enumerate(texts)]
+
+    monkeypatch.setattr(query_cache, "VERSION_PATH", str(tmp_path / "collection_version"))
+    monkeypatch.setattr(lexical, "LEXICAL_PATH", str(tmp_path / "lexical.sqlite"))
+    monkeypatch.setattr(lexical, "_conn", None)
+    store = vector_store.NumpyCollection(tmp_path / "store", embedding_function=embed)
+    monkeypatch.setattr(rag_db, "_collection", store)
+    store.embed_calls = calls
+    return store
+
+def test_ingest_documents_batches(scratch_index, monkeypatch):
+    from src import lexical, query_cache, rag_db
+
+    posts = [{"shortcode": f"P{n}", "content": f"caption {n}\n[Image Text]: slide {n}", "image_path": None}
+             for n in range(5)]
+    posts.insert(2, {"shortcode": "EMPTY", "content": "  ", "image_path": None})
+    # One upsert (and embedding call) per batch of posts; empty posts are skipped
+    assert rag_db.ingest_documents(posts, batch_size=2) == 5
+    assert scratch_index.embed_calls == [4, 4, 2]
+    assert query_cache.collection_version() == 1
+    assert scratch_index.count() == 10 and lexical.count() == 5
+    assert scratch_index.get(where={"shortcode": "P3"}, include=["documents"])['documents'] == ["caption 3", "slide 3"]
+
+    # Re-ingesting replaces a post's chunks; precomputed embeddings bypass the collection's function
+    embedded = []
+
+    def embed_documents(texts, batch_size=None):
+        embedded.append(len(texts))
+        return [[1.0, 0.0, 0.0]] * len(texts)
+    monkeypatch.setattr(rag_db, "embed_documents", embed_documents)
+    assert rag_db.ingest_documents([{"shortcode": "P3", "content": "only a caption", "image_path": None}],
+                                   precompute=True) == 1
+    assert embedded == [1] and scratch_index.embed_calls == [4, 4, 2]
+    assert scratch_index.count() == 9
+    assert scratch_index.get(where={"shortcode": "P3"}, include=["documents"])['documents'] == ["only a caption"]
+    assert query_cache.collection_version() == 2
+
+def test_ingest_buffer_flushes_full_batches(scratch_index):
+    from src import query_cache, rag_db
+
+    buffer = rag_db.IngestBuffer(batch_size=3)
+    post = lambda n: {"shortcode": f"P{n}", "content": f"caption {n}", "image_path": None}
+    # Nothing is written until a batch is full
+    assert [buffer.add(post(n)) for n in range(3)] == [0, 0, 3]
+    assert len(buffer) == 0 and scratch_index.count() == 3
+    assert [buffer.add(post(n)) for n in range(3, 5)] == [0, 0]
+    assert len(buffer) == 2 and scratch_index.count() == 3
+    # flush() writes the partial batch (end of run, checkpoint, Ctrl-C)
+    assert buffer.flush() == 2 and len(buffer) == 0
+    assert buffer.flush() == 0
+    assert scratch_index.count() == 5 and scratch_index.embed_calls == [3, 2]
+    assert query_cache.collection_version() == 2
+
+def test_run_log_is_kept_while_another_run_holds_the_lock(tmp_path):
+    import subprocess
+
+    env = {**os.environ, "PYTHONPATH": os.getcwd(), "INSTARAG_VECTOR_BACKEND": "numpy"}
+    log = tmp_path / "pipeline.log"
+    log.write_text("output of the run in progress\n")
+    # Started the way the app starts it: stdout appended to the log
+    start = lambda: subprocess.run([sys.executable, "-m", "src.pipeline", "run", "--export", "missing.json",
+                                    "--log", str(log)], cwd=tmp_path, env=env,
+                                   stdout=open(log, 'a'), stderr=subprocess.STDOUT).returncode
+
+    holder = subprocess.Popen(
+        [sys.executable, "-c", "import sys; from src import manifest\n"
+                               "with manifest.run_lock():\n    print('locked', flush=True); sys.stdin.read()"],
+        cwd=tmp_path, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        assert start() == 1
+        text = log.read_text()
+        assert text.startswith("output of the run in progress\n") and "already in progress" in text
+    finally:
+        holder.stdin.close()
+        holder.wait()
+
+    # The run holding the lock starts a fresh log (how it ends depends on the installed vector store)
+    start()
+    text = log.read_text()
+    assert "output of the run in progress" not in text and "Found 0 posts" in text
+
+def test_query_chunks_widens_the_window(tmp_path, monkeypatch):
+    from src import rag_db, vector_store
+
+    monkeypatch.setattr(rag_db, "embed_query", lambda text: [1.0, 0.0, 0.0])
+    store = vector_store.NumpyCollection(tmp_path / "store")
+    # A long transcript whose 40 chunks are all closer than the next post
+    long_ids = [f"LONG#{n}" for n in range(40)]
+    store.upsert(ids=long_ids + ["B#0", "C#0"],
+                 metadatas=[{"shortcode": "LONG"}] * 40 + [{"shortcode": "B"}, {"shortcode": "C"}],
+                 embeddings=[[1.0, 0.01 * n, 0.0] for n in range(40)] + [[1.0, 1.0, 0.0], [1.0, 2.0, 0.0]])
+    monkeypatch.setattr(rag_db, "_collection", store)
+
+    assert [code for code, _, _ in rag_db.query_chunks("q", n_results=3)] == ["LONG", "B", "C"]
+    # Fewer posts than asked for when the collection runs out
+    assert [code for code, _, _ in rag_db.query_chunks("q", n_results=5)] == ["LONG", "B", "C"]
+    assert [code for code, _, _ in rag_db.query_chunks("q", n_results=1)] == ["LONG"]
+
 if __name__ == "__main__":
     test_pipeline()